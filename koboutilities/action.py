@@ -9,6 +9,7 @@ import calendar
 import os
 import threading
 import time
+from dataclasses import dataclass
 from pathlib import Path
 from typing import TYPE_CHECKING, Callable, Literal, cast
 
@@ -31,9 +32,11 @@ from .features import (
     booksnotindb,
     cleanimages,
     covers,
+    coverstorage,
     database,
     duplicateshelves,
     getshelves,
+    highlights,
     locations,
     manageseries,
     metadata,
@@ -41,6 +44,7 @@ from .features import (
     readingstatus,
     relatedbooks,
     removeannotations,
+    syncshelves,
     toc,
 )
 from .utils import debug, get_icon, is_device_view, set_plugin_icon_resources, show_help
@@ -77,6 +81,30 @@ KOBO_EPOCH_CONF_NAME = "epoch.conf"
 load_translations()
 
 
+@dataclass(frozen=True)
+class MenuState:
+    # Everything the enabled state and visibility of the menu items depend on
+    has_device: bool
+    is_device_view: bool
+    is_kobotouch: bool = False
+    supports_series: bool = False
+    supports_related_books: bool = False
+    is_db_copied: bool = False
+    driver_name: str = ""
+
+
+@dataclass
+class MenuItem:
+    action: QAction
+    tooltip: str | None
+    is_library_action: bool
+    is_device_action: bool
+    is_no_device_action: bool
+    is_supported: Callable[[MenuState], bool]
+    not_supported_reason: str
+    is_visible: Callable[[MenuState], bool]
+
+
 class KoboUtilitiesAction(InterfaceAction):
     interface_action_base_plugin: ActionKoboUtilities
     qaction: QAction
@@ -104,6 +132,9 @@ class KoboUtilitiesAction(InterfaceAction):
         self.library_actions_map = []
         self.no_device_actions_map = []
         self.menu_actions = {}
+        self.menu_items: dict[str, MenuItem] = {}
+        self.menu_state: MenuState | None = None
+        self.configure_driver_action: QAction | None = None
 
         # Assign our menu to this action and an icon
         self.qaction.setMenu(self.menu)
@@ -215,9 +246,93 @@ class KoboUtilitiesAction(InterfaceAction):
                     self.load_resources,
                 )
 
+            if (
+                cfg.plugin_prefs.setRelatedBooksOptionsStore.updateOnConnect
+                and self.device.supports_series
+                and self.device.driver.fwversion < (4, 4, 0)
+            ):
+                debug("About to update related books")
+                relatedbooks.auto_set_related_books(
+                    self.device, self.gui, cast("Dispatcher", self.Dispatcher)
+                )
+
+            if cfg.plugin_prefs.highlightArchive.harvestOnConnect:
+                debug("About to add highlights to the archive")
+                highlights.auto_harvest_highlights(
+                    self.device, self.gui, cast("Dispatcher", self.Dispatcher)
+                )
+
         self.rebuild_menus()
 
     def rebuild_menus(self) -> None:
+        """
+        Bring the menu up to date with the connected device and the current
+        view. The actions and their shortcuts are only created the first time,
+        after that only their enabled state, tooltips and visibility change,
+        and only when something they depend on has changed.
+        """
+        with self.menus_lock:
+            if not self.menu_items:
+                self._build_menus()
+            state = self._get_menu_state()
+            if state == self.menu_state:
+                return
+            debug("menu state:", state)
+            self.menu_state = state
+            for item in self.menu_items.values():
+                self._update_menu_item(item, state)
+            if self.configure_driver_action is not None:
+                self.configure_driver_action.setText(
+                    _("&Configure current driver") + " - " + state.driver_name
+                )
+            self.set_toolbar_button_tooltip()
+
+    def _get_menu_state(self) -> MenuState:
+        device = self.device
+        # The driver only has to be looked up when it is shown in the menu
+        driver_name = (
+            self.device_driver_name if self.configure_driver_action is not None else ""
+        )
+        if device is None:
+            return MenuState(
+                has_device=False,
+                is_device_view=is_device_view(self.gui),
+                driver_name=driver_name,
+            )
+        return MenuState(
+            has_device=True,
+            is_device_view=is_device_view(self.gui),
+            is_kobotouch=device.is_kobotouch,
+            supports_series=device.supports_series,
+            supports_related_books=device.driver.fwversion < (4, 4, 0),
+            is_db_copied=device.is_db_copied,
+            driver_name=driver_name,
+        )
+
+    def _update_menu_item(self, item: MenuItem, state: MenuState) -> None:
+        if not state.has_device and not item.is_no_device_action:
+            tooltip = _("No device connected")
+            enabled = False
+        elif state.has_device and not item.is_supported(state):
+            tooltip = item.not_supported_reason
+            enabled = False
+        elif state.is_device_view and not item.is_device_action:
+            tooltip = _("Only supported in library view")
+            enabled = False
+        elif not state.is_device_view and not item.is_library_action:
+            tooltip = _("Only supported in device view")
+            enabled = False
+        else:
+            tooltip = item.tooltip
+            enabled = True
+
+        action = item.action
+        action.setToolTip(tooltip or "")
+        action.setStatusTip(tooltip or "")
+        action.setEnabled(enabled)
+        action.setVisible(item.is_visible(state))
+
+    def _build_menus(self) -> None:
         def menu_wrapper(
             func: Callable[
                 [KoboDevice, ui.Main, Dispatcher, LoadResources],
@@ -236,365 +351,412 @@ class KoboUtilitiesAction(InterfaceAction):
 
             return wrapper
 
-        with self.menus_lock:
-            # Show the config dialog
-            # The config dialog can also be shown from within
-            # Preferences->Plugins, which is why the do_user_config
-            # method is defined on the base plugin class
-            self.menu.clear()
-            for action in self.menu_actions.values():
-                self.gui.keyboard.unregister_shortcut(
-                    action.calibre_shortcut_unique_name
-                )
-                # starting in calibre 2.10.0, actions are registers at
-                # the top gui level for OSX' benefit.
-                self.gui.removeAction(action)
-            self.menu_actions = {}
-            self.device_actions_map = []
-            self.library_actions_map = []
-            self.no_device_actions_map = []
-
-            device = self.device
-            self.menu.setToolTipsVisible(True)
-            self.set_toolbar_button_tooltip()
-
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Set reader font for selected books"),
-                unique_name="Set reader font for selected books",
-                shortcut_name=_("Set reader font for selected books"),
-                image="embed-fonts.png",
-                triggered=menu_wrapper(reader.set_reader_fonts),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and device.is_kobotouch,
-            )
-
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Remove reader font for selected books"),
-                unique_name="Remove reader font for selected books",
-                shortcut_name=_("Remove reader font for selected books"),
-                triggered=menu_wrapper(reader.remove_reader_fonts),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and device.is_kobotouch,
-            )
-
-            self.menu.addSeparator()
+        # Show the config dialog
+        # The config dialog can also be shown from within
+        # Preferences->Plugins, which is why the do_user_config
+        # method is defined on the base plugin class
+        self.menu.setToolTipsVisible(True)
+
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Set reader font for selected books"),
+            unique_name="Set reader font for selected books",
+            shortcut_name=_("Set reader font for selected books"),
+            image="embed-fonts.png",
+            triggered=menu_wrapper(reader.set_reader_fonts),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("Update &metadata in device library"),
-                unique_name="Update metadata in device library",
-                shortcut_name=_("Update metadata in device library"),
-                image="metadata.png",
-                triggered=menu_wrapper(metadata.update_metadata),
-                is_library_action=True,
-            )
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Remove reader font for selected books"),
+            unique_name="Remove reader font for selected books",
+            shortcut_name=_("Remove reader font for selected books"),
+            triggered=menu_wrapper(reader.remove_reader_fonts),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Change reading status in device library"),
-                unique_name="Change reading status in device library",
-                shortcut_name=_("Change reading status in device library"),
-                triggered=menu_wrapper(readingstatus.change_reading_status),
-                is_device_action=True,
-            )
+        self.menu.addSeparator()
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Manage series information in device library"),
-                unique_name="Manage series information in device library",
-                shortcut_name=_("Manage series information in device library"),
-                triggered=menu_wrapper(manageseries.manage_series_on_device),
-                is_device_action=True,
-                is_supported=device is not None and device.supports_series,
-            )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Update &metadata in device library"),
+            unique_name="Update metadata in device library",
+            shortcut_name=_("Update metadata in device library"),
+            image="metadata.png",
+            triggered=menu_wrapper(metadata.update_metadata),
+            is_library_action=True,
+        )
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Store/restore reading positions"),
-                unique_name="Store/restore reading positions",
-                shortcut_name=_("Store/restore reading positions"),
-                image="bookmarks.png",
-                triggered=menu_wrapper(locations.handle_bookmarks),
-                is_library_action=True,
-            )
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Change reading status in device library"),
+            unique_name="Change reading status in device library",
+            shortcut_name=_("Change reading status in device library"),
+            triggered=menu_wrapper(readingstatus.change_reading_status),
+            is_device_action=True,
+        )
 
-            self.menu.addSeparator()
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Update ToC for selected books"),
-                image="toc.png",
-                unique_name="Update ToC for selected books",
-                shortcut_name=_("Update ToC for selected books"),
-                triggered=menu_wrapper(toc.update_book_toc_on_device),
-                is_library_action=True,
-            )
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Manage series information in device library"),
+            unique_name="Manage series information in device library",
+            shortcut_name=_("Manage series information in device library"),
+            triggered=menu_wrapper(manageseries.manage_series_on_device),
+            is_device_action=True,
+            is_supported=lambda state: state.supports_series,
+        )
 
-            self.menu.addSeparator()
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Upload covers for selected books"),
-                unique_name="Upload covers for selected books",
-                shortcut_name=_("Upload covers for selected books"),
-                image="default_cover.png",
-                triggered=menu_wrapper(covers.upload_covers),
-                is_library_action=True,
-            )
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Remove covers for selected books"),
-                unique_name="Remove covers for selected books",
-                shortcut_name=_("Remove covers for selected books"),
-                triggered=menu_wrapper(covers.remove_covers),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and device.is_kobotouch,
-            )
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Store/restore reading positions"),
+            unique_name="Store/restore reading positions",
+            shortcut_name=_("Store/restore reading positions"),
+            image="bookmarks.png",
+            triggered=menu_wrapper(locations.handle_bookmarks),
+            is_library_action=True,
+        )
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Clean images directory of extra cover images"),
-                unique_name="Clean images directory of extra cover images",
-                shortcut_name=_("Clean images directory of extra cover images"),
-                triggered=menu_wrapper(cleanimages.clean_images_dir),
-                is_library_action=True,
-                is_device_action=True,
-            )
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Open cover image directory"),
-                unique_name="Open cover image directory",
-                shortcut_name=_("Open cover image directory"),
-                triggered=menu_wrapper(covers.open_cover_image_directory),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and device.is_kobotouch,
-            )
-            self.menu.addSeparator()
+        self.menu.addSeparator()
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Update ToC for selected books"),
+            image="toc.png",
+            unique_name="Update ToC for selected books",
+            shortcut_name=_("Update ToC for selected books"),
+            triggered=menu_wrapper(toc.update_book_toc_on_device),
+            is_library_action=True,
+        )
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("Get collections from device"),
-                unique_name="Get collections from device",
-                shortcut_name=_("Get collections from device"),
-                image="catalog.png",
-                triggered=menu_wrapper(getshelves.get_shelves_from_device),
-                is_library_action=True,
-                is_supported=device is not None and device.is_kobotouch,
-            )
-            if device is not None and device.driver.fwversion < (4, 4, 0):
-                self.create_menu_item_ex(
-                    self.menu,
-                    _("Set related books"),
-                    unique_name="Set related books",
-                    shortcut_name=_("Set related books"),
-                    triggered=menu_wrapper(relatedbooks.set_related_books),
-                    is_library_action=True,
-                    is_device_action=True,
-                    is_supported=device.supports_series,
-                )
-            self.menu.addSeparator()
-            self.create_menu_item_ex(
-                self.menu,
-                _("Copy annotation for selected book"),
-                image="edit_input.png",
-                unique_name="Copy annotation for selected book",
-                shortcut_name=_("Copy annotation for selected book"),
-                triggered=menu_wrapper(annotations.getAnnotationForSelected),
-                is_library_action=True,
-            )
-            self.create_menu_item_ex(
-                self.menu,
-                _("Back up annotation file"),
-                unique_name="Back up annotation file",
-                shortcut_name=_("Back up annotation file"),
-                triggered=menu_wrapper(annotations.backup_annotation_files),
-                is_library_action=True,
-            )
-            self.create_menu_item_ex(
-                self.menu,
-                _("Remove annotation files"),
-                unique_name="Remove annotation files",
-                shortcut_name=_("Remove annotation files"),
-                triggered=menu_wrapper(removeannotations.remove_annotations_files),
-                is_library_action=True,
-                is_device_action=True,
-            )
+        self.menu.addSeparator()
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Upload covers for selected books"),
+            unique_name="Upload covers for selected books",
+            shortcut_name=_("Upload covers for selected books"),
+            image="default_cover.png",
+            triggered=menu_wrapper(covers.upload_covers),
+            is_library_action=True,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Remove covers for selected books"),
+            unique_name="Remove covers for selected books",
+            shortcut_name=_("Remove covers for selected books"),
+            triggered=menu_wrapper(covers.remove_covers),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
 
-            self.menu.addSeparator()
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Clean images directory of extra cover images"),
+            unique_name="Clean images directory of extra cover images",
+            shortcut_name=_("Clean images directory of extra cover images"),
+            triggered=menu_wrapper(cleanimages.clean_images_dir),
+            is_library_action=True,
+            is_device_action=True,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Analyze cover image storage"),
+            unique_name="Analyze cover image storage",
+            shortcut_name=_("Analyze cover image storage"),
+            triggered=menu_wrapper(coverstorage.analyze_cover_storage),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Open cover image directory"),
+            unique_name="Open cover image directory",
+            shortcut_name=_("Open cover image directory"),
+            triggered=menu_wrapper(covers.open_cover_image_directory),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
+        self.menu.addSeparator()
+
+        self.create_menu_item_ex(
+            self.menu,
+            _("Get collections from device"),
+            unique_name="Get collections from device",
+            shortcut_name=_("Get collections from device"),
+            image="catalog.png",
+            triggered=menu_wrapper(getshelves.get_shelves_from_device),
+            is_library_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Sync collections with device"),
+            unique_name="Sync collections with device",
+            shortcut_name=_("Sync collections with device"),
+            triggered=menu_wrapper(syncshelves.sync_shelves_with_device),
+            is_library_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Set related books"),
+            unique_name="Set related books",
+            shortcut_name=_("Set related books"),
+            triggered=menu_wrapper(relatedbooks.set_related_books),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: (
+                state.supports_series and state.supports_related_books
+            ),
+            is_visible=lambda state: state.supports_related_books,
+        )
+        self.menu.addSeparator()
+        self.create_menu_item_ex(
+            self.menu,
+            _("Copy annotation for selected book"),
+            image="edit_input.png",
+            unique_name="Copy annotation for selected book",
+            shortcut_name=_("Copy annotation for selected book"),
+            triggered=menu_wrapper(annotations.getAnnotationForSelected),
+            is_library_action=True,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Back up annotation file"),
+            unique_name="Back up annotation file",
+            shortcut_name=_("Back up annotation file"),
+            triggered=menu_wrapper(annotations.backup_annotation_files),
+            is_library_action=True,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Remove annotation files"),
+            unique_name="Remove annotation files",
+            shortcut_name=_("Remove annotation files"),
+            triggered=menu_wrapper(removeannotations.remove_annotations_files),
+            is_library_action=True,
+            is_device_action=True,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Add highlights to archive"),
+            unique_name="Add highlights to archive",
+            shortcut_name=_("Add highlights to archive"),
+            triggered=menu_wrapper(highlights.harvest_highlights),
+            is_library_action=True,
+            is_device_action=True,
+        )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Search highlights") + "...",
+            unique_name="Search highlights",
+            shortcut_name=_("Search highlights"),
+            image="search.png",
+            triggered=lambda _: highlights.search_highlights(
+                self.gui, self.load_resources
+            ),
+            is_library_action=True,
+            is_device_action=True,
+            is_no_device_action=True,
+        )
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("Show books not in the device database"),
-                unique_name="Show books not in the device database",
-                shortcut_name=_("Show books not in the device database"),
-                triggered=menu_wrapper(booksnotindb.show_books_not_in_database),
-                is_device_action=True,
-            )
+        self.menu.addSeparator()
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("Refresh the list of books on the device"),
-                unique_name="Refresh the list of books on the device",
-                shortcut_name=_("Refresh the list of books on the device"),
-                image="view-refresh.png",
-                triggered=lambda _: self.gui.device_detected(True, KOBOTOUCH),
-                is_library_action=True,
-                is_device_action=True,
-            )
-            databaseMenu = cast("QMenu", self.menu.addMenu(_("Database")))
-            databaseMenu.setIcon(get_icon("images/database.png"))
-            self.create_menu_item_ex(
-                databaseMenu,
-                _("Block analytics events"),
-                unique_name="Block analytics events",
-                shortcut_name=_("Block analytics events"),
-                triggered=menu_wrapper(analytics.block_analytics),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and device.is_kobotouch,
-            )
-            databaseMenu.addSeparator()
-            self.create_menu_item_ex(
-                databaseMenu,
-                _("Fix duplicate collections"),
-                unique_name="Fix duplicate collections",
-                shortcut_name=_("Fix duplicate collections"),
-                triggered=menu_wrapper(duplicateshelves.fix_duplicate_shelves),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and device.is_kobotouch,
-            )
-            self.create_menu_item_ex(
-                databaseMenu,
-                _("Check the device database"),
-                unique_name="Check the device database",
-                shortcut_name=_("Check the device database"),
-                image="ok.png",
-                triggered=menu_wrapper(database.check_device_database),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and not device.is_db_copied,
-                not_supported_reason=_("Not supported for this connection mode"),
-            )
-            self.create_menu_item_ex(
-                databaseMenu,
-                _("Compress the device database"),
-                unique_name="Compress the device database",
-                shortcut_name=_("Compress the device database"),
-                image="images/vise.png",
-                triggered=menu_wrapper(database.vacuum_device_database),
-                is_library_action=True,
-                is_device_action=True,
-                is_supported=device is not None and not device.is_db_copied,
-                not_supported_reason=_("Not supported for this connection mode"),
-            )
-            self.create_menu_item_ex(
-                databaseMenu,
-                _("Back up device database"),
-                unique_name="Back up device database",
-                shortcut_name=_("Back up device database"),
-                image="images/databases.png",
-                triggered=menu_wrapper(backup.backup_device_database),
-                is_library_action=True,
-                is_device_action=True,
-            )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Show books not in the device database"),
+            unique_name="Show books not in the device database",
+            shortcut_name=_("Show books not in the device database"),
+            triggered=menu_wrapper(booksnotindb.show_books_not_in_database),
+            is_device_action=True,
+        )
 
-            self.menu.addSeparator()
-            self.create_menu_item_ex(
-                self.menu,
-                _("Set time on device"),
-                unique_name="Set time on device",
-                shortcut_name=_("Set time on device"),
-                image="images/clock.png",
-                tooltip=_(
-                    "Creates a file on the device which will be used to set the time when the device is disconnected."
-                ),
-                triggered=menu_wrapper(set_time_on_device),
-                is_library_action=True,
-                is_device_action=True,
-            )
+        self.create_menu_item_ex(
+            self.menu,
+            _("Refresh the list of books on the device"),
+            unique_name="Refresh the list of books on the device",
+            shortcut_name=_("Refresh the list of books on the device"),
+            image="view-refresh.png",
+            triggered=lambda _: self.gui.device_detected(True, KOBOTOUCH),
+            is_library_action=True,
+            is_device_action=True,
+        )
+        databaseMenu = cast("QMenu", self.menu.addMenu(_("Database")))
+        databaseMenu.setIcon(get_icon("images/database.png"))
+        self.create_menu_item_ex(
+            databaseMenu,
+            _("Block analytics events"),
+            unique_name="Block analytics events",
+            shortcut_name=_("Block analytics events"),
+            triggered=menu_wrapper(analytics.block_analytics),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
+        databaseMenu.addSeparator()
+        self.create_menu_item_ex(
+            databaseMenu,
+            _("Fix duplicate collections"),
+            unique_name="Fix duplicate collections",
+            shortcut_name=_("Fix duplicate collections"),
+            triggered=menu_wrapper(duplicateshelves.fix_duplicate_shelves),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: state.is_kobotouch,
+        )
+        self.create_menu_item_ex(
+            databaseMenu,
+            _("Check the device database"),
+            unique_name="Check the device database",
+            shortcut_name=_("Check the device database"),
+            image="ok.png",
+            triggered=menu_wrapper(database.check_device_database),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: not state.is_db_copied,
+            not_supported_reason=_("Not supported for this connection mode"),
+        )
+        self.create_menu_item_ex(
+            databaseMenu,
+            _("Compress the device database"),
+            unique_name="Compress the device database",
+            shortcut_name=_("Compress the device database"),
+            image="images/vise.png",
+            triggered=menu_wrapper(database.vacuum_device_database),
+            is_library_action=True,
+            is_device_action=True,
+            is_supported=lambda state: not state.is_db_copied,
+            not_supported_reason=_("Not supported for this connection mode"),
+        )
+        self.create_menu_item_ex(
+            databaseMenu,
+            _("Back up device database"),
+            unique_name="Back up device database",
+            shortcut_name=_("Back up device database"),
+            image="images/databases.png",
+            triggered=menu_wrapper(backup.backup_device_database),
+            is_library_action=True,
+            is_device_action=True,
+        )
+        self.create_menu_item_ex(
+            databaseMenu,
+            _("List backups"),
+            unique_name="List backups",
+            shortcut_name=_("List backups"),
+            image="images/databases.png",
+            triggered=menu_wrapper(backup.list_backups),
+            is_library_action=True,
+            is_device_action=True,
+        )
+        self.create_menu_item_ex(
+            databaseMenu,
+            _("Restore incremental backup") + "...",
+            unique_name="Restore incremental backup",
+            shortcut_name=_("Restore incremental backup"),
+            image="images/databases.png",
+            triggered=menu_wrapper(backup.restore_backup_from_store),
+            is_library_action=True,
+            is_device_action=True,
+        )
 
-            self.menu.addSeparator()
-
-            def create_configure_driver_item(menu: QMenu, menu_text: str):
-                self.create_menu_item_ex(
-                    menu,
-                    menu_text,
-                    unique_name="Configure driver",
-                    shortcut_name=_("Configure driver"),
-                    image="config.png",
-                    triggered=self.configure_device,
-                    is_library_action=True,
-                    is_device_action=True,
-                    is_no_device_action=True,
-                )
+        self.menu.addSeparator()
+        self.create_menu_item_ex(
+            self.menu,
+            _("Set time on device"),
+            unique_name="Set time on device",
+            shortcut_name=_("Set time on device"),
+            image="images/clock.png",
+            tooltip=_(
+                "Creates a file on the device which will be used to set the time when the device is disconnected."
+            ),
+            triggered=menu_wrapper(set_time_on_device),
+            is_library_action=True,
+            is_device_action=True,
+        )
 
-            # Calibre 8 integrates the functionality of the KoboTouchExtended driver
-            # and disables the plugin, so there is no need to switch between drivers.
-            # Cast the version literal because of https://github.com/microsoft/pyright/issues/7733
-            if calibre_version >= cast("tuple[int, int, int]", (8, 0, 0)):
-                create_configure_driver_item(self.menu, _("&Configure driver..."))
-            else:
-                driver_menu = self.menu.addMenu(_("Driver"))
-                assert driver_menu is not None
-                create_configure_driver_item(
-                    driver_menu,
-                    _("&Configure current driver") + " - " + self.device_driver_name,
-                )
-                self.create_menu_item_ex(
-                    driver_menu,
-                    _("Switch between main and extended driver"),
-                    unique_name="Switch between main and extended driver",
-                    shortcut_name=_("Switch between main and extended driver"),
-                    image="config.png",
-                    triggered=self.switch_device_driver,
-                    is_library_action=True,
-                    is_device_action=True,
-                    is_no_device_action=True,
-                )
-            self.menu.addSeparator()
+        self.menu.addSeparator()
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Customize plugin") + "...",  # shortcut=False,
-                unique_name="Customize plugin",
-                shortcut_name=_("Customize plugin"),
+        def create_configure_driver_item(menu: QMenu, menu_text: str) -> QAction:
+            return self.create_menu_item_ex(
+                menu,
+                menu_text,
+                unique_name="Configure driver",
+                shortcut_name=_("Configure driver"),
                 image="config.png",
-                triggered=self.show_configuration,
+                triggered=self.configure_device,
                 is_library_action=True,
                 is_device_action=True,
                 is_no_device_action=True,
             )
 
-            self.create_menu_item_ex(
-                self.menu,
-                _("&Help"),  # shortcut=False,
-                unique_name="Help",
-                shortcut_name=_("Help"),
-                image="help.png",
-                triggered=lambda _: show_help(self.load_resources),
-                is_library_action=True,
-                is_device_action=True,
-                is_no_device_action=True,
+        # Calibre 8 integrates the functionality of the KoboTouchExtended driver
+        # and disables the plugin, so there is no need to switch between drivers.
+        # Cast the version literal because of https://github.com/microsoft/pyright/issues/7733
+        if calibre_version >= cast("tuple[int, int, int]", (8, 0, 0)):
+            create_configure_driver_item(self.menu, _("&Configure driver..."))
+        else:
+            driver_menu = self.menu.addMenu(_("Driver"))
+            assert driver_menu is not None
+            # The name of the current driver is added when the menu is updated
+            self.configure_driver_action = create_configure_driver_item(
+                driver_menu, _("&Configure current driver")
             )
-
             self.create_menu_item_ex(
-                self.menu,
-                _("&About plugin"),  # shortcut=False,
-                image="images/icon.png",
-                unique_name="About KoboUtilities",
-                shortcut_name=_("About KoboUtilities"),
-                triggered=self.about,
+                driver_menu,
+                _("Switch between main and extended driver"),
+                unique_name="Switch between main and extended driver",
+                shortcut_name=_("Switch between main and extended driver"),
+                image="config.png",
+                triggered=self.switch_device_driver,
                 is_library_action=True,
                 is_device_action=True,
                 is_no_device_action=True,
             )
+        self.menu.addSeparator()
+
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Customize plugin") + "...",  # shortcut=False,
+            unique_name="Customize plugin",
+            shortcut_name=_("Customize plugin"),
+            image="config.png",
+            triggered=self.show_configuration,
+            is_library_action=True,
+            is_device_action=True,
+            is_no_device_action=True,
+        )
+
+        self.create_menu_item_ex(
+            self.menu,
+            _("&Help"),  # shortcut=False,
+            unique_name="Help",
+            shortcut_name=_("Help"),
+            image="help.png",
+            triggered=lambda _: show_help(self.load_resources),
+            is_library_action=True,
+            is_device_action=True,
+            is_no_device_action=True,
+        )
+
+        self.create_menu_item_ex(
+            self.menu,
+            _("&About plugin"),  # shortcut=False,
+            image="images/icon.png",
+            unique_name="About KoboUtilities",
+            shortcut_name=_("About KoboUtilities"),
+            triggered=self.about,
+            is_library_action=True,
+            is_device_action=True,
+            is_no_device_action=True,
+        )
 
-            self.gui.keyboard.finalize()
+        self.gui.keyboard.finalize()
 
     def about(self):
         # Get the about text from a file inside the plugin zip file
@@ -644,25 +806,10 @@ class KoboUtilitiesAction(InterfaceAction):
         is_library_action: bool = False,
         is_device_action: bool = False,
         is_no_device_action: bool = False,
-        is_supported: bool = True,
+        is_supported: Callable[[MenuState], bool] = lambda _state: True,
         not_supported_reason: str = _("Not supported for this device"),
+        is_visible: Callable[[MenuState], bool] = lambda _state: True,
     ) -> QAction:
-        if self.device is None and not is_no_device_action:
-            tooltip = _("No device connected")
-            enabled = False
-        elif self.device is not None and not is_supported:
-            tooltip = not_supported_reason
-            enabled = False
-        elif is_device_view(self.gui) and not is_device_action:
-            tooltip = _("Only supported in library view")
-            enabled = False
-        elif not is_device_view(self.gui) and not is_library_action:
-            tooltip = _("Only supported in device view")
-            enabled = False
-        else:
-            tooltip = tooltip
-            enabled = True
-
         orig_shortcut = shortcut
         kb = self.gui.keyboard
         if unique_name is None:
@@ -700,8 +847,18 @@ class KoboUtilitiesAction(InterfaceAction):
             ac.setCheckable(True)
             if is_checked:
                 ac.setChecked(True)
-        ac.setEnabled(enabled)
         self.menu_actions[shortcut_name] = ac
+        # The enabled state is set by rebuild_menus
+        self.menu_items[shortcut_name] = MenuItem(
+            action=ac,
+            tooltip=tooltip,
+            is_library_action=is_library_action,
+            is_device_action=is_device_action,
+            is_no_device_action=is_no_device_action,
+            is_supported=is_supported,
+            not_supported_reason=not_supported_reason,
+            is_visible=is_visible,
+        )
 
         if is_library_action:
             self.library_actions_map.append(shortcut_name)
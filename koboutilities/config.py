@@ -389,6 +389,7 @@ class BackupAnnotationsConfig(ConfigWrapper):
 
 class BackupOptionsStoreConfig(ConfigWrapper):
     backupCopiesToKeepSpin: int = 5
+    backupDeduplicate: bool = False
     backupDestDirectory: str = ""
     backupEachCOnnection: bool = False
     backupZipDatabase: bool = True
@@ -405,6 +406,12 @@ class CommonOptionsStoreConfig(ConfigWrapper):
     individualDeviceOptions: bool = False
 
 
+class CoverStorageConfig(ConfigWrapper):
+    prune_covers: bool = False
+    target_size_mb: int = 200
+    unread_months: int = 6
+
+
 class CoverUploadConfig(ConfigWrapper):
     blackandwhite: bool = False
     dithered_covers: bool = False
@@ -425,6 +432,10 @@ class GetShelvesOptionStoreConfig(ConfigWrapper):
     replaceShelves: bool = True
 
 
+class HighlightArchiveConfig(ConfigWrapper):
+    harvestOnConnect: bool = False
+
+
 class RemoveAnnotationsAction(enum.IntEnum):
     All = 0
     Selected = 1
@@ -449,6 +460,7 @@ class RelatedBooksType(enum.IntEnum):
 
 class SetRelatedBooksOptionsStoreConfig(ConfigWrapper):
     relatedBooksType: RelatedBooksType = RelatedBooksType.Series
+    updateOnConnect: bool = False
 
 
 class DeviceConfig(ConfigWrapper):
@@ -470,9 +482,11 @@ class PluginConfig(ConfigWrapper):
     backupOptionsStore: BackupOptionsStoreConfig
     cleanImagesDir: CleanImagesDirConfig
     commonOptionsStore: CommonOptionsStoreConfig
+    coverStorage: CoverStorageConfig
     coverUpload: CoverUploadConfig
     fixDuplicatesOptionsStore: FixDuplicatesOptionsStoreConfig
     getShelvesOptionStore: GetShelvesOptionStoreConfig
+    highlightArchive: HighlightArchiveConfig
     removeAnnotations: RemoveAnnotationsConfig
     removeCovers: RemoveCoversConfig
     setRelatedBooksOptionsStore: SetRelatedBooksOptionsStoreConfig
@@ -1457,6 +1471,23 @@ class DevicesTab(QWidget):
         )
         options_layout.addWidget(self.zip_database_checkbox, 2, 0, 1, 3)
 
+        self.deduplicate_checkbox = QCheckBox(_("Incremental backups"), self)
+        self.deduplicate_checkbox.setToolTip(
+            _(
+                "If checked, backups are kept in a shared backup store in the destination directory. Only the parts of the database and configuration files that changed since the previous backup are saved, which uses much less space when many copies are kept."
+            )
+        )
+        options_layout.addWidget(self.deduplicate_checkbox, 2, 3, 1, 2)
+
+        self.list_backups_button = QPushButton(_("List and compare backups..."), self)
+        self.list_backups_button.setToolTip(
+            _(
+                "Show the backups in the destination directory and compare the device databases in them."
+            )
+        )
+        self.list_backups_button.clicked.connect(self.list_backups_button_clicked)
+        options_layout.addWidget(self.list_backups_button, 3, 0, 1, 2)
+
         layout.addLayout(options_layout)
 
         self.toggle_backup_options_state(False)
@@ -1627,6 +1658,7 @@ class DevicesTab(QWidget):
             enabled and self.copies_to_keep_checkbox.isChecked()
         )
         self.zip_database_checkbox.setEnabled(enabled)
+        self.deduplicate_checkbox.setEnabled(enabled)
 
     def do_daily_backp_checkbox_clicked(self, checked: bool):
         enable_backup_options = (
@@ -1651,6 +1683,20 @@ class DevicesTab(QWidget):
     def copies_to_keep_checkbox_clicked(self, checked: bool):
         self.copies_to_keep_spin.setEnabled(checked)
 
+    def list_backups_button_clicked(self):
+        from .features import backup
+
+        dest_dir = self.dest_directory_edit.text()
+        if not dest_dir:
+            return
+        dlg = backup.ListBackupsDialog(
+            self,
+            self.plugin_action.load_resources,
+            backup.BackupCatalog(dest_dir, with_sizes=True),
+            self.plugin_action.device,
+        )
+        dlg.exec()
+
     def _get_dest_directory_name(self):
         path = choose_dir(
             self,
@@ -1677,6 +1723,7 @@ class DevicesTab(QWidget):
         self.backup_each_connection_checkbox.setChecked(backup_each_connection)
         self.dest_directory_edit.setText(backup_prefs.backupDestDirectory)
         self.zip_database_checkbox.setChecked(backup_prefs.backupZipDatabase)
+        self.deduplicate_checkbox.setChecked(backup_prefs.backupDeduplicate)
         if copies_to_keep == -1:
             self.copies_to_keep_checkbox.setChecked(False)
         else:
@@ -1693,6 +1740,7 @@ class DevicesTab(QWidget):
             self.backup_each_connection_checkbox.isChecked()
         )
         backup_prefs.backupZipDatabase = self.zip_database_checkbox.isChecked()
+        backup_prefs.backupDeduplicate = self.deduplicate_checkbox.isChecked()
         backup_prefs.backupDestDirectory = self.dest_directory_edit.text()
         backup_prefs.backupCopiesToKeepSpin = (
             self.copies_to_keep_spin.value()
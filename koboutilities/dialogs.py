@@ -6,12 +6,15 @@ __license__ = "GPL v3"
 __copyright__ = "2012-2020, David Forrester <davidfor@internode.on.net>"
 __docformat__ = "restructuredtext en"
 
+import datetime as dt
 from typing import TYPE_CHECKING, Any, Callable
 
 from calibre.gui2 import Application, error_dialog
 from calibre.gui2.dialogs.plugin_updater import SizePersistedDialog
 from calibre.utils.date import UNDEFINED_DATE, format_date, now
 from qt.core import (
+    QAbstractItemView,
+    QAbstractTableModel,
     QCheckBox,
     QComboBox,
     QDateTime,
@@ -20,10 +23,13 @@ from qt.core import (
     QGridLayout,
     QGroupBox,
     QHBoxLayout,
+    QHeaderView,
     QLabel,
+    QModelIndex,
     QProgressBar,
     QRadioButton,
     Qt,
+    QTableView,
     QTableWidgetItem,
     QVBoxLayout,
     QWidget,
@@ -33,7 +39,7 @@ from . import utils
 from .utils import debug
 
 if TYPE_CHECKING:
-    import datetime as dt
+    from typing import Iterable
 
     from calibre.devices.kobo.books import Book
     from qt.core import QIcon
@@ -359,6 +365,160 @@ class AuthorsTableWidgetItem(ReadOnlyTableWidgetItem):
         return NotImplemented
 
 
+class ResultsTableModel(QAbstractTableModel):
+    """
+    Read-only model for tables of results.
+
+    Each row is a tuple of plain values, one for each column, optionally
+    followed by values that aren't shown, such as sort keys or ids. Values
+    are only converted for display when the view asks for them, so no
+    objects are created for each cell and tables of any size open at once.
+    sort_columns maps a column to the value in the row to sort it by. The
+    check_column, if any, has a checkbox in each row.
+    """
+
+    def __init__(
+        self,
+        headers: list[str],
+        rows: list[tuple[Any, ...]],
+        sort_columns: dict[int, int] | None = None,
+        right_aligned_columns: Iterable[int] = (),
+        dimmed_columns: Iterable[int] = (),
+        check_column: int | None = None,
+        checked: bool = True,
+    ):
+        super().__init__()
+        self.headers = headers
+        self.rows = rows
+        self.sort_columns = sort_columns or {}
+        self.right_aligned_columns = frozenset(right_aligned_columns)
+        self.dimmed_columns = frozenset(dimmed_columns)
+        self.check_column = check_column
+        self.checked = [checked] * len(rows)
+        # Position of the shown rows in self.rows, changed when sorting
+        self.order = list(range(len(rows)))
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:  # noqa: B008
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:  # noqa: B008
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(
+        self,
+        section: int,
+        orientation: Qt.Orientation,
+        role: int = Qt.ItemDataRole.DisplayRole,
+    ) -> Any:
+        if (
+            orientation == Qt.Orientation.Horizontal
+            and role == Qt.ItemDataRole.DisplayRole
+        ):
+            return self.headers[section]
+        return None
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlag:
+        flags = Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled
+        if index.column() == self.check_column:
+            flags |= Qt.ItemFlag.ItemIsUserCheckable
+        return flags
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+        row = self.order[index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            value = self.rows[row][column]
+            if isinstance(value, dt.datetime):
+                return QDateTime(value)
+            return value
+        if role == Qt.ItemDataRole.CheckStateRole and column == self.check_column:
+            return (
+                Qt.CheckState.Checked if self.checked[row] else Qt.CheckState.Unchecked
+            )
+        if (
+            role == Qt.ItemDataRole.TextAlignmentRole
+            and column in self.right_aligned_columns
+        ):
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        if role == Qt.ItemDataRole.ForegroundRole and column in self.dimmed_columns:
+            return Qt.GlobalColor.darkGray
+        return None
+
+    def setData(
+        self, index: QModelIndex, value: Any, role: int = Qt.ItemDataRole.EditRole
+    ) -> bool:
+        if (
+            not index.isValid()
+            or index.column() != self.check_column
+            or role != Qt.ItemDataRole.CheckStateRole
+        ):
+            return False
+        self.checked[self.order[index.row()]] = (
+            Qt.CheckState(value) == Qt.CheckState.Checked
+        )
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def sort(
+        self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder
+    ) -> None:
+        if column < 0:
+            self.layoutAboutToBeChanged.emit()
+            self.order = list(range(len(self.rows)))
+            self.layoutChanged.emit()
+            return
+        key_column = self.sort_columns.get(column, column)
+
+        def sort_key(row: int) -> tuple[bool, Any]:
+            value = self.rows[row][key_column]
+            return value is None, value
+
+        self.layoutAboutToBeChanged.emit()
+        self.order.sort(key=sort_key, reverse=order == Qt.SortOrder.DescendingOrder)
+        self.layoutChanged.emit()
+
+    def set_all_checked(self, checked: bool) -> None:
+        self.checked = [checked] * len(self.rows)
+        if self.rows and self.check_column is not None:
+            self.dataChanged.emit(
+                self.index(0, self.check_column),
+                self.index(len(self.rows) - 1, self.check_column),
+                [Qt.ItemDataRole.CheckStateRole],
+            )
+
+    def checked_rows(self) -> list[tuple[Any, ...]]:
+        return [row for row, checked in zip(self.rows, self.checked) if checked]
+
+
+class ResultsTableView(QTableView):
+    def __init__(self, parent: QWidget):
+        super().__init__(parent)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.setAlternatingRowColors(True)
+        vert_header = self.verticalHeader()
+        assert vert_header is not None
+        vert_header.setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        vert_header.setDefaultSectionSize(24)
+        horiz_header = self.horizontalHeader()
+        assert horiz_header is not None
+        horiz_header.setStretchLastSection(True)
+
+    def set_results_model(self, model: ResultsTableModel) -> None:
+        self.setModel(model)
+        # Keep the order of the rows until a column is clicked
+        horiz_header = self.horizontalHeader()
+        assert horiz_header is not None
+        horiz_header.setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.setSortingEnabled(True)
+        self.selectRow(0)
+
+    def setMinimumColumnWidth(self, col: int, minimum: int):
+        if self.columnWidth(col) < minimum:
+            self.setColumnWidth(col, minimum)
+
+
 class ReadingStatusGroupBox(QGroupBox):
     def __init__(self, parent: QWidget):
         QGroupBox.__init__(self, parent)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import os
 import shutil
 from typing import TYPE_CHECKING, cast
@@ -26,11 +27,17 @@ from ..utils import debug
 if TYPE_CHECKING:
     from calibre.devices.kobo.books import Book
     from calibre.gui2 import ui
+    from calibre.gui2.device import DeviceJob
     from qt.core import QWidget
 
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
 
+# Number of books whose annotations are fetched in one device job
+ANNOTATIONS_CHUNK_SIZE = 25
+# Name of the file in the backup destination recording the backed up files
+ANNOTATIONS_BACKUP_MANIFEST = "KoboUtilitiesAnnotations.json"
+
 
 def getAnnotationForSelected(
     device: KoboDevice,
@@ -38,15 +45,17 @@ def getAnnotationForSelected(
     dispatcher: Dispatcher,
     load_resources: LoadResources,
 ) -> None:
-    del dispatcher, load_resources
+    del load_resources
     current_view = gui.current_view()
     if current_view is None or len(current_view.selectionModel().selectedRows()) == 0:
         return
 
-    _getAnnotationForSelected(device, gui)
+    _getAnnotationForSelected(device, gui, dispatcher)
 
 
-def _getAnnotationForSelected(device: KoboDevice, gui: ui.Main) -> None:
+def _getAnnotationForSelected(
+    device: KoboDevice, gui: ui.Main, dispatcher: Dispatcher
+) -> None:
     # Generate a path_map from selected ids
     def get_ids_from_selected_rows() -> list[int]:
         rows = gui.library_view.selectionModel().selectedRows()
@@ -54,18 +63,16 @@ def _getAnnotationForSelected(device: KoboDevice, gui: ui.Main) -> None:
             rows = range(gui.library_view.model().rowCount(QModelIndex()))
         return list(map(gui.library_view.model().id, rows))
 
-    def get_formats(_id: int) -> list[str]:
-        formats = db.formats(_id, index_is_id=True)
-        return [fmt.lower() for fmt in formats.split(",")]
-
     def generate_annotation_paths(
         ids: list[int],
     ) -> dict[int, dict[str, str | list[str]]]:
         # Generate path templates
         # Individual storage mount points scanned/resolved in driver.get_annotations()
+        device_books = utils.get_books_from_ids(ids, gui)
+        formats = db.new_api.all_field_for("formats", ids)
         path_map = {}
         for _id in ids:
-            paths = utils.get_device_paths_from_id(_id, gui)
+            paths = [book.path for book in device_books.get(_id, [])]
             debug("paths=", paths)
             if len(paths) > 0:
                 the_path = paths[0]
@@ -73,11 +80,12 @@ def _getAnnotationForSelected(device: KoboDevice, gui: ui.Main) -> None:
                     len(os.path.splitext(paths[0])) > 1
                 ):  # No extension - is kepub
                     the_path = paths[1]
-                path_map[_id] = {"path": the_path, "fmts": get_formats(_id)}
+                path_map[_id] = {
+                    "path": the_path,
+                    "fmts": [fmt.lower() for fmt in formats.get(_id) or ()],
+                }
         return path_map
 
-    annotationText = []
-
     if gui.current_view() is not gui.library_view:
         error_dialog(
             gui,
@@ -114,29 +122,97 @@ def _getAnnotationForSelected(device: KoboDevice, gui: ui.Main) -> None:
         )
         return
 
-    # Dispatch to the device get_annotations()
-    debug("path_map=", path_map)
-    bookmarked_books = device.driver.get_annotations(path_map)
-    debug("bookmarked_books=", bookmarked_books)
-
-    for id_ in bookmarked_books:
-        bm = device.driver.UserAnnotation(
-            bookmarked_books[id_][0], bookmarked_books[id_][1]
+    fetcher = AnnotationsFetcher(device, gui, dispatcher, path_map)
+    fetcher.fetch_next_chunk()
+
+
+class AnnotationsFetcher:
+    """
+    Gets the annotations of the books in path_map from the device a chunk of
+    books at a time. Each chunk is a device job, and the annotations are
+    added to the viewer as soon as the job has finished. No more chunks are
+    fetched once the viewer has been closed.
+    """
+
+    def __init__(
+        self,
+        device: KoboDevice,
+        gui: ui.Main,
+        dispatcher: Dispatcher,
+        path_map: dict[int, dict[str, str | list[str]]],
+    ) -> None:
+        self.device = device
+        self.gui = gui
+        self.dispatcher = dispatcher
+        self.path_map = path_map
+        self.pending_ids = list(path_map)
+        self.annotations_found = 0
+
+        new_api = gui.library_view.model().db.new_api
+        self.titles = new_api.all_field_for("title", self.pending_ids)
+        self.authors = new_api.all_field_for("authors", self.pending_ids)
+        self.viewer = ViewLog(
+            "Kobo Touch Annotation",
+            _("Getting annotations from the device..."),
+            parent=gui,
+        )
+        self.viewer.setWindowTitle(self._progress_title())
+        self.viewer.show()
+
+    def fetch_next_chunk(self) -> None:
+        if not self.pending_ids or not self.viewer.isVisible():
+            self.viewer.setWindowTitle("Kobo Touch Annotation")
+            if self.annotations_found == 0:
+                self.viewer.tb.setHtml(_("No annotations found"))
+            return
+
+        chunk = self.pending_ids[:ANNOTATIONS_CHUNK_SIZE]
+        del self.pending_ids[:ANNOTATIONS_CHUNK_SIZE]
+        # Dispatch to the device get_annotations()
+        self.gui.device_manager.annotations(
+            self.dispatcher(self._chunk_fetched),
+            {book_id: self.path_map[book_id] for book_id in chunk},
         )
 
-        mi = db.get_metadata(id_, index_is_id=True)
-
-        user_notes_soup = device.driver.generate_annotation_html(bm.value)
-        book_heading = "<b>%(title)s</b> by <b>%(author)s</b>" % {
-            "title": mi.title,
-            "author": authors_to_string(mi.authors),
-        }
-        bookmark_html = str(user_notes_soup.div)
-        debug("bookmark_html:", bookmark_html)
-        annotationText.append(book_heading + bookmark_html)
-
-    d = ViewLog("Kobo Touch Annotation", "\n<hr/>\n".join(annotationText), parent=gui)
-    d.exec()
+    def _chunk_fetched(self, job: DeviceJob) -> None:
+        if job.failed:
+            self.gui.job_exception(job, dialog_title=_("Failed to get annotations"))
+            self.pending_ids = []
+            self.fetch_next_chunk()
+            return
+
+        bookmarked_books = job.result
+        debug("bookmarked_books=", bookmarked_books)
+        driver = self.device.driver
+        annotationText = []
+        for id_ in bookmarked_books:
+            bm = driver.UserAnnotation(
+                bookmarked_books[id_][0], bookmarked_books[id_][1]
+            )
+            user_notes_soup = driver.generate_annotation_html(bm.value)
+            book_heading = "<b>%(title)s</b> by <b>%(author)s</b>" % {
+                "title": self.titles.get(id_),
+                "author": authors_to_string(self.authors.get(id_) or ()),
+            }
+            bookmark_html = str(user_notes_soup.div)
+            debug("bookmark_html:", bookmark_html)
+            annotationText.append(book_heading + bookmark_html)
+
+        if annotationText:
+            if self.annotations_found == 0:
+                self.viewer.tb.clear()
+            else:
+                annotationText.insert(0, "")
+            self.viewer.tb.append("\n<hr/>\n".join(annotationText))
+            self.annotations_found += len(bookmarked_books)
+        self.viewer.setWindowTitle(self._progress_title())
+        self.fetch_next_chunk()
+
+    def _progress_title(self) -> str:
+        done = len(self.path_map) - len(self.pending_ids)
+        return "Kobo Touch Annotation - " + _("{0} of {1} books").format(
+            done, len(self.path_map)
+        )
 
 
 def backup_annotation_files(
@@ -175,12 +251,12 @@ def backup_annotation_files(
         ]
 
     debug("dest_path=", dest_path)
-    annotations_found, no_annotations, kepubs, count_books = _backup_annotation_files(
-        device, books, dest_path
+    annotations_found, no_annotations, kepubs, count_books, files_copied = (
+        _backup_annotation_files(device, books, dest_path)
     )
     result_message = _(
-        "Annotations backup summary:\n\tBooks with annotations={0}\n\tBooks without annotations={1}\n\tKobo epubs={2}\n\tTotal books={3}"
-    ).format(annotations_found, no_annotations, kepubs, count_books)
+        "Annotations backup summary:\n\tBooks with annotations={0}\n\tBooks without annotations={1}\n\tKobo epubs={2}\n\tTotal books={3}\n\tNew or changed annotation files={4}"
+    ).format(annotations_found, no_annotations, kepubs, count_books, files_copied)
     info_dialog(
         gui,
         _("Kobo Utilities") + _(" - Annotations backup"),
@@ -194,6 +270,7 @@ def _backup_annotation_files(device: KoboDevice, books: list[Book], dest_path: s
     kepubs = 0
     no_annotations = 0
     count_books = 0
+    files_copied = 0
 
     debug("self.device.path='%s'" % (device.path))
     kepub_dir = cast("str", device.driver.normalize_path(".kobo/kepub/"))
@@ -203,47 +280,89 @@ def _backup_annotation_files(device: KoboDevice, books: list[Book], dest_path: s
     )
     annotations_ext = ".annot"
 
+    manifest = _read_annotations_backup_manifest(dest_path)
+    backup_dirs = set()
     for book in books:
         count_books += 1
 
         for book_path in cast("list[str]", book.paths):
             relative_path = book_path.replace(device.path, "")
-            annotation_file = device.driver.normalize_path(
-                annotations_dir + relative_path + annotations_ext
-            )
-            assert annotation_file is not None
-            debug(
-                "kepub title='%s' annotation_file='%s'" % (book.title, annotation_file)
-            )
+            # Kobo epubs don't have annotation files
             if relative_path.startswith(kepub_dir):
                 debug("kepub title='%s' book_path='%s'" % (book.title, book_path))
                 kepubs += 1
-            elif os.path.exists(annotation_file):
-                debug("book_path='%s'" % (book_path))
-                backup_file = device.driver.normalize_path(
-                    dest_path + "/" + relative_path + annotations_ext
-                )
-                assert backup_file is not None
-                debug("backup_file='%s'" % (backup_file))
-                d, p = os.path.splitdrive(backup_file)
-                debug("d='%s' p='%s'" % (d, p))
-                backup_path = os.path.dirname(str(backup_file))
-                try:
-                    os.makedirs(backup_path)
-                except OSError:
-                    debug("path exists: backup_path='%s'" % (backup_path))
-                shutil.copyfile(annotation_file, backup_file)
-                annotations_found += 1
-            else:
+                continue
+
+            annotation_file = cast(
+                "str",
+                device.driver.normalize_path(
+                    annotations_dir + relative_path + annotations_ext
+                ),
+            )
+            debug("title='%s' annotation_file='%s'" % (book.title, annotation_file))
+            try:
+                stat = os.stat(annotation_file)
+            except FileNotFoundError:
                 debug("book_path='%s'" % (book_path))
                 no_annotations += 1
+                continue
+
+            annotations_found += 1
+            manifest_key = relative_path.replace("\\", "/") + annotations_ext
+            file_state = [stat.st_size, stat.st_mtime_ns]
+            backup_file = cast(
+                "str",
+                device.driver.normalize_path(
+                    dest_path + "/" + relative_path + annotations_ext
+                ),
+            )
+            if manifest.get(manifest_key) == file_state and os.path.exists(backup_file):
+                debug("unchanged since last backup: '%s'" % (annotation_file))
+                continue
+
+            debug("backup_file='%s'" % (backup_file))
+            backup_path = os.path.dirname(backup_file)
+            if backup_path not in backup_dirs:
+                os.makedirs(backup_path, exist_ok=True)
+                backup_dirs.add(backup_path)
+            shutil.copyfile(annotation_file, backup_file)
+            manifest[manifest_key] = file_state
+            files_copied += 1
+
+    if files_copied > 0:
+        _write_annotations_backup_manifest(dest_path, manifest)
 
     debug(
-        "Backup summary: annotations_found=%d, no_annotations=%d, kepubs=%d Total=%d"
-        % (annotations_found, no_annotations, kepubs, count_books)
+        "Backup summary: annotations_found=%d, no_annotations=%d, kepubs=%d Total=%d, copied=%d"
+        % (annotations_found, no_annotations, kepubs, count_books, files_copied)
     )
 
-    return (annotations_found, no_annotations, kepubs, count_books)
+    return (annotations_found, no_annotations, kepubs, count_books, files_copied)
+
+
+def _read_annotations_backup_manifest(dest_path: str) -> dict[str, list[int]]:
+    # Size and modification time of each annotation file when it was last
+    # backed up, by its path relative to the destination
+    manifest_path = os.path.join(dest_path, ANNOTATIONS_BACKUP_MANIFEST)
+    try:
+        with open(manifest_path, "rb") as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        debug("could not read manifest '%s': %s" % (manifest_path, e))
+        return {}
+    return manifest.get("files", {})
+
+
+def _write_annotations_backup_manifest(
+    dest_path: str, files: dict[str, list[int]]
+) -> None:
+    manifest_path = os.path.join(dest_path, ANNOTATIONS_BACKUP_MANIFEST)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump({"version": 1, "files": files}, manifest_file, indent=1)
+    os.replace(tmp_path, manifest_path)
 
 
 class BackupAnnotationsOptionsDialog(PluginDialog):
@@ -1,29 +1,217 @@
 from __future__ import annotations
 
 import datetime as dt
+import html
 import os
 import pickle
-import shutil
+import re
+from collections import defaultdict
 from dataclasses import dataclass
 from functools import partial
 from typing import TYPE_CHECKING
 from zipfile import ZIP_DEFLATED, ZipFile
 
-from calibre.gui2 import FileDialog
-from qt.core import QFileDialog
+import apsw
+from calibre import human_readable
+from calibre.gui2 import FileDialog, choose_dir, error_dialog, info_dialog
+from calibre.gui2.dialogs.message_box import ViewLog
+from qt.core import (
+    QAbstractItemView,
+    QDialogButtonBox,
+    QFileDialog,
+    QInputDialog,
+    Qt,
+    QTableWidget,
+    QVBoxLayout,
+)
 
 from .. import utils
-from ..utils import debug
+from ..dialogs import (
+    DateTableWidgetItem,
+    ImageTitleLayout,
+    PluginDialog,
+    ReadOnlyTableWidgetItem,
+)
+from ..utils import DeviceDatabaseConnection, debug
+from . import backupdiff
+from .backupstore import (
+    BACKUP_STORE_DIR_NAME,
+    MANIFEST_EXT,
+    BackupStore,
+    BackupStoreError,
+)
 
 if TYPE_CHECKING:
     from calibre.gui2 import ui
     from calibre.gui2.device import DeviceJob
+    from qt.core import QWidget
 
     from .. import config as cfg
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
 
 
+# Backup names are <database>-<device name>-<serial number>-<timestamp>, with
+# "_CORRUPT" added if the backup failed the integrity check. Device names can
+# contain "-", serial numbers and timestamps can't.
+BACKUP_NAME_RE = re.compile(
+    r"^(?P<database>KoboReader|BookReader)-(?P<device_name>.+)"
+    r"-(?P<serial_number>[^-]+)-(?P<timestamp>\d{8}-\d{6})(?P<corrupt>_CORRUPT)?$"
+)
+BACKUP_TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+BACKUP_KIND_DATABASE = "sqlite"
+BACKUP_KIND_ZIP = "zip"
+BACKUP_KIND_STORE = "store"
+
+
+@dataclass(frozen=True)
+class BackupRecord:
+    database: str
+    device_name: str
+    serial_number: str
+    timestamp: str
+    kind: str
+    path: str
+    size: int | None
+    corrupt: bool
+
+    @property
+    def name(self) -> str:
+        return (
+            f"{self.database}-{self.device_name}-{self.serial_number}-{self.timestamp}"
+        )
+
+    @property
+    def date(self) -> dt.datetime:
+        return dt.datetime.strptime(self.timestamp, BACKUP_TIMESTAMP_FORMAT)  # noqa: DTZ007
+
+
+class BackupCatalog:
+    """
+    All backups in a backup directory. The backup directory and the backup
+    store are each listed once and every later query is answered from the
+    parsed records.
+    """
+
+    def __init__(self, dest_dir: str, with_sizes: bool = False) -> None:
+        self.dest_dir = dest_dir
+        self.store = BackupStore(os.path.join(dest_dir, BACKUP_STORE_DIR_NAME))
+        self.records: list[BackupRecord] = []
+        self._scan(
+            dest_dir,
+            {".sqlite": BACKUP_KIND_DATABASE, ".zip": BACKUP_KIND_ZIP},
+            with_sizes,
+        )
+        # Incremental backups only have a manifest, their size is shared
+        self._scan(self.store.manifests_path, {MANIFEST_EXT: BACKUP_KIND_STORE}, False)
+        debug("dest_dir=%s, backups found=%d" % (dest_dir, len(self.records)))
+
+    def _scan(self, path: str, kinds: dict[str, str], with_sizes: bool) -> None:
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                kind = kinds.get(os.path.splitext(entry.name)[1])
+                if kind is not None and entry.is_file():
+                    self.add(
+                        entry.path,
+                        kind,
+                        entry.stat().st_size if with_sizes else None,
+                    )
+
+    def add(self, path: str, kind: str, size: int | None = None) -> None:
+        """
+        Add a backup file to the catalog. Files that aren't named like a
+        backup are ignored.
+        """
+        match = BACKUP_NAME_RE.match(os.path.splitext(os.path.basename(path))[0])
+        if match is None:
+            return
+        self.records.append(
+            BackupRecord(
+                database=match.group("database"),
+                device_name=match.group("device_name"),
+                serial_number=match.group("serial_number"),
+                timestamp=match.group("timestamp"),
+                kind=kind,
+                path=path,
+                size=size,
+                corrupt=match.group("corrupt") is not None,
+            )
+        )
+
+    def backup_sets(
+        self, device_name: str | None = None, serial_number: str | None = None
+    ) -> list[list[BackupRecord]]:
+        """
+        Group the records into backups, oldest first. All files written by
+        one backup run share the device, serial number and timestamp.
+        """
+        sets: dict[tuple[str, str, str, bool], list[BackupRecord]] = defaultdict(list)
+        for record in self.records:
+            if device_name is not None and record.device_name != device_name:
+                continue
+            if serial_number is not None and record.serial_number != serial_number:
+                continue
+            sets[
+                (
+                    record.timestamp,
+                    record.device_name,
+                    record.serial_number,
+                    record.corrupt,
+                )
+            ].append(record)
+        return [sets[key] for key in sorted(sets)]
+
+    def has_backup_on(
+        self, device_name: str, serial_number: str, date: dt.date
+    ) -> bool:
+        day = date.strftime("%Y%m%d-")
+        return any(
+            record.database == "KoboReader"
+            and not record.corrupt
+            and record.timestamp.startswith(day)
+            for record in self.backup_records(device_name, serial_number)
+        )
+
+    def backup_records(
+        self, device_name: str, serial_number: str
+    ) -> list[BackupRecord]:
+        return [
+            record
+            for record in self.records
+            if record.device_name == device_name
+            and record.serial_number == serial_number
+        ]
+
+    def remove_old_backups(
+        self, device_name: str, serial_number: str, copies_to_keep: int
+    ) -> None:
+        """
+        Keep the newest copies_to_keep backups of the device and remove all
+        files of the older ones. Corrupt backups are never removed.
+        """
+        backup_sets = [
+            backup_set
+            for backup_set in self.backup_sets(device_name, serial_number)
+            if not backup_set[0].corrupt
+        ]
+        debug("backups=%d, copies_to_keep=%d" % (len(backup_sets), copies_to_keep))
+        stored_backups = []
+        for backup_set in backup_sets[: max(len(backup_sets) - copies_to_keep, 0)]:
+            for record in backup_set:
+                if record.kind == BACKUP_KIND_STORE:
+                    stored_backups.append(record.name)
+                else:
+                    debug("removing backup file:", record.path)
+                    os.unlink(record.path)
+                self.records.remove(record)
+        if stored_backups:
+            self.store.remove_backups(stored_backups)
+
+
 @dataclass
 class DatabaseBackupJobOptions:
     backup_store_config: cfg.BackupOptionsStoreConfig
@@ -57,8 +245,117 @@ def backup_device_database(
         return
 
     debug("backup file selected=", backup_file)
-    source_file = device.db_path
-    shutil.copyfile(source_file, backup_file)
+    snapshot_database(device.db_path, backup_file).close()
+
+
+def restore_backup_from_store(
+    device: KoboDevice,
+    gui: ui.Main,
+    dispatcher: Dispatcher,
+    load_resources: LoadResources,
+) -> None:
+    del dispatcher, load_resources
+    dest_dir = device.backup_config.backupDestDirectory
+    store = BackupStore(os.path.join(dest_dir, BACKUP_STORE_DIR_NAME))
+    backup_names = store.backup_names()
+    if not backup_names:
+        info_dialog(
+            gui,
+            _("Kobo Utilities") + " - " + _("Restore backup"),
+            _("There are no incremental backups in {0}.").format(dest_dir),
+            show=True,
+        )
+        return
+
+    backup_name, ok = QInputDialog.getItem(
+        gui,
+        _("Restore backup"),
+        _("Choose the backup to restore:"),
+        list(reversed(backup_names)),
+        0,
+        False,
+    )
+    if not ok:
+        return
+    target_dir = choose_dir(
+        gui,
+        "Kobo Utilities plugin:restore backup destination",
+        _("Choose where to put the restored files"),
+    )
+    if not target_dir:
+        return
+
+    debug("restoring backup=%s to %s" % (backup_name, target_dir))
+    try:
+        restored_files = store.restore(backup_name, target_dir)
+    except (BackupStoreError, OSError) as e:
+        error_dialog(
+            gui,
+            _("Restore backup"),
+            _("The backup could not be restored."),
+            det_msg=str(e),
+            show=True,
+        )
+        return
+    info_dialog(
+        gui,
+        _("Kobo Utilities") + " - " + _("Restore backup"),
+        _("{0} files were restored to {1}.").format(len(restored_files), target_dir),
+        show=True,
+    )
+
+
+def list_backups(
+    device: KoboDevice,
+    gui: ui.Main,
+    dispatcher: Dispatcher,
+    load_resources: LoadResources,
+) -> None:
+    del dispatcher
+    dest_dir = device.backup_config.backupDestDirectory
+    if not dest_dir:
+        error_dialog(
+            gui,
+            _("List backups"),
+            _("No backup destination directory has been set."),
+            show=True,
+        )
+        return
+    catalog = BackupCatalog(dest_dir, with_sizes=True)
+    dlg = ListBackupsDialog(gui, load_resources, catalog, device)
+    dlg.show()
+
+
+def _database_backup_record(backup_set: list[BackupRecord]) -> BackupRecord | None:
+    # Prefer the plain database file, it can be attached without loading it
+    for kind in (BACKUP_KIND_DATABASE, BACKUP_KIND_ZIP, BACKUP_KIND_STORE):
+        for record in backup_set:
+            if record.database == "KoboReader" and record.kind == kind:
+                return record
+    return None
+
+
+def diff_backups(
+    old_backup: BackupRecord, new_backup: BackupRecord | None, database_path: str
+) -> list[backupdiff.TableDiff]:
+    """
+    Compare the database of two backups. If new_backup is None, the backup
+    is compared with the database at database_path instead.
+    """
+    connection = backupdiff.open_diff_connection()
+    try:
+        backupdiff.attach_backup(connection, backupdiff.OLD_SCHEMA, old_backup.path)
+        if new_backup is not None:
+            backupdiff.attach_backup(connection, backupdiff.NEW_SCHEMA, new_backup.path)
+        else:
+            snapshot = snapshot_database(database_path, ":memory:")
+            backupdiff.attach_database_content(
+                connection, backupdiff.NEW_SCHEMA, snapshot.serialize("main")
+            )
+            snapshot.close()
+        return backupdiff.diff_databases(connection)
+    finally:
+        connection.close()
 
 
 def auto_backup_device_database(
@@ -126,6 +423,57 @@ def _device_database_backup_completed(job: DeviceJob, gui: ui.Main):
         return
 
 
+def snapshot_database(database_path: str, destination: str) -> apsw.Connection:
+    """
+    Copy a database with SQLite's online backup API and return a connection
+    to the copy. The destination can be a file path or ":memory:".
+
+    All pages are copied in a single step while holding the device database
+    lock, so the copy is consistent even if the driver is using the database.
+    """
+    source = DeviceDatabaseConnection(database_path, database_path, is_db_copied=False)
+    snapshot = apsw.Connection(destination)
+    try:
+        with source, snapshot.backup("main", source, "main") as backup:
+            backup.step(-1)
+    except Exception:
+        snapshot.close()
+        raise
+    finally:
+        source.close()
+    return snapshot
+
+
+def _read_file(file_path: str) -> bytes | None:
+    try:
+        with open(file_path, "rb") as f:
+            return f.read()
+    except OSError as e:
+        debug("file '%s' not added. Exception was: %s" % (file_path, e))
+        return None
+
+
+def _config_files(device_path: str) -> list[tuple[str, str]]:
+    """
+    Return the configuration files that are backed up along with the
+    database, as (path, name in the backup) pairs.
+    """
+    kobo_dir = os.path.join(device_path, ".kobo")
+    config_files = [
+        (os.path.join(kobo_dir, "Kobo", "Kobo eReader.conf"), "Kobo eReader.conf"),
+        (os.path.join(kobo_dir, "version"), "version"),
+        (os.path.join(kobo_dir, "affiliate.conf"), "affiliate.conf"),
+    ]
+
+    ade_dir = os.path.join(device_path, ".adobe-digital-editions")
+    for root, _dirs, files in os.walk(ade_dir):
+        for fn in files:
+            absfn = os.path.join(root, fn)
+            zfn = os.path.relpath(absfn, device_path).replace(os.sep, "/")
+            config_files.append((absfn, zfn))
+    return config_files
+
+
 def device_database_backup_job(backup_options_raw: bytes):
     debug("start")
     backup_options: DatabaseBackupJobOptions = pickle.loads(backup_options_raw)  # noqa: S301
@@ -146,6 +494,7 @@ def device_database_backup_job(backup_options_raw: bytes):
     copies_to_keep = backup_options.backup_store_config.backupCopiesToKeepSpin
     do_daily_backup = backup_options.backup_store_config.doDailyBackp
     zip_database = backup_options.backup_store_config.backupZipDatabase
+    deduplicate = backup_options.backup_store_config.backupDeduplicate
     database_file = backup_options.database_file
     device_path = backup_options.device_path
     debug("copies_to_keep=", copies_to_keep)
@@ -153,36 +502,15 @@ def device_database_backup_job(backup_options_raw: bytes):
     bookreader_backup_file_template = "BookReader-{0}-{1}-{2}"
     bookreader_database_file = os.path.join(device_path, ".kobo", "BookReader.sqlite")
 
+    catalog = BackupCatalog(dest_dir)
+    store = catalog.store
+
     now = dt.datetime.now()  # noqa: DTZ005
-    backup_timestamp = now.strftime("%Y%m%d-%H%M%S")
-    import glob
-
-    if do_daily_backup:
-        backup_file_search = (
-            now.strftime(
-                backup_file_template.format(
-                    device_name, serial_number, "%Y%m%d-" + "[0-9]" * 6
-                )
-            )
-            + ".sqlite"
-        )
-        backup_file_search = (
-            now.strftime(
-                backup_file_template.format(
-                    device_name, serial_number, "%Y%m%d-" + "[0-9]" * 6
-                )
-            )
-            + ".*"
-        )
-        debug("backup_file_search=", backup_file_search)
-        backup_file_search = os.path.join(dest_dir, backup_file_search)
-        debug("backup_file_search=", backup_file_search)
-        backup_files = glob.glob(backup_file_search)
-        debug("backup_files=", backup_files)
-
-        if len(backup_files) > 0:
-            debug("Backup already done today")
-            return
+    backup_timestamp = now.strftime(BACKUP_TIMESTAMP_FORMAT)
+
+    if do_daily_backup and catalog.has_backup_on(device_name, serial_number, now):
+        debug("Backup already done today")
+        return
 
     backup_file_name = backup_file_template.format(
         device_name, serial_number, backup_timestamp
@@ -191,8 +519,15 @@ def device_database_backup_job(backup_options_raw: bytes):
     debug("backup_file_name=%s" % backup_file_name)
     debug("backup_file_path=%s" % backup_file_path)
     debug("database_file=%s" % database_file)
-    shutil.copyfile(database_file, backup_file_path)
+    # When zipping or using the backup store, the snapshot is kept in memory
+    # and written straight into the backup instead of going through a
+    # temporary copy on disk.
+    in_memory = zip_database or deduplicate
+    database_snapshot = snapshot_database(
+        database_file, ":memory:" if in_memory else backup_file_path
+    )
 
+    bookreader_snapshot = None
     bookreader_backup_file_path = None
     try:
         bookreader_backup_file_name = bookreader_backup_file_template.format(
@@ -204,114 +539,282 @@ def device_database_backup_job(backup_options_raw: bytes):
         debug("bookreader_backup_file_name=%s" % bookreader_backup_file_name)
         debug("bookreader_backup_file_path=%s" % bookreader_backup_file_path)
         debug("bookreader_database_file=%s" % bookreader_database_file)
-        shutil.copyfile(bookreader_database_file, bookreader_backup_file_path)
+        if not os.path.exists(bookreader_database_file):
+            raise FileNotFoundError(bookreader_database_file)
+        bookreader_snapshot = snapshot_database(
+            bookreader_database_file,
+            ":memory:" if in_memory else bookreader_backup_file_path,
+        )
     except Exception as e:
         debug(f"backup of database BookReader.sqlite failed. Exception: {e}")
-        bookreader_backup_file_path = None
 
     try:
-        check_result = utils.check_device_database(backup_file_path)
+        check_result = utils.check_database_integrity(database_snapshot)
         if check_result.split()[0] != "ok":
             debug("database is corrupt!")
             raise Exception(check_result)
     except:
-        debug("backup is corrupt - renaming file.")
-        filename = os.path.basename(backup_file_path)
-        filename, fileext = os.path.splitext(filename)
+        debug("backup is corrupt - saving it as a separate file.")
+        filename, fileext = os.path.splitext(os.path.basename(backup_file_path))
         corrupt_filename = filename + "_CORRUPT" + fileext
         corrupt_file_path = os.path.join(dest_dir, corrupt_filename)
         debug("backup_file_name=%s" % database_file)
         debug("corrupt_file_path=%s" % corrupt_file_path)
-        os.rename(backup_file_path, corrupt_file_path)
+        if in_memory:
+            with open(corrupt_file_path, "wb") as corrupt_file:
+                corrupt_file.write(database_snapshot.serialize("main"))
+        database_snapshot.close()
+        if bookreader_snapshot is not None:
+            bookreader_snapshot.close()
+        if not in_memory:
+            os.rename(backup_file_path, corrupt_file_path)
+            # Mark the BookReader copy as well, so it isn't counted as a backup
+            if bookreader_backup_file_path is not None and os.path.exists(
+                bookreader_backup_file_path
+            ):
+                bookreader_path, bookreader_ext = os.path.splitext(
+                    bookreader_backup_file_path
+                )
+                os.rename(
+                    bookreader_backup_file_path,
+                    bookreader_path + "_CORRUPT" + bookreader_ext,
+                )
         raise
 
-    # Create the zip file archive
-    config_backup_path = os.path.join(dest_dir, backup_file_name + ".zip")
-    debug("config_backup_path=%s" % config_backup_path)
-    with ZipFile(
-        config_backup_path, "w", compression=ZIP_DEFLATED
-    ) as config_backup_zip:
-        config_file = os.path.join(device_path, ".kobo", "Kobo", "Kobo eReader.conf")
-        backup_file(config_backup_zip, config_file)
+    if deduplicate:
+        backup_files_content = [
+            ("KoboReader.sqlite", database_snapshot.serialize("main"))
+        ]
+        if bookreader_snapshot is not None:
+            backup_files_content.append(
+                ("BookReader.sqlite", bookreader_snapshot.serialize("main"))
+            )
+        backup_files_content.extend(
+            (archive_name, content)
+            for file_path, archive_name in _config_files(device_path)
+            if (content := _read_file(file_path)) is not None
+        )
+        store.add_backup(backup_file_name, backup_files_content)
+        catalog.add(
+            os.path.join(store.manifests_path, backup_file_name + MANIFEST_EXT),
+            BACKUP_KIND_STORE,
+        )
+    else:
+        # Create the zip file archive
+        config_backup_path = os.path.join(dest_dir, backup_file_name + ".zip")
+        debug("config_backup_path=%s" % config_backup_path)
+        with ZipFile(
+            config_backup_path, "w", compression=ZIP_DEFLATED
+        ) as config_backup_zip:
+            backup_file(
+                config_backup_zip, os.path.join(device_path, ".adobe-digital-editions")
+            )
+            for file_path, archive_name in _config_files(device_path):
+                backup_file(config_backup_zip, file_path, basename=archive_name)
+
+            if zip_database:
+                debug("adding database KoboReader to zip file")
+                config_backup_zip.writestr(
+                    "KoboReader.sqlite", database_snapshot.serialize("main")
+                )
 
-        version_file = os.path.join(device_path, ".kobo", "version")
-        backup_file(config_backup_zip, version_file)
+                if bookreader_snapshot is not None:
+                    debug("adding database BookReader to zip file")
+                    config_backup_zip.writestr(
+                        "BookReader.sqlite", bookreader_snapshot.serialize("main")
+                    )
+        catalog.add(config_backup_path, BACKUP_KIND_ZIP)
+
+    database_snapshot.close()
+    if not in_memory:
+        catalog.add(backup_file_path, BACKUP_KIND_DATABASE)
+    if bookreader_snapshot is not None:
+        bookreader_snapshot.close()
+        if not in_memory and bookreader_backup_file_path is not None:
+            catalog.add(bookreader_backup_file_path, BACKUP_KIND_DATABASE)
 
-        affiliate_file = os.path.join(device_path, ".kobo", "affiliate.conf")
-        backup_file(config_backup_zip, affiliate_file)
+    if copies_to_keep > 0:
+        debug("copies to keep:%s" % copies_to_keep)
+        catalog.remove_old_backups(device_name, serial_number, copies_to_keep)
+        debug("Removing old backups - finished")
+    else:
+        debug("Manually managing backups")
 
-        ade_file = os.path.join(device_path, ".adobe-digital-editions")
-        backup_file(config_backup_zip, ade_file)
+    return
 
-        for root, _dirs, files in os.walk(ade_file):
-            for fn in files:
-                absfn = os.path.join(root, fn)
-                zfn = os.path.relpath(absfn, device_path).replace(os.sep, "/")
-                backup_file(config_backup_zip, absfn, basename=zfn)
 
-        if zip_database:
-            debug("adding database KoboReader to zip file=%s" % backup_file_path)
-            backup_file(
-                config_backup_zip, backup_file_path, basename="KoboReader.sqlite"
+class BackupsTableWidget(QTableWidget):
+    def __init__(self, parent: QWidget):
+        QTableWidget.__init__(self, parent)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+
+    def populate_table(self, backup_sets: list[list[BackupRecord]]):
+        self.clear()
+        self.setAlternatingRowColors(True)
+        self.setRowCount(len(backup_sets))
+        header_labels = [
+            _("Date"),
+            _("Device"),
+            _("Serial number"),
+            _("Contents"),
+            _("Size"),
+        ]
+        self.setColumnCount(len(header_labels))
+        self.setHorizontalHeaderLabels(header_labels)
+        vert_header = self.verticalHeader()
+        assert vert_header is not None
+        vert_header.setDefaultSectionSize(24)
+        horiz_header = self.horizontalHeader()
+        assert horiz_header is not None
+        horiz_header.setStretchLastSection(True)
+
+        # Newest first
+        for row, backup_set in enumerate(reversed(backup_sets)):
+            self.populate_table_row(row, backup_set)
+
+        self.resizeColumnsToContents()
+        self.setSortingEnabled(True)
+        self.setMinimumSize(550, 0)
+        self.selectRow(0)
+
+    def backup_set(self, row: int) -> list[BackupRecord]:
+        item = self.item(row, 0)
+        assert item is not None
+        return item.data(Qt.ItemDataRole.UserRole)
+
+    def populate_table_row(self, row: int, backup_set: list[BackupRecord]):
+        kind_names = {
+            BACKUP_KIND_DATABASE: _("database"),
+            BACKUP_KIND_ZIP: _("ZIP file"),
+            BACKUP_KIND_STORE: _("incremental backup"),
+        }
+        first = backup_set[0]
+        contents = sorted(
+            (
+                kind_names[record.kind]
+                if record.kind == BACKUP_KIND_STORE
+                else "%s %s" % (record.database, kind_names[record.kind])
             )
-            os.unlink(backup_file_path)
+            for record in backup_set
+        )
+        if first.corrupt:
+            contents.insert(0, _("CORRUPT"))
+        sizes = [record.size for record in backup_set if record.size is not None]
+
+        date_item = DateTableWidgetItem(first.date, is_read_only=True)
+        date_item.setData(Qt.ItemDataRole.UserRole, backup_set)
+        self.setItem(row, 0, date_item)
+        self.setItem(row, 1, ReadOnlyTableWidgetItem(first.device_name))
+        self.setItem(row, 2, ReadOnlyTableWidgetItem(first.serial_number))
+        self.setItem(row, 3, ReadOnlyTableWidgetItem(", ".join(contents)))
+        self.setItem(
+            row,
+            4,
+            ReadOnlyTableWidgetItem(human_readable(sum(sizes)) if sizes else None),
+        )
 
-            if bookreader_backup_file_path is not None:
-                debug(
-                    "adding database BookReader to zip file=%s"
-                    % bookreader_backup_file_path
-                )
-                backup_file(
-                    config_backup_zip,
-                    bookreader_backup_file_path,
-                    basename="BookReader.sqlite",
-                )
-                os.unlink(bookreader_backup_file_path)
 
-    if copies_to_keep > 0:
-        debug("copies to keep:%s" % copies_to_keep)
+class ListBackupsDialog(PluginDialog):
+    def __init__(
+        self,
+        parent: QWidget,
+        load_resources: LoadResources,
+        catalog: BackupCatalog,
+        device: KoboDevice | None,
+    ):
+        super().__init__(
+            parent,
+            "kobo utilities plugin:list backups dialog",
+        )
+        self.device = device
+        self.initialize_controls(load_resources, catalog.dest_dir)
+        self.backups_table.populate_table(catalog.backup_sets())
+
+        # Cause our dialog size to be restored from prefs or created on first usage
+        self.resize_dialog()
+
+    def initialize_controls(self, load_resources: LoadResources, dest_dir: str):
+        self.setWindowTitle(_("Backups"))
+        layout = QVBoxLayout(self)
+        self.setLayout(layout)
+        title_layout = ImageTitleLayout(
+            self,
+            "images/databases.png",
+            _("Backups in {0}").format(dest_dir),
+            load_resources,
+        )
+        layout.addLayout(title_layout)
+
+        self.backups_table = BackupsTableWidget(self)
+        layout.addWidget(self.backups_table)
 
-        timestamp_filter = "{0}-{1}".format("[0-9]" * 8, "[0-9]" * 6)
-        backup_file_search = backup_file_template.format(
-            device_name, serial_number, timestamp_filter
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok)
+        button_box.accepted.connect(self.accept)
+        compare_button = button_box.addButton(
+            _("Compare"), QDialogButtonBox.ButtonRole.ActionRole
+        )
+        assert compare_button is not None
+        compare_button.setToolTip(
+            _(
+                "Show the differences in books, collections, ratings and annotations between the two selected backups, or between the selected backup and the database on the connected device."
+            )
         )
-        debug("backup_file_search=", backup_file_search)
-        db_backup_file_search = os.path.join(dest_dir, backup_file_search + ".sqlite")
-        debug("db_backup_file_search=", db_backup_file_search)
-        backup_files = glob.glob(db_backup_file_search)
-        debug("backup_files=", backup_files)
-        debug(
-            "backup_files=",
-            backup_files[: len(backup_files) - copies_to_keep],
+        compare_button.clicked.connect(self.compare_backups)
+        layout.addWidget(button_box)
+
+    def compare_backups(self):
+        selection_model = self.backups_table.selectionModel()
+        assert selection_model is not None
+        backup_sets = sorted(
+            (
+                self.backups_table.backup_set(index.row())
+                for index in selection_model.selectedRows()
+            ),
+            key=lambda backup_set: backup_set[0].timestamp,
         )
-        debug("len(backup_files) - copies_to_keep=", len(backup_files) - copies_to_keep)
-
-        if len(backup_files) - copies_to_keep > 0:
-            for filename in sorted(backup_files)[: len(backup_files) - copies_to_keep]:
-                debug("removing backup file:", filename)
-                os.unlink(filename)
-                zip_filename = os.path.splitext(filename)[0] + ".zip"
-                if os.path.exists(zip_filename):
-                    debug("removing zip backup file:", zip_filename)
-                    os.unlink(zip_filename)
-
-        config_backup_file_search = os.path.join(dest_dir, backup_file_search + ".zip")
-        debug("config_backup_file_search=", config_backup_file_search)
-        backup_files = glob.glob(config_backup_file_search)
-        debug("backup_files=", backup_files[: len(backup_files) - copies_to_keep])
-        debug("len(backup_files) - copies_to_keep=", len(backup_files) - copies_to_keep)
-
-        if len(backup_files) - copies_to_keep > 0:
-            for filename in sorted(backup_files)[: len(backup_files) - copies_to_keep]:
-                debug("removing backup file:", filename)
-                os.unlink(filename)
-                sqlite_filename = os.path.splitext(filename)[0] + ".sqlite"
-                if os.path.exists(sqlite_filename):
-                    debug("removing sqlite backup file:", sqlite_filename)
-                    os.unlink(sqlite_filename)
+        if not (
+            len(backup_sets) == 2 or (len(backup_sets) == 1 and self.device is not None)
+        ):
+            error_dialog(
+                self,
+                _("Compare backups"),
+                _(
+                    "Select two backups, or one backup to compare with the database on the connected device."
+                ),
+                show=True,
+            )
+            return
 
-        debug("Removing old backups - finished")
-    else:
-        debug("Manually managing backups")
+        backups = [_database_backup_record(backup_set) for backup_set in backup_sets]
+        old_backup = backups[0]
+        new_backup = backups[1] if len(backups) == 2 else None
+        if old_backup is None or (len(backups) == 2 and new_backup is None):
+            error_dialog(
+                self,
+                _("Compare backups"),
+                _("A selected backup does not contain the device database."),
+                show=True,
+            )
+            return
 
-    return
+        new_name = new_backup.name if new_backup is not None else _("Device database")
+        database_path = self.device.db_path if self.device is not None else ""
+        try:
+            diffs = diff_backups(old_backup, new_backup, database_path)
+        except (OSError, KeyError, apsw.Error, BackupStoreError) as e:
+            error_dialog(
+                self,
+                _("Compare backups"),
+                _("The backups could not be compared."),
+                det_msg=str(e),
+                show=True,
+            )
+            return
+
+        result = (
+            _("Differences from {0} to {1}:").format(old_backup.name, new_name)
+            + "\n\n"
+            + backupdiff.format_diff(diffs)
+        )
+        d = ViewLog(_("Compare backups"), html.escape(result), parent=self)
+        d.exec()
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, Tuple
+from zipfile import ZipFile
+
+import apsw
+
+from ..constants import BOOK_CONTENTTYPE
+from ..utils import debug
+from .backupstore import MANIFEST_EXT, BackupStore
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+# Schema names the two databases are attached as
+OLD_SCHEMA = "old"
+NEW_SCHEMA = "new"
+# Name of the database file inside ZIP backups and incremental backups
+DATABASE_FILE_NAME = "KoboReader.sqlite"
+
+RowKey = Tuple[Any, ...]
+ColumnChanges = Dict[str, Tuple[Any, Any]]
+
+
+@dataclass(frozen=True)
+class DiffTable:
+    name: str
+    key_columns: tuple[str, ...]
+    # Condition on the rows to compare, with {alias} standing for the table
+    where: str = ""
+
+
+DIFF_TABLES = (
+    DiffTable("content", ("ContentID",), "{alias}.ContentType = %d" % BOOK_CONTENTTYPE),
+    DiffTable("Shelf", ("Id",)),
+    DiffTable("ShelfContent", ("ShelfName", "ContentId")),
+    DiffTable("ratings", ("ContentID",)),
+    DiffTable("Bookmark", ("BookmarkID",)),
+)
+
+
+@dataclass
+class TableDiff:
+    table: str
+    key_columns: tuple[str, ...]
+    added: list[RowKey] = field(default_factory=list)
+    removed: list[RowKey] = field(default_factory=list)
+    changed: dict[RowKey, ColumnChanges] = field(default_factory=dict)
+    # Set if the table couldn't be compared, for example because it is
+    # missing from one of the databases
+    skipped: str | None = None
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+
+def open_diff_connection() -> apsw.Connection:
+    connection = apsw.Connection(":memory:")
+    connection.execute("ATTACH ':memory:' AS %s" % OLD_SCHEMA)
+    connection.execute("ATTACH ':memory:' AS %s" % NEW_SCHEMA)
+    return connection
+
+
+def attach_backup(connection: apsw.Connection, schema: str, path: str) -> None:
+    """
+    Make the database of a backup available as schema. The backup can be a
+    database file, a ZIP file with the database or the manifest of an
+    incremental backup.
+    """
+    debug("schema=%s, path=%s" % (schema, path))
+    if path.endswith(".zip"):
+        with ZipFile(path) as backup_zip:
+            attach_database_content(
+                connection, schema, backup_zip.read(DATABASE_FILE_NAME)
+            )
+    elif path.endswith(MANIFEST_EXT):
+        store = BackupStore(os.path.dirname(os.path.dirname(path)))
+        name = os.path.basename(path)[: -len(MANIFEST_EXT)]
+        attach_database_content(
+            connection, schema, store.read_file(name, DATABASE_FILE_NAME)
+        )
+    else:
+        connection.execute("DETACH %s" % schema)
+        connection.execute("ATTACH ? AS %s" % schema, (path,))
+
+
+def attach_database_content(
+    connection: apsw.Connection, schema: str, content: bytes
+) -> None:
+    """
+    Make a database that is held in memory, for example a snapshot of the
+    device database, available as schema.
+    """
+    connection.deserialize(schema, content)
+
+
+def diff_databases(
+    connection: apsw.Connection, tables: Iterable[DiffTable] = DIFF_TABLES
+) -> list[TableDiff]:
+    """
+    Compare the tables of the databases attached as OLD_SCHEMA and NEW_SCHEMA.
+    Rows are matched on the key columns and compared on the columns that
+    both databases have, so backups from different firmware versions can be
+    compared.
+    """
+    connection.execute("PRAGMA query_only = ON")
+    try:
+        return [_diff_table(connection, table) for table in tables]
+    finally:
+        connection.execute("PRAGMA query_only = OFF")
+
+
+def _table_columns(connection: apsw.Connection, schema: str, table: str) -> list[str]:
+    return [
+        row[1]
+        for row in connection.execute(
+            "PRAGMA %s.table_info(%s)" % (schema, _quote(table))
+        )
+    ]
+
+
+def _quote(identifier: str) -> str:
+    return '"%s"' % identifier.replace('"', '""')
+
+
+def _diff_table(connection: apsw.Connection, table: DiffTable) -> TableDiff:
+    diff = TableDiff(table.name, table.key_columns)
+    old_columns = _table_columns(connection, OLD_SCHEMA, table.name)
+    new_columns = set(_table_columns(connection, NEW_SCHEMA, table.name))
+    if not old_columns or not new_columns:
+        diff.skipped = _("Table is missing")
+        return diff
+    columns = [column for column in old_columns if column in new_columns]
+    if any(key not in columns for key in table.key_columns):
+        diff.skipped = _("Key columns are missing")
+        return diff
+
+    table_name = _quote(table.name)
+    keys = [_quote(key) for key in table.key_columns]
+    values = [_quote(column) for column in columns if column not in table.key_columns]
+    key_join = " AND ".join("o.%s = n.%s" % (key, key) for key in keys)
+
+    for side, other, target in (
+        ("n", "o", diff.added),
+        ("o", "n", diff.removed),
+    ):
+        # Identifiers are quoted table and column names, values are never
+        # put into the query text
+        query = (  # noqa: S608
+            "SELECT {keys} FROM {side_schema}.{table} {side} "
+            "WHERE NOT EXISTS ("
+            "SELECT 1 FROM {other_schema}.{table} {other} WHERE {key_join}{other_where}"
+            "){side_where}"
+        ).format(
+            keys=", ".join("%s.%s" % (side, key) for key in keys),
+            side_schema=NEW_SCHEMA if side == "n" else OLD_SCHEMA,
+            other_schema=OLD_SCHEMA if side == "n" else NEW_SCHEMA,
+            table=table_name,
+            side=side,
+            other=other,
+            key_join=key_join,
+            other_where=_where(table, other),
+            side_where=_where(table, side),
+        )
+        target.extend(tuple(row) for row in connection.execute(query))
+
+    if values:
+        differs = " OR ".join("o.%s IS NOT n.%s" % (value, value) for value in values)
+        query = (  # noqa: S608
+            "SELECT {keys}, {old_values}, {new_values} "
+            "FROM {old_schema}.{table} o JOIN {new_schema}.{table} n ON {key_join} "
+            "WHERE ({differs}){old_where}{new_where}"
+        ).format(
+            keys=", ".join("o.%s" % key for key in keys),
+            old_values=", ".join("o.%s" % value for value in values),
+            new_values=", ".join("n.%s" % value for value in values),
+            old_schema=OLD_SCHEMA,
+            new_schema=NEW_SCHEMA,
+            table=table_name,
+            key_join=key_join,
+            differs=differs,
+            old_where=_where(table, "o"),
+            new_where=_where(table, "n"),
+        )
+        value_names = [column for column in columns if column not in table.key_columns]
+        key_count = len(keys)
+        value_count = len(values)
+        for row in connection.execute(query):
+            old_values = row[key_count : key_count + value_count]
+            new_values = row[key_count + value_count :]
+            diff.changed[tuple(row[:key_count])] = {
+                name: (old_value, new_value)
+                for name, old_value, new_value in zip(
+                    value_names, old_values, new_values
+                )
+                if old_value != new_value
+            }
+
+    debug(
+        "table=%s, added=%d, removed=%d, changed=%d"
+        % (table.name, len(diff.added), len(diff.removed), len(diff.changed))
+    )
+    return diff
+
+
+def _where(table: DiffTable, alias: str) -> str:
+    return " AND (%s)" % table.where.format(alias=alias) if table.where else ""
+
+
+def format_diff(diffs: list[TableDiff], max_rows: int = 200) -> str:
+    """
+    Describe the differences as text. At most max_rows rows are listed for
+    each kind of change in a table.
+    """
+    lines = []
+    for diff in diffs:
+        if diff.skipped is not None:
+            lines.append("%s: %s" % (diff.table, diff.skipped))
+            continue
+        lines.append(
+            _("{0}: {1} added, {2} removed, {3} changed").format(
+                diff.table, len(diff.added), len(diff.removed), len(diff.changed)
+            )
+        )
+        for label, keys in ((_("Added"), diff.added), (_("Removed"), diff.removed)):
+            lines.extend(
+                "\t%s: %s" % (label, _format_key(diff, key)) for key in keys[:max_rows]
+            )
+            if len(keys) > max_rows:
+                lines.append("\t" + _("... and {0} more").format(len(keys) - max_rows))
+        for key, changes in list(diff.changed.items())[:max_rows]:
+            lines.append("\t%s: %s" % (_("Changed"), _format_key(diff, key)))
+            lines.extend(
+                "\t\t%s: %r -> %r" % (column, old_value, new_value)
+                for column, (old_value, new_value) in changes.items()
+            )
+        if len(diff.changed) > max_rows:
+            lines.append(
+                "\t" + _("... and {0} more").format(len(diff.changed) - max_rows)
+            )
+    return "\n".join(lines)
+
+
+def _format_key(diff: TableDiff, key: RowKey) -> str:
+    return ", ".join(
+        "%s=%s" % (column, value) for column, value in zip(diff.key_columns, key)
+    )
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import json
+import os
+import zlib
+from collections import Counter
+from typing import TYPE_CHECKING, Any
+
+from ..utils import debug
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+# Name of the directory inside the backup destination that holds the store
+BACKUP_STORE_DIR_NAME = "KoboUtilitiesBackupStore"
+# Files are split into chunks of this size. It is a multiple of every SQLite
+# page size, so a page that changes between two backups only affects one chunk.
+CHUNK_SIZE = 64 * 1024
+MANIFEST_VERSION = 1
+MANIFEST_EXT = ".json"
+
+
+class BackupStoreError(Exception):
+    pass
+
+
+class BackupStore:
+    """
+    A content-addressed store for device backups.
+
+    Every file of a backup is split into fixed-size chunks that are stored
+    compressed under their SHA-256 hash, so chunks that are the same in
+    several backups are only stored once. Each backup is described by a
+    manifest listing the chunks of its files.
+
+        <store>/chunks/ab/abcdef...
+        <store>/manifests/<backup name>.json
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.chunks_path = os.path.join(path, "chunks")
+        self.manifests_path = os.path.join(path, "manifests")
+
+    def backup_names(self) -> list[str]:
+        if not os.path.isdir(self.manifests_path):
+            return []
+        with os.scandir(self.manifests_path) as entries:
+            return sorted(
+                entry.name[: -len(MANIFEST_EXT)]
+                for entry in entries
+                if entry.name.endswith(MANIFEST_EXT) and entry.is_file()
+            )
+
+    def add_backup(self, name: str, files: Iterable[tuple[str, bytes]]) -> int:
+        """
+        Store a backup made up of (archive name, content) pairs and return
+        the number of bytes that had to be written for new chunks.
+        """
+        bytes_written = 0
+        manifest_files: list[dict[str, Any]] = []
+        for file_name, data in files:
+            chunks = []
+            view = memoryview(data)
+            for offset in range(0, len(data), CHUNK_SIZE):
+                digest, written = self._write_chunk(view[offset : offset + CHUNK_SIZE])
+                chunks.append(digest)
+                bytes_written += written
+            manifest_files.append(
+                {
+                    "name": file_name,
+                    "size": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                    "chunks": chunks,
+                }
+            )
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "name": name,
+            "created": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+            "files": manifest_files,
+        }
+        # The manifest is written last so that a backup only becomes visible
+        # once all of its chunks are in the store
+        _write_atomically(
+            self._manifest_path(name), json.dumps(manifest, indent=1).encode("utf-8")
+        )
+        debug("backup=%s, new bytes written=%d" % (name, bytes_written))
+        return bytes_written
+
+    def read_manifest(self, name: str) -> dict[str, Any]:
+        with open(self._manifest_path(name), "rb") as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise BackupStoreError(
+                "Unsupported backup manifest version: %s" % manifest.get("version")
+            )
+        return manifest
+
+    def restore(self, name: str, target_dir: str) -> list[str]:
+        """
+        Recreate all files of a backup below target_dir and return their paths.
+        Every file is checked against the hash of the original file.
+        """
+        restored_files = []
+        for file_info in self.read_manifest(name)["files"]:
+            target_path = os.path.join(target_dir, *file_info["name"].split("/"))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            file_hash = hashlib.sha256()
+            with open(target_path, "wb") as target_file:
+                for digest in file_info["chunks"]:
+                    data = self._read_chunk(digest)
+                    file_hash.update(data)
+                    target_file.write(data)
+            if file_hash.hexdigest() != file_info["sha256"]:
+                raise BackupStoreError(
+                    "Restored file does not match the backup: %s" % file_info["name"]
+                )
+            restored_files.append(target_path)
+        return restored_files
+
+    def read_file(self, name: str, file_name: str) -> bytes:
+        """
+        Return the content of one file of a backup, checked against the hash
+        of the original file.
+        """
+        for file_info in self.read_manifest(name)["files"]:
+            if file_info["name"] == file_name:
+                data = b"".join(
+                    self._read_chunk(digest) for digest in file_info["chunks"]
+                )
+                if hashlib.sha256(data).hexdigest() != file_info["sha256"]:
+                    raise BackupStoreError(
+                        "Restored file does not match the backup: %s" % file_name
+                    )
+                return data
+        raise BackupStoreError("%s is not part of backup %s" % (file_name, name))
+
+    def remove_backups(self, names: Iterable[str]) -> int:
+        """
+        Remove the given backups and then every chunk that is no longer
+        referenced by any backup. Returns the number of chunks removed.
+        """
+        for name in names:
+            debug("removing backup:", name)
+            os.unlink(self._manifest_path(name))
+        return self.collect_garbage()
+
+    def collect_garbage(self) -> int:
+        ref_counts: Counter[str] = Counter()
+        for name in self.backup_names():
+            for file_info in self.read_manifest(name)["files"]:
+                ref_counts.update(file_info["chunks"])
+
+        removed_chunks = 0
+        if not os.path.isdir(self.chunks_path):
+            return removed_chunks
+        with os.scandir(self.chunks_path) as shards:
+            shard_paths = [shard.path for shard in shards if shard.is_dir()]
+        for shard_path in shard_paths:
+            with os.scandir(shard_path) as entries:
+                unreferenced = [
+                    entry.path for entry in entries if ref_counts[entry.name] == 0
+                ]
+            for chunk_path in unreferenced:
+                os.unlink(chunk_path)
+            removed_chunks += len(unreferenced)
+        debug("removed chunks:", removed_chunks)
+        return removed_chunks
+
+    def _manifest_path(self, name: str) -> str:
+        return os.path.join(self.manifests_path, name + MANIFEST_EXT)
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunks_path, digest[:2], digest)
+
+    def _write_chunk(self, data: memoryview) -> tuple[str, int]:
+        digest = hashlib.sha256(data).hexdigest()
+        chunk_path = self._chunk_path(digest)
+        if os.path.exists(chunk_path):
+            return digest, 0
+        compressed = zlib.compress(data)
+        _write_atomically(chunk_path, compressed)
+        return digest, len(compressed)
+
+    def _read_chunk(self, digest: str) -> bytes:
+        try:
+            with open(self._chunk_path(digest), "rb") as chunk_file:
+                data = zlib.decompress(chunk_file.read())
+        except (OSError, zlib.error) as e:
+            raise BackupStoreError(
+                "Missing or damaged chunk %s: %s" % (digest, e)
+            ) from e
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise BackupStoreError("Damaged chunk %s" % digest)
+        return data
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
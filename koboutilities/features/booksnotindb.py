@@ -1,36 +1,29 @@
 from __future__ import annotations
 
 import datetime as dt
-from typing import TYPE_CHECKING, cast
+from typing import TYPE_CHECKING
 
 from calibre.gui2.library.delegates import DateDelegate
-from calibre.utils.config import tweaks
 from calibre.utils.date import utc_tz
 from qt.core import (
-    QAbstractItemView,
     QDialogButtonBox,
     QHBoxLayout,
-    Qt,
-    QTableWidget,
-    QTableWidgetItem,
     QVBoxLayout,
 )
 
 from .. import utils
 from ..constants import BOOK_CONTENTTYPE
 from ..dialogs import (
-    AuthorsTableWidgetItem,
-    DateTableWidgetItem,
     ImageTitleLayout,
     PluginDialog,
-    TitleWidgetItem,
+    ResultsTableModel,
+    ResultsTableView,
 )
 from ..utils import debug
 
 if TYPE_CHECKING:
     from calibre.devices.kobo.books import Book
     from calibre.gui2 import ui
-    from qt.core import QWidget
 
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
@@ -87,18 +80,8 @@ def _check_book_in_database(device: KoboDevice, books: list[Book]) -> list[Book]
     return not_on_device_books
 
 
-class BooksNotInDeviceDatabaseTableWidget(QTableWidget):
-    def __init__(self, parent: QWidget):
-        QTableWidget.__init__(self, parent)
-        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
-        self.fmt = tweaks["gui_pubdate_display_format"]
-        if self.fmt is None:
-            self.fmt = "MMM yyyy"
-
+class BooksNotInDeviceDatabaseTableView(ResultsTableView):
     def populate_table(self, books: list[Book]):
-        self.clear()
-        self.setAlternatingRowColors(True)
-        self.setRowCount(len(books))
         header_labels = [
             _("Title"),
             _("Author(s)"),
@@ -106,73 +89,33 @@ class BooksNotInDeviceDatabaseTableWidget(QTableWidget):
             _("PubDate"),
             _("File timestamp"),
         ]
-        self.setColumnCount(len(header_labels))
-        self.setHorizontalHeaderLabels(header_labels)
-        vert_header = self.verticalHeader()
-        assert vert_header is not None
-        vert_header.setDefaultSectionSize(24)
-        horiz_header = self.horizontalHeader()
-        assert horiz_header is not None
-        horiz_header.setStretchLastSection(True)
-
-        for row, book in enumerate(books):
-            self.populate_table_row(row, book)
+        rows = [
+            (
+                book.title,
+                " & ".join(book.authors),
+                book.path,
+                book.pubdate,
+                dt.datetime(*book.datetime[:6], tzinfo=utc_tz),
+                book.title_sort,
+                book.author_sort,
+            )
+            for book in books
+        ]
+        self.set_results_model(
+            ResultsTableModel(
+                header_labels, rows, sort_columns={0: 5, 1: 6}, dimmed_columns=(1,)
+            )
+        )
 
         self.resizeColumnToContents(0)
         self.setMinimumColumnWidth(0, 150)
         self.setColumnWidth(1, 100)
         self.resizeColumnToContents(2)
         self.setMinimumColumnWidth(2, 200)
-        self.setSortingEnabled(True)
         self.setMinimumSize(550, 0)
-        self.selectRow(0)
         delegate = DateDelegate(self, tweak_name="gui_pubdate_display_format")
         self.setItemDelegateForColumn(3, delegate)
 
-    def setMinimumColumnWidth(self, col: int, minimum: int):
-        if self.columnWidth(col) < minimum:
-            self.setColumnWidth(col, minimum)
-
-    def populate_table_row(self, row: int, book: Book):
-        self.blockSignals(True)
-        titleColumn = TitleWidgetItem(book)
-        titleColumn.setFlags(Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled)
-        self.setItem(row, 0, titleColumn)
-        authorColumn = AuthorsTableWidgetItem(book.authors, book.author_sort)
-        self.setItem(row, 1, authorColumn)
-        pathColumn = QTableWidgetItem(book.path)
-        pathColumn.setFlags(Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled)
-        self.setItem(row, 2, pathColumn)
-        self.setItem(
-            row,
-            3,
-            DateTableWidgetItem(
-                cast("dt.datetime", book.pubdate),
-                is_read_only=True,
-                default_to_today=False,
-                fmt=self.fmt,
-            ),
-        )
-        self.setItem(
-            row,
-            4,
-            DateTableWidgetItem(
-                dt.datetime(
-                    book.datetime[0],
-                    book.datetime[1],
-                    book.datetime[2],
-                    book.datetime[3],
-                    book.datetime[4],
-                    book.datetime[5],
-                    book.datetime[6],
-                    utc_tz,
-                ),
-                is_read_only=True,
-                default_to_today=False,
-            ),
-        )
-        self.blockSignals(False)
-
 
 class ShowBooksNotInDeviceDatabaseDialog(PluginDialog):
     def __init__(
@@ -211,7 +154,7 @@ class ShowBooksNotInDeviceDatabaseDialog(PluginDialog):
         table_layout = QHBoxLayout()
         layout.addLayout(table_layout)
 
-        self.books_table = BooksNotInDeviceDatabaseTableWidget(self)
+        self.books_table = BooksNotInDeviceDatabaseTableView(self)
         table_layout.addWidget(self.books_table)
 
         # Dialog buttons
@@ -2,9 +2,12 @@ from __future__ import annotations
 
 import os
 import pickle
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import partial
-from typing import TYPE_CHECKING, Any, Callable
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple
 
 from calibre.devices.kobo.driver import KOBOTOUCH
 from calibre.gui2 import info_dialog
@@ -32,6 +35,17 @@ if TYPE_CHECKING:
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
 
+# Cover files are named "<ImageId> - N3_<variant>" or
+# "<ImageId> - AndroidBookLoadTablet_Aspect<...>"
+IMAGE_FILENAME_RE = re.compile(r"^(.+?)( - (?:N3_|AndroidBookLoadTablet_Aspect).*)$")
+# Number of threads used to enumerate the top-level directories of the images
+# tree. Listing directories over USB is I/O-bound, so this is independent of
+# the number of CPUs.
+SCAN_THREADS = 8
+
+# ImageId -> (directory, [filename suffixes])
+ImageIdIndex = Dict[str, Tuple[str, List[str]]]
+
 
 @dataclass
 class CleanImagesDirJobOptions:
@@ -58,6 +72,25 @@ def clean_images_dir(
     if dlg.result() != dlg.DialogCode.Accepted:
         return
 
+    main_image_path, sd_image_path, images_tree = get_image_paths(device)
+    options = CleanImagesDirJobOptions(
+        main_image_path,
+        sd_image_path,
+        device.db_path,
+        device.device_db_path,
+        device.is_db_copied,
+        cfg.plugin_prefs.cleanImagesDir.delete_extra_covers,
+        images_tree,
+    )
+    debug("options=", options)
+    CleanImagesDirProgressDialog(gui, options, dispatcher)
+
+
+def get_image_paths(device: KoboDevice) -> tuple[str, str, bool]:
+    """
+    Return the main memory and SD card image directories of the device, and
+    whether the covers are stored in the ".kobo-images" tree.
+    """
     main_prefix = device.driver._main_prefix
     assert isinstance(main_prefix, str), f"_main_prefix is type {type(main_prefix)}"
     if (
@@ -80,17 +113,11 @@ def clean_images_dir(
         )
         images_tree = False
 
-    options = CleanImagesDirJobOptions(
+    return (
         str(device.driver.normalize_path(main_image_path)),
         str(device.driver.normalize_path(sd_image_path)),
-        device.db_path,
-        device.device_db_path,
-        device.is_db_copied,
-        cfg.plugin_prefs.cleanImagesDir.delete_extra_covers,
         images_tree,
     )
-    debug("options=", options)
-    CleanImagesDirProgressDialog(gui, options, dispatcher)
 
 
 def _clean_images_dir_job(
@@ -178,11 +205,11 @@ def do_clean_images_dir(
         "Getting ImageIDs from main images directory - Path is: '%s'"
         % (main_image_path)
     )
-    imageids_files_main = _get_file_imageIds(main_image_path)
+    imageids_files_main = get_file_imageIds(main_image_path)
 
     notification(2 / 7, "Getting ImageIDs from SD card images directory")
     debug("Getting ImageIDs from SD images directory - Path is: '%s'" % (sd_image_path))
-    imageids_files_sd = _get_file_imageIds(sd_image_path)
+    imageids_files_sd = get_file_imageIds(sd_image_path)
 
     notification(3 / 7, "Getting ImageIDs from device database.")
     debug("Getting ImageIDs from device database.")
@@ -195,11 +222,9 @@ def do_clean_images_dir(
         % (len(extra_imageids_files_main))
     )
     extra_image_files_main = utils.remove_extra_files(
-        extra_imageids_files_main,
-        imageids_files_main,
+        _image_files_by_dir(extra_imageids_files_main, imageids_files_main),
         options.delete_extra_covers,
-        main_image_path,
-        images_tree=options.images_tree,
+        prune_empty_dirs=options.images_tree,
     )
 
     notification(5 / 7, "Checking/removing images from SD card images directory")
@@ -209,11 +234,9 @@ def do_clean_images_dir(
         % (len(extra_imageids_files_sd))
     )
     extra_image_files_sd = utils.remove_extra_files(
-        extra_imageids_files_sd,
-        imageids_files_sd,
+        _image_files_by_dir(extra_imageids_files_sd, imageids_files_sd),
         options.delete_extra_covers,
-        sd_image_path,
-        images_tree=options.images_tree,
+        prune_empty_dirs=options.images_tree,
     )
 
     extra_image_files: dict[str, list[str]] = {}
@@ -225,25 +248,76 @@ def do_clean_images_dir(
     return extra_image_files
 
 
-def _get_file_imageIds(image_path: str | None) -> dict[str, str]:
-    imageids_files = {}
-    if image_path:
-        for path, _dirs, files in os.walk(image_path):
-            for filename in files:
-                if filename.find(" - N3_") > 0:
-                    imageid = filename.split(" - N3_")[0]
-                    imageids_files[imageid] = path
-                    continue
-                if filename.find(" - AndroidBookLoadTablet_Aspect") > 0:
-                    imageid = filename.split(" - AndroidBookLoadTablet_Aspect")[0]
-                    imageids_files[imageid] = path
-                    continue
-                debug("path=%s" % (path))
-                debug("check_covers: not 'N3' file - filename=%s" % (filename))
+def get_file_imageIds(image_path: str | None) -> ImageIdIndex:
+    imageids_files: ImageIdIndex = {}
+    if not image_path or not os.path.isdir(image_path):
+        return imageids_files
 
+    # Files directly in the images directory (the flat ".kobo/images" layout)
+    # are indexed here, the subdirectories of the ".kobo-images" tree are
+    # enumerated concurrently.
+    subdirs: list[str] = []
+    skipped = _scan_image_dir(image_path, imageids_files, subdirs)
+    with ThreadPoolExecutor(max_workers=SCAN_THREADS) as executor:
+        for shard_index, shard_skipped in executor.map(_scan_image_tree, subdirs):
+            _merge_imageid_index(imageids_files, shard_index)
+            skipped += shard_skipped
+
+    debug(
+        "path=%s, imageids=%d, skipped non-cover files=%d"
+        % (image_path, len(imageids_files), skipped)
+    )
     return imageids_files
 
 
+def _scan_image_tree(top_path: str) -> tuple[ImageIdIndex, int]:
+    imageids_files: ImageIdIndex = {}
+    skipped = 0
+    pending = [top_path]
+    while pending:
+        skipped += _scan_image_dir(pending.pop(), imageids_files, pending)
+    return imageids_files, skipped
+
+
+def _scan_image_dir(path: str, imageids_files: ImageIdIndex, subdirs: list[str]) -> int:
+    skipped = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+                continue
+            match = IMAGE_FILENAME_RE.match(entry.name)
+            if match is None:
+                skipped += 1
+                continue
+            imageid, suffix = match.groups()
+            indexed = imageids_files.get(imageid)
+            if indexed is not None and indexed[0] == path:
+                indexed[1].append(suffix)
+            else:
+                imageids_files[imageid] = (path, [suffix])
+    return skipped
+
+
+def _merge_imageid_index(imageids_files: ImageIdIndex, other: ImageIdIndex) -> None:
+    for imageid, (path, suffixes) in other.items():
+        indexed = imageids_files.get(imageid)
+        if indexed is not None and indexed[0] == path:
+            indexed[1].extend(suffixes)
+        else:
+            imageids_files[imageid] = (path, suffixes)
+
+
+def _image_files_by_dir(
+    imageids: set[str], imageids_files: ImageIdIndex
+) -> dict[str, list[str]]:
+    files_by_dir: dict[str, list[str]] = defaultdict(list)
+    for imageid in imageids:
+        path, suffixes = imageids_files[imageid]
+        files_by_dir[path].extend(imageid + suffix for suffix in suffixes)
+    return files_by_dir
+
+
 def _get_imageId_set(
     database_path: str, device_database_path: str, is_db_copied: bool
 ) -> set[str]:
@@ -0,0 +1,541 @@
+from __future__ import annotations
+
+import calendar
+import datetime as dt
+import os
+import pickle
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass, field
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple
+
+from calibre import human_readable
+from calibre.devices.kobo.driver import KOBOTOUCH
+from calibre.gui2 import info_dialog
+from qt.core import (
+    QCheckBox,
+    QDialogButtonBox,
+    QGridLayout,
+    QGroupBox,
+    QLabel,
+    QSpinBox,
+    QVBoxLayout,
+)
+
+from .. import config as cfg
+from .. import utils
+from ..constants import BOOK_CONTENTTYPE, GUI_NAME
+from ..dialogs import ImageTitleLayout, PluginDialog
+from ..utils import DeviceDatabaseConnection, debug
+from .cleanimages import SCAN_THREADS, get_file_imageIds, get_image_paths
+
+if TYPE_CHECKING:
+    from calibre.gui2 import ui
+    from calibre.gui2.device import DeviceJob
+    from qt.core import QWidget
+
+    from ..config import KoboDevice
+    from ..utils import Dispatcher, LoadResources
+    from .cleanimages import ImageIdIndex
+
+FULLSIZE_COVER_ENDING = " - N3_FULL.parsed"
+# Upper bounds of the size histogram buckets. The last bucket has no upper bound.
+SIZE_BUCKETS = [16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+
+# ImageId -> [(filename suffix, size)]
+ImageSizeIndex = Dict[str, List[Tuple[str, int]]]
+
+
+@dataclass
+class CoverStorageJobOptions:
+    main_image_path: str
+    sd_image_path: str
+    database_path: str
+    device_database_path: str
+    is_db_copied: bool
+    images_tree: bool
+    cover_endings: list[str]
+    prune_covers: bool
+    target_size: int
+    unread_months: int
+    remove_fullsize_covers: bool
+    kepub_covers: bool
+
+
+@dataclass
+class CoverVariantStats:
+    count: int = 0
+    size: int = 0
+    histogram: list[int] = field(default_factory=lambda: [0] * (len(SIZE_BUCKETS) + 1))
+
+    def add(self, size: int) -> None:
+        self.count += 1
+        self.size += size
+        bucket = 0
+        while bucket < len(SIZE_BUCKETS) and size >= SIZE_BUCKETS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+
+@dataclass
+class BookCoverUsage:
+    title: str
+    contentID: str
+    size: int
+    last_read: str | None
+
+
+@dataclass
+class CoverStorageReport:
+    total_size: int = 0
+    file_count: int = 0
+    orphaned_size: int = 0
+    variants: dict[str, CoverVariantStats] = field(default_factory=dict)
+    books: list[BookCoverUsage] = field(default_factory=list)
+    pruned_files: list[str] = field(default_factory=list)
+    pruned_size: int = 0
+
+
+@dataclass
+class _ImageOwner:
+    titles: list[str]
+    contentIDs: list[str]
+    last_read: dt.datetime | None
+    last_read_str: str | None
+    can_prune: bool
+
+
+def analyze_cover_storage(
+    device: KoboDevice,
+    gui: ui.Main,
+    dispatcher: Dispatcher,
+    load_resources: LoadResources,
+) -> None:
+    debug("device.path", device.path)
+
+    dlg = CoverStorageOptionsDialog(gui, load_resources)
+    dlg.exec()
+    if dlg.result() != dlg.DialogCode.Accepted:
+        return
+
+    assert isinstance(device.driver, KOBOTOUCH)
+    main_image_path, sd_image_path, images_tree = get_image_paths(device)
+    storage_options = cfg.plugin_prefs.coverStorage
+    remove_covers_options = cfg.plugin_prefs.removeCovers
+    options = CoverStorageJobOptions(
+        main_image_path,
+        sd_image_path,
+        device.db_path,
+        device.device_db_path,
+        device.is_db_copied,
+        images_tree,
+        list(device.driver.cover_file_endings().keys()),
+        storage_options.prune_covers,
+        storage_options.target_size_mb * 1024 * 1024,
+        storage_options.unread_months,
+        remove_covers_options.remove_fullsize_covers,
+        remove_covers_options.kepub_covers,
+    )
+    debug("options=", options)
+
+    func = "arbitrary_n"
+    cpus = gui.job_manager.server.pool_size
+    args = [
+        do_analyze_cover_storage.__module__,
+        do_analyze_cover_storage.__name__,
+        (pickle.dumps(options), cpus),
+    ]
+    desc = _("Analyzing cover image storage")
+    gui.job_manager.run_job(
+        dispatcher(partial(_analyze_cover_storage_completed, gui, options)),
+        func,
+        args=args,
+        description=desc,
+    )
+    gui.status_bar.show_message(desc + "...")
+
+
+def _analyze_cover_storage_completed(
+    gui: ui.Main, options: CoverStorageJobOptions, job: DeviceJob
+) -> None:
+    if job.failed:
+        gui.job_exception(
+            job, dialog_title=_("Failed to analyze cover image storage on device")
+        )
+        return
+    reports: dict[str, CoverStorageReport] = job.result
+    gui.status_bar.show_message(_("Analyzing cover image storage completed"), 3000)
+
+    locations = (
+        ("main_memory", _("Main memory")),
+        ("sd_card", _("SD card")),
+    )
+    msg = ""
+    details = ""
+    for key, location_name in locations:
+        report = reports[key]
+        if report.file_count == 0:
+            continue
+        msg += (
+            _("{0}: {1} in {2} cover image files.").format(
+                location_name, human_readable(report.total_size), report.file_count
+            )
+            + "\n"
+        )
+        if options.prune_covers:
+            msg += (
+                _("{0} cover image files removed, {1} freed.").format(
+                    len(report.pruned_files), human_readable(report.pruned_size)
+                )
+                + "\n"
+            )
+        details += _format_report_details(location_name, report)
+
+    if not msg:
+        msg = _("No cover images found")
+
+    info_dialog(
+        gui,
+        _("Kobo Utilities") + " - " + _("Cover image storage"),
+        msg,
+        show_copy_button=True,
+        show=True,
+        det_msg=details,
+    )
+
+
+def _format_report_details(location_name: str, report: CoverStorageReport) -> str:
+    bucket_names = [
+        "< " + human_readable(SIZE_BUCKETS[0]),
+        *(
+            human_readable(low) + " - " + human_readable(high)
+            for low, high in zip(SIZE_BUCKETS, SIZE_BUCKETS[1:])
+        ),
+        ">= " + human_readable(SIZE_BUCKETS[-1]),
+    ]
+
+    details = "%s\n\n" % location_name
+    details += _("Size by cover type:") + "\n"
+    for name, stats in sorted(
+        report.variants.items(), key=lambda item: item[1].size, reverse=True
+    ):
+        details += "\t%s: %s, %d\n" % (name, human_readable(stats.size), stats.count)
+        for bucket_name, count in zip(bucket_names, stats.histogram):
+            if count:
+                details += "\t\t%s: %d\n" % (bucket_name, count)
+    if report.orphaned_size:
+        details += (
+            _("Cover images without a book: {0}").format(
+                human_readable(report.orphaned_size)
+            )
+            + "\n"
+        )
+
+    details += "\n" + _("Size by book:") + "\n"
+    for book in report.books:
+        details += "\t%s\t%s\t%s\n" % (
+            human_readable(book.size),
+            book.last_read or _("Never"),
+            book.title,
+        )
+
+    if report.pruned_files:
+        details += "\n" + _("Removed cover image files:") + "\n"
+        for filename in report.pruned_files:
+            details += "\t%s\n" % filename
+
+    return details + "\n"
+
+
+def do_analyze_cover_storage(
+    options_raw: bytes,
+    cpus: int,
+    notification: Callable[[float, str], Any] = lambda _x, y: y,
+) -> dict[str, CoverStorageReport]:
+    del cpus
+    options: CoverStorageJobOptions = pickle.loads(options_raw)  # noqa: S301
+
+    notification(1 / 5, "Getting cover images from device database")
+    image_owners = _get_image_owners(options)
+
+    reports: dict[str, CoverStorageReport] = {}
+    for step, key, image_path in (
+        (2, "main_memory", options.main_image_path),
+        (3, "sd_card", options.sd_image_path),
+    ):
+        notification(step / 5, "Scanning cover images in %s" % image_path)
+        imageids_files = get_file_imageIds(image_path)
+        image_sizes = _get_image_sizes(imageids_files)
+        report = _build_report(image_sizes, image_owners)
+        if options.prune_covers:
+            notification(4 / 5, "Removing cover images in %s" % image_path)
+            _prune_covers(report, imageids_files, image_sizes, image_owners, options)
+        reports[key] = report
+
+    notification(5 / 5, "Analyzing cover image storage - Done")
+    return reports
+
+
+def _get_image_owners(options: CoverStorageJobOptions) -> dict[str, _ImageOwner]:
+    connection = DeviceDatabaseConnection(
+        options.database_path,
+        options.device_database_path,
+        options.is_db_copied,
+        use_row_factory=True,
+    )
+    query = (
+        "SELECT ContentID, Title, ImageId, DateLastRead "
+        "FROM content "
+        "WHERE ContentType = ? "
+        "AND ImageId IS NOT NULL"
+    )
+    cursor = connection.cursor()
+
+    image_owners: dict[str, _ImageOwner] = {}
+    for row in cursor.execute(query, (BOOK_CONTENTTYPE,)):
+        contentID = row["ContentID"]
+        last_read_str = row["DateLastRead"]
+        last_read = utils.convert_kobo_date(last_read_str)
+        # Same rule as "Remove covers": covers of Kobo epubs are only touched
+        # if that has been explicitly requested
+        can_prune = "file:///" in contentID or options.kepub_covers
+        owner = image_owners.get(row["ImageId"])
+        if owner is None:
+            image_owners[row["ImageId"]] = _ImageOwner(
+                [row["Title"] or ""], [contentID], last_read, last_read_str, can_prune
+            )
+            continue
+        owner.titles.append(row["Title"] or "")
+        owner.contentIDs.append(contentID)
+        owner.can_prune = owner.can_prune and can_prune
+        if last_read is not None and (
+            owner.last_read is None or last_read > owner.last_read
+        ):
+            owner.last_read = last_read
+            owner.last_read_str = last_read_str
+
+    connection.close()
+    return image_owners
+
+
+def _get_image_sizes(imageids_files: ImageIdIndex) -> ImageSizeIndex:
+    def stat_files(
+        item: tuple[str, tuple[str, list[str]]],
+    ) -> tuple[str, list[tuple[str, int]]]:
+        imageid, (path, suffixes) = item
+        sizes = []
+        for suffix in suffixes:
+            with suppress(OSError):
+                sizes.append(
+                    (suffix, os.path.getsize(os.path.join(path, imageid + suffix)))
+                )
+        return imageid, sizes
+
+    with ThreadPoolExecutor(max_workers=SCAN_THREADS) as executor:
+        return dict(executor.map(stat_files, imageids_files.items()))
+
+
+def _variant_name(suffix: str) -> str:
+    name = suffix[len(" - ") :]
+    return os.path.splitext(name)[0] if name.endswith(".parsed") else name
+
+
+def _build_report(
+    image_sizes: ImageSizeIndex,
+    image_owners: dict[str, _ImageOwner],
+) -> CoverStorageReport:
+    report = CoverStorageReport()
+    for imageid, sizes in image_sizes.items():
+        image_size = 0
+        for suffix, size in sizes:
+            variant = _variant_name(suffix)
+            report.variants.setdefault(variant, CoverVariantStats()).add(size)
+            image_size += size
+        report.total_size += image_size
+        report.file_count += len(sizes)
+
+        owner = image_owners.get(imageid)
+        if owner is None:
+            report.orphaned_size += image_size
+            continue
+        report.books.append(
+            BookCoverUsage(
+                " / ".join(owner.titles),
+                owner.contentIDs[0],
+                image_size,
+                owner.last_read_str,
+            )
+        )
+
+    report.books.sort(key=lambda book: book.size, reverse=True)
+    return report
+
+
+def _months_ago(now: dt.datetime, months: int) -> dt.datetime:
+    year, month = divmod(now.year * 12 + now.month - 1 - months, 12)
+    day = min(now.day, calendar.monthrange(year, month + 1)[1])
+    return now.replace(year=year, month=month + 1, day=day)
+
+
+def _prune_covers(
+    report: CoverStorageReport,
+    imageids_files: ImageIdIndex,
+    image_sizes: ImageSizeIndex,
+    image_owners: dict[str, _ImageOwner],
+    options: CoverStorageJobOptions,
+) -> None:
+    excess = report.total_size - options.target_size
+    debug("total_size=%d, excess=%d" % (report.total_size, excess))
+    if excess <= 0:
+        return
+
+    if options.remove_fullsize_covers:
+        prune_endings = {FULLSIZE_COVER_ENDING}
+    else:
+        prune_endings = set(options.cover_endings)
+
+    cutoff = _months_ago(dt.datetime.now(tz=dt.timezone.utc), options.unread_months)
+    candidates = [
+        (imageid, owner)
+        for imageid, owner in image_owners.items()
+        if imageid in image_sizes
+        and owner.can_prune
+        and (owner.last_read is None or owner.last_read < cutoff)
+    ]
+    # Books that have never been opened go first, then the least recently read
+    candidates.sort(
+        key=lambda candidate: (
+            candidate[1].last_read is not None,
+            candidate[1].last_read or cutoff,
+        )
+    )
+
+    files_by_dir: dict[str, list[str]] = defaultdict(list)
+    for imageid, _owner in candidates:
+        if report.pruned_size >= excess:
+            break
+        path = imageids_files[imageid][0]
+        for suffix, size in image_sizes[imageid]:
+            if suffix in prune_endings:
+                files_by_dir[path].append(imageid + suffix)
+                report.pruned_size += size
+
+    report.pruned_files = utils.remove_extra_files(
+        files_by_dir, True, prune_empty_dirs=options.images_tree
+    )
+
+
+class CoverStorageOptionsDialog(PluginDialog):
+    def __init__(self, parent: QWidget, load_resources: LoadResources):
+        super().__init__(
+            parent,
+            "kobo utilities plugin:cover storage settings dialog",
+        )
+        self.initialize_controls(load_resources)
+
+        options = cfg.plugin_prefs.coverStorage
+        self.prune_covers_checkbox.setChecked(options.prune_covers)
+        self.target_size_spin.setValue(options.target_size_mb)
+        self.unread_months_spin.setValue(options.unread_months)
+        remove_covers_options = cfg.plugin_prefs.removeCovers
+        self.remove_fullsize_covers_checkbox.setChecked(
+            remove_covers_options.remove_fullsize_covers
+        )
+        self.kepub_covers_checkbox.setChecked(remove_covers_options.kepub_covers)
+        self.prune_covers_checkbox_clicked(options.prune_covers)
+
+        # Cause our dialog size to be restored from prefs or created on first usage
+        self.resize_dialog()
+
+    def initialize_controls(self, load_resources: LoadResources):
+        self.setWindowTitle(GUI_NAME)
+        layout = QVBoxLayout(self)
+        self.setLayout(layout)
+        title_layout = ImageTitleLayout(
+            self,
+            "images/icon.png",
+            _("Cover image storage"),
+            load_resources,
+            "CoverStorage",
+        )
+        layout.addLayout(title_layout)
+
+        options_group = QGroupBox(_("Remove covers"), self)
+        layout.addWidget(options_group)
+        options_layout = QGridLayout()
+        options_group.setLayout(options_layout)
+
+        self.prune_covers_checkbox = QCheckBox(
+            _("Remove covers until the images directory fits the target size"), self
+        )
+        self.prune_covers_checkbox.setToolTip(
+            _(
+                "Check this if you want to remove covers of books that have not been opened recently, starting with the least recently read, until the images directory is no larger than the target size."
+            )
+        )
+        self.prune_covers_checkbox.clicked.connect(self.prune_covers_checkbox_clicked)
+        options_layout.addWidget(self.prune_covers_checkbox, 0, 0, 1, 2)
+
+        target_size_label = QLabel(_("Target size:"), self)
+        options_layout.addWidget(target_size_label, 1, 0, 1, 1)
+        self.target_size_spin = QSpinBox(self)
+        self.target_size_spin.setRange(0, 100000)
+        self.target_size_spin.setSuffix(" MB")
+        target_size_label.setBuddy(self.target_size_spin)
+        options_layout.addWidget(self.target_size_spin, 1, 1, 1, 1)
+
+        unread_months_label = QLabel(_("Only books not opened for:"), self)
+        options_layout.addWidget(unread_months_label, 2, 0, 1, 1)
+        self.unread_months_spin = QSpinBox(self)
+        self.unread_months_spin.setRange(0, 240)
+        self.unread_months_spin.setSuffix(" " + _("months"))
+        unread_months_label.setBuddy(self.unread_months_spin)
+        options_layout.addWidget(self.unread_months_spin, 2, 1, 1, 1)
+
+        self.remove_fullsize_covers_checkbox = QCheckBox(
+            _("Remove full size covers"), self
+        )
+        self.remove_fullsize_covers_checkbox.setToolTip(
+            _(
+                "Check this if you want to remove just the full size cover from the device. This will save space, but, if covers are used for the sleep screen, they will not look very good."
+            )
+        )
+        options_layout.addWidget(self.remove_fullsize_covers_checkbox, 3, 0, 1, 2)
+
+        self.kepub_covers_checkbox = QCheckBox(_("Remove covers for Kobo epubs"), self)
+        self.kepub_covers_checkbox.setToolTip(
+            _(
+                "Check this if you want to remove covers for any Kobo epubs synced from the Kobo server."
+            )
+        )
+        options_layout.addWidget(self.kepub_covers_checkbox, 4, 0, 1, 2)
+
+        layout.addStretch(1)
+
+        # Dialog buttons
+        button_box = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        )
+        button_box.accepted.connect(self.ok_clicked)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+    def prune_covers_checkbox_clicked(self, checked: bool):
+        self.target_size_spin.setEnabled(checked)
+        self.unread_months_spin.setEnabled(checked)
+        self.remove_fullsize_covers_checkbox.setEnabled(checked)
+        self.kepub_covers_checkbox.setEnabled(checked)
+
+    def ok_clicked(self):
+        with cfg.plugin_prefs.coverStorage as options:
+            options.prune_covers = self.prune_covers_checkbox.isChecked()
+            options.target_size_mb = self.target_size_spin.value()
+            options.unread_months = self.unread_months_spin.value()
+        with cfg.plugin_prefs.removeCovers as options:
+            options.remove_fullsize_covers = (
+                self.remove_fullsize_covers_checkbox.isChecked()
+            )
+            options.kepub_covers = self.kepub_covers_checkbox.isChecked()
+        self.accept()
@@ -7,7 +7,6 @@ from calibre import strftime
 from calibre.gui2 import error_dialog, info_dialog
 from calibre.gui2.library.delegates import DateDelegate
 from qt.core import (
-    QAbstractItemView,
     QCheckBox,
     QDialogButtonBox,
     QGridLayout,
@@ -15,30 +14,29 @@ from qt.core import (
     QHBoxLayout,
     QLabel,
     QRadioButton,
-    Qt,
-    QTableWidget,
-    QTableWidgetItem,
     QVBoxLayout,
 )
 
 from .. import config as cfg
 from .. import utils
 from ..dialogs import (
-    DateTableWidgetItem,
     ImageTitleLayout,
     PluginDialog,
     ProgressBar,
-    RatingTableWidgetItem,
+    ResultsTableModel,
+    ResultsTableView,
 )
 from ..utils import debug
 
 if TYPE_CHECKING:
     from calibre.gui2 import ui
-    from qt.core import QWidget
 
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
 
+# Temporary table with the collection to keep for each duplicated name
+DUPLICATE_SHELVES_KEEP_TABLE = "kobo_utilities_keep_shelves"
+
 
 def fix_duplicate_shelves(
     device: KoboDevice,
@@ -116,7 +114,7 @@ class FixDuplicateShelvesDialog(PluginDialog):
         table_layout = QHBoxLayout()
         layout.addLayout(table_layout)
 
-        self.shelves_table = DuplicateShelvesInDeviceDatabaseTableWidget(self)
+        self.shelves_table = DuplicateShelvesInDeviceDatabaseTableView(self)
         table_layout.addWidget(self.shelves_table)
 
         options_group = QGroupBox(_("Options"), self)
@@ -181,71 +179,30 @@ class FixDuplicateShelvesDialog(PluginDialog):
         )
 
 
-class DuplicateShelvesInDeviceDatabaseTableWidget(QTableWidget):
-    def __init__(self, parent: QWidget):
-        QTableWidget.__init__(self, parent)
-        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
-
+class DuplicateShelvesInDeviceDatabaseTableView(ResultsTableView):
     def populate_table(self, shelves: list[list[Any]]):
-        self.clear()
-        self.setAlternatingRowColors(True)
-        self.setRowCount(len(shelves))
         header_labels = [
             _("Collection name"),
             _("Oldest"),
             _("Newest"),
             _("Number"),
         ]
-        self.setColumnCount(len(header_labels))
-        self.setHorizontalHeaderLabels(header_labels)
-        vert_header = self.verticalHeader()
-        assert vert_header is not None
-        vert_header.setDefaultSectionSize(24)
-        horiz_header = self.horizontalHeader()
-        assert horiz_header is not None
-        horiz_header.setStretchLastSection(True)
-
-        for row, shelf in enumerate(shelves):
-            self.populate_table_row(row, shelf)
+        rows = [
+            (shelf[0] or _("(Unnamed collection)"), *shelf[1:4]) for shelf in shelves
+        ]
+        self.set_results_model(
+            ResultsTableModel(header_labels, rows, right_aligned_columns=(3,))
+        )
 
         self.resizeColumnToContents(0)
         self.setMinimumColumnWidth(0, 150)
         self.setColumnWidth(1, 150)
         self.resizeColumnToContents(2)
         self.setMinimumColumnWidth(2, 150)
-        self.setSortingEnabled(True)
-        self.selectRow(0)
         delegate = DateDelegate(self)
         self.setItemDelegateForColumn(1, delegate)
         self.setItemDelegateForColumn(2, delegate)
 
-    def setMinimumColumnWidth(self, col: int, minimum: int):
-        if self.columnWidth(col) < minimum:
-            self.setColumnWidth(col, minimum)
-
-    def populate_table_row(self, row: int, shelf: list[Any]):
-        self.blockSignals(True)
-        shelf_name = shelf[0] if shelf[0] else _("(Unnamed collection)")
-        titleColumn = QTableWidgetItem(shelf_name)
-        titleColumn.setFlags(Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled)
-        self.setItem(row, 0, titleColumn)
-        self.setItem(
-            row,
-            1,
-            DateTableWidgetItem(shelf[1], is_read_only=True, default_to_today=False),
-        )
-        self.setItem(
-            row,
-            2,
-            DateTableWidgetItem(shelf[2], is_read_only=True, default_to_today=False),
-        )
-        shelf_count = RatingTableWidgetItem(shelf[3], is_read_only=True)
-        shelf_count.setTextAlignment(
-            Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
-        )
-        self.setItem(row, 3, shelf_count)
-        self.blockSignals(False)
-
 
 def _get_shelf_count(device: KoboDevice) -> list[list[Any]]:
     connection = utils.device_database_connection(device)
@@ -281,105 +238,91 @@ def _remove_duplicate_shelves(
     shelves: list[list[Any]],
     options: cfg.FixDuplicatesOptionsStoreConfig,
 ):
+    """
+    Remove the duplicates of all the collections in shelves, which is the
+    list shown to the user by _get_shelf_count. The collection to keep for
+    each name is put into a temporary table so all duplicates are removed
+    with one statement for each kind of change.
+    """
     debug("total shelves=%d: options=%s" % (len(shelves), options))
-    starting_shelves = 0
-    shelves_removed = 0
-    finished_shelves = 0
     progressbar = ProgressBar(
         parent=gui, window_title=_("Duplicate collections in device database")
     )
-    total_shelves = len(shelves)
-    progressbar.show_with_maximum(total_shelves)
+    progressbar.show()
     progressbar.left_align_label()
+    progressbar.set_label(_("Removing duplicate collections"))
 
-    shelves_update_timestamp = (
-        "UPDATE Shelf "
-        "SET _IsDeleted = 'true', "
-        "LastModified = ? "
-        "WHERE _IsSynced = 'true' "
-        "AND Name = ? "
-        "AND CreationDate <> ?"
-    )
-    shelves_update_id = (
+    purge_shelves = options.purgeShelves
+    keep_newest = options.keepNewestShelf
+
+    starting_shelves = sum(shelf[3] for shelf in shelves)
+    finished_shelves = len(shelves)
+    # A collection is kept by its creation date, or by its id if all the
+    # duplicates have the same creation date
+    keepers = []
+    for shelf in shelves:
+        if shelf[3] > 1:
+            debug(
+                "shelf: %s, '%s', '%s', '%s', '%s'"
+                % (shelf[0], shelf[1], shelf[2], shelf[3], shelf[4])
+            )
+            timestamp = shelf[2] if keep_newest else shelf[1]
+            shelf_id = shelf[4] if shelf[1] == shelf[2] else None
+            keepers.append(
+                (shelf[0], timestamp.strftime(device.timestamp_string), shelf_id)
+            )
+    shelves_removed = sum(shelf[3] - 1 for shelf in shelves if shelf[3] > 1)
+
+    # The name of the temporary table is the only thing put into the queries
+    is_duplicate = (  # noqa: S608
+        "EXISTS ("
+        "SELECT 1 FROM temp.{table} k "
+        "WHERE k.Name = Shelf.Name "
+        "AND CASE WHEN k.Id IS NULL "
+        "THEN Shelf.CreationDate <> k.CreationDate "
+        "ELSE Shelf.Id <> k.Id END"
+        ")"
+    ).format(table=DUPLICATE_SHELVES_KEEP_TABLE)
+    shelves_update = (  # noqa: S608
         "UPDATE Shelf "
         "SET _IsDeleted = 'true', "
         "LastModified = ? "
         "WHERE _IsSynced = 'true' "
-        "AND Name = ? "
-        "AND id <> ?"
-    )
-
-    shelves_delete_timestamp = (
-        "DELETE FROM Shelf "
-        "WHERE _IsSynced = 'false' "
-        "AND Name = ? "
-        "AND CreationDate <> ? "
-        "AND _IsDeleted = 'true'"
-    )
-    shelves_delete_id = (
+        "AND {is_duplicate}"
+    ).format(is_duplicate=is_duplicate)
+    shelves_delete = (  # noqa: S608
         "DELETE FROM Shelf "
         "WHERE _IsSynced = 'false' "
-        "AND Name = ? "
-        "AND id <> ?"
-        "AND _IsDeleted = 'true'"
-    )
+        "AND _IsDeleted = 'true' "
+        "AND {is_duplicate}"
+    ).format(is_duplicate=is_duplicate)
 
     shelves_purge = "DELETE FROM Shelf WHERE _IsDeleted = 'true'"
 
-    purge_shelves = options.purgeShelves
-    keep_newest = options.keepNewestShelf
-
     with utils.device_database_connection(device) as connection:
-        cursor = connection.cursor()
-        for shelf in shelves:
-            starting_shelves += shelf[3]
-            finished_shelves += 1
-            progressbar.set_label(
-                _("Removing duplicates of collection {}").format(shelf[0])
+        if keepers:
+            connection.execute(
+                "CREATE TEMP TABLE %s (Name TEXT PRIMARY KEY, CreationDate TEXT, Id TEXT)"
+                % DUPLICATE_SHELVES_KEEP_TABLE
             )
-            progressbar.increment()
-
-            if shelf[3] > 1:
-                debug(
-                    "shelf: %s, '%s', '%s', '%s', '%s'"
-                    % (shelf[0], shelf[1], shelf[2], shelf[3], shelf[4])
+            try:
+                connection.executemany(
+                    "INSERT INTO temp.%s VALUES (?, ?, ?)"  # noqa: S608
+                    % DUPLICATE_SHELVES_KEEP_TABLE,
+                    keepers,
                 )
-                timestamp = shelf[2] if keep_newest else shelf[1]
-                shelf_id = shelf[4] if shelf[1] == shelf[2] else None
-                shelves_values = (
-                    shelf[0],
-                    timestamp.strftime(device.timestamp_string),
+                debug("shelves_update_query:", shelves_update)
+                connection.execute(
+                    shelves_update, (strftime(device.timestamp_string, time.gmtime()),)
                 )
-
-                if shelf_id:
-                    shelves_update_query = shelves_update_id
-                    shelves_delete_query = shelves_delete_id
-                    shelves_update_values = (
-                        strftime(device.timestamp_string, time.gmtime()),
-                        shelf[0],
-                        shelf_id,
-                    )
-                    shelves_delete_values = (shelf[0], shelf_id)
-                else:
-                    shelves_update_query = shelves_update_timestamp
-                    shelves_delete_query = shelves_delete_timestamp
-                    shelves_update_values = (
-                        strftime(device.timestamp_string, time.gmtime()),
-                        shelf[0],
-                        timestamp.strftime(device.timestamp_string),
-                    )
-                    shelves_delete_values = shelves_values
-                debug("marking as deleted:", shelves_update_values)
-                debug("shelves_update_query:", shelves_update_query)
-                debug("shelves_delete_query:", shelves_delete_query)
-                debug("shelves_delete_values:", shelves_delete_values)
-                cursor.execute(shelves_update_query, shelves_update_values)
-                cursor.execute(shelves_delete_query, shelves_delete_values)
-                shelves_removed += shelf[3] - 1
+                debug("shelves_delete_query:", shelves_delete)
+                connection.execute(shelves_delete)
+            finally:
+                connection.execute("DROP TABLE temp.%s" % DUPLICATE_SHELVES_KEEP_TABLE)
 
         if purge_shelves:
             debug("purging all shelves marked as deleted")
-            cursor.execute(shelves_purge)
+            connection.execute(shelves_purge)
 
     progressbar.hide()
     return starting_shelves, shelves_removed, finished_shelves
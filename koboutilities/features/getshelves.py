@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections import defaultdict
 from typing import TYPE_CHECKING, cast
 
 from calibre.gui2 import error_dialog, info_dialog, question_dialog
@@ -25,12 +26,16 @@ from ..dialogs import (
 from ..utils import debug
 
 if TYPE_CHECKING:
+    import apsw
     from calibre.devices.kobo.books import Book
     from calibre.gui2 import ui
 
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
 
+# Temporary table with the ContentIDs of the books to get the collections for
+SHELVES_CONTENT_IDS_TABLE = "kobo_utilities_shelves_ids"
+
 
 def get_shelves_from_device(
     device: KoboDevice,
@@ -151,94 +156,110 @@ def _get_shelves_from_device(
     total_books = len(books)
     progressbar.show_with_maximum(total_books)
 
-    fetch_query = (
-        "SELECT c.ContentID, sc.ShelfName "
-        "FROM content c LEFT OUTER JOIN ShelfContent sc "
-        "ON c.ContentID = sc.ContentId AND c.ContentType = 6  AND sc._IsDeleted = 'false' "
-        "JOIN Shelf s ON s.Name = sc.ShelfName AND s._IsDeleted = 'false' "
-        "WHERE c.ContentID = ? "
-        "ORDER BY c.ContentID, sc.ShelfName"
-    )
-
-    connection = utils.device_database_connection(device)
     library_db = gui.current_db
     library_config = cfg.get_library_config(library_db)
     bookshelf_column_name = library_config.shelvesColumn
     debug("bookshelf_column_name=", bookshelf_column_name)
     bookshelf_column = library_db.field_metadata[bookshelf_column_name]
-    bookshelf_column_label = library_db.field_metadata.key_to_label(
-        bookshelf_column_name
-    )
     bookshelf_column_is_multiple = (
         bookshelf_column["is_multiple"] is not None
         and len(bookshelf_column["is_multiple"]) > 0
     )
-    debug("bookshelf_column_label=", bookshelf_column_label)
     debug("bookshelf_column_is_multiple=", bookshelf_column_is_multiple)
 
-    cursor = connection.cursor()
+    progressbar.set_label(_("Getting list of collections"))
+    connection = utils.device_database_connection(device)
+    try:
+        with connection:
+            device_shelves = get_device_shelves(
+                connection,
+                [
+                    contentID
+                    for book in books
+                    for contentID in cast("list[str]", book.contentIDs)
+                ],
+            )
+    finally:
+        connection.close()
+
+    id_map = {}
     for book in books:
         progressbar.set_label(_("Getting collections for {}").format(book.title))
         progressbar.increment()
         count_books += 1
         shelf_names = []
-        update_library = False
         for contentID in cast("list[str]", book.contentIDs):
             debug("title='%s' contentId='%s'" % (book.title, contentID))
-            fetch_values = (contentID,)
-            debug("tetch_query='%s'" % (fetch_query))
-            cursor.execute(fetch_query, fetch_values)
-
-            for row in cursor:
-                debug("result=", row)
-                shelf_names.append(row[1])
-                update_library = True
-
-        if len(shelf_names) > 0:
-            books_with_shelves += 1
-        else:
+            shelf_names.extend(device_shelves.get(contentID, []))
+
+        if len(shelf_names) == 0:
             books_without_shelves += 1
             continue
-
-        if update_library and len(shelf_names) > 0:
+        books_with_shelves += 1
+
+        debug("device shelf_names='%s'" % (shelf_names))
+        debug("device set(shelf_names)='%s'" % (set(shelf_names)))
+        metadata = book.get_user_metadata(bookshelf_column_name, True)
+        assert metadata is not None
+        old_value = metadata["#value#"]
+        debug("library shelf names='%s'" % (old_value))
+        if old_value is None or set(old_value) != set(shelf_names):
+            debug("shelves are not the same")
+            shelf_names = (
+                list(set(shelf_names))
+                if bookshelf_column_is_multiple
+                else ", ".join(shelf_names)
+            )
             debug("device shelf_names='%s'" % (shelf_names))
-            debug("device set(shelf_names)='%s'" % (set(shelf_names)))
-            metadata = book.get_user_metadata(bookshelf_column_name, True)
-            assert metadata is not None
-            old_value = metadata["#value#"]
-            debug("library shelf names='%s'" % (old_value))
-            if old_value is None or set(old_value) != set(shelf_names):
-                debug("shelves are not the same")
-                shelf_names = (
-                    list(set(shelf_names))
-                    if bookshelf_column_is_multiple
-                    else ", ".join(shelf_names)
-                )
-                debug("device shelf_names='%s'" % (shelf_names))
-                if replace_shelves or old_value is None:
-                    new_value = shelf_names
-                elif bookshelf_column_is_multiple:
-                    new_value = old_value + shelf_names
-                else:
-                    new_value = old_value + ", " + shelf_names
-                debug("new shelf names='%s'" % (new_value))
-                library_db.set_custom(
-                    book.calibre_id,
-                    new_value,
-                    label=bookshelf_column_label,
-                    commit=False,
-                )
-
-        else:
-            books_with_shelves -= 1
-            books_without_shelves += 1
-
+            if replace_shelves or old_value is None:
+                new_value = shelf_names
+            elif bookshelf_column_is_multiple:
+                new_value = old_value + shelf_names
+            else:
+                new_value = old_value + ", " + shelf_names
+            debug("new shelf names='%s'" % (new_value))
+            id_map[book.calibre_id] = new_value
+
+    if len(id_map) > 0:
+        debug(
+            "Updating metadata - for column: %s number of changes=%d"
+            % (bookshelf_column_name, len(id_map))
+        )
+        library_db.new_api.set_field(bookshelf_column_name, id_map)
+        gui.iactions["Edit Metadata"].refresh_gui(list(id_map))
     library_db.commit()
     progressbar.hide()
 
     return (books_with_shelves, books_without_shelves, count_books)
 
 
+def get_device_shelves(
+    connection: apsw.Connection, content_ids: list[str]
+) -> dict[str, list[str]]:
+    """
+    Read the names of the collections each of the books is on with one query,
+    keyed by ContentID.
+    """
+    fetch_query = (  # noqa: S608
+        "SELECT c.ContentID, sc.ShelfName "
+        "FROM temp.{table} ids "
+        "JOIN content c ON c.ContentID = ids.ContentID AND c.ContentType = 6 "
+        "JOIN ShelfContent sc ON c.ContentID = sc.ContentId AND sc._IsDeleted = 'false' "
+        "JOIN Shelf s ON s.Name = sc.ShelfName AND s._IsDeleted = 'false' "
+        "ORDER BY c.ContentID, sc.ShelfName"
+    ).format(table=SHELVES_CONTENT_IDS_TABLE)
+
+    utils.fill_temp_content_ids(connection, SHELVES_CONTENT_IDS_TABLE, content_ids)
+    device_shelves: dict[str, list[str]] = defaultdict(list)
+    try:
+        for content_id, shelf_name in connection.execute(fetch_query):
+            device_shelves[content_id].append(shelf_name)
+    finally:
+        connection.execute("DROP TABLE temp.%s" % SHELVES_CONTENT_IDS_TABLE)
+    debug("books=%d, with collections=%d" % (len(content_ids), len(device_shelves)))
+    return device_shelves
+
+
 class GetShelvesFromDeviceDialog(PluginDialog):
     def __init__(self, parent: ui.Main, load_resources: LoadResources):
         super().__init__(
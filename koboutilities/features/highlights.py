@@ -0,0 +1,565 @@
+from __future__ import annotations
+
+import os
+import pickle
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable
+
+import apsw
+from calibre.constants import config_dir
+from calibre.gui2 import error_dialog, info_dialog
+from qt.core import (
+    QAbstractItemView,
+    QCheckBox,
+    QDialogButtonBox,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QTableWidget,
+    QVBoxLayout,
+)
+
+from .. import config as cfg
+from ..dialogs import ImageTitleLayout, PluginDialog, ReadOnlyTableWidgetItem
+from ..utils import DeviceDatabaseConnection, debug
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+    from calibre.gui2 import ui
+    from calibre.gui2.device import DeviceJob
+    from qt.core import QWidget
+
+    from ..config import KoboDevice
+    from ..utils import Dispatcher, LoadResources
+
+HIGHLIGHTS_ARCHIVE_NAME = "Kobo Utilities highlights.sqlite"
+# Maximum number of matches shown in the search dialog
+SEARCH_LIMIT = 500
+ANNOTATION_FILE_EXT = ".annot"
+ADOBE_NS = "{http://ns.adobe.com/adobedigitaleditions/2007}"
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+
+# Highlights are never removed from the archive, even if they are deleted on
+# the device. The full-text index is an external content table kept up to
+# date by the triggers.
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    serial_no TEXT NOT NULL PRIMARY KEY,
+    name TEXT,
+    last_change TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS annotation_files (
+    serial_no TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    PRIMARY KEY (serial_no, path)
+);
+CREATE TABLE IF NOT EXISTS highlights (
+    serial_no TEXT NOT NULL,
+    bookmark_id TEXT NOT NULL,
+    content_id TEXT NOT NULL,
+    title TEXT,
+    attribution TEXT,
+    text TEXT,
+    annotation TEXT,
+    type TEXT,
+    date_created TEXT,
+    date_modified TEXT,
+    PRIMARY KEY (serial_no, bookmark_id)
+);
+CREATE INDEX IF NOT EXISTS highlights_content_id
+    ON highlights (serial_no, content_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS highlights_fts USING fts5 (
+    text, annotation, title, attribution,
+    content = 'highlights', content_rowid = 'rowid'
+);
+CREATE TRIGGER IF NOT EXISTS highlights_ai AFTER INSERT ON highlights BEGIN
+    INSERT INTO highlights_fts (rowid, text, annotation, title, attribution)
+    VALUES (new.rowid, new.text, new.annotation, new.title, new.attribution);
+END;
+CREATE TRIGGER IF NOT EXISTS highlights_ad AFTER DELETE ON highlights BEGIN
+    INSERT INTO highlights_fts (highlights_fts, rowid, text, annotation, title, attribution)
+    VALUES ('delete', old.rowid, old.text, old.annotation, old.title, old.attribution);
+END;
+CREATE TRIGGER IF NOT EXISTS highlights_au AFTER UPDATE ON highlights BEGIN
+    INSERT INTO highlights_fts (highlights_fts, rowid, text, annotation, title, attribution)
+    VALUES ('delete', old.rowid, old.text, old.annotation, old.title, old.attribution);
+    INSERT INTO highlights_fts (rowid, text, annotation, title, attribution)
+    VALUES (new.rowid, new.text, new.annotation, new.title, new.attribution);
+END;
+"""
+
+# Rows that haven't changed are left alone so the index isn't rewritten
+UPSERT_HIGHLIGHT_QUERY = (
+    "INSERT INTO highlights "
+    "(serial_no, bookmark_id, content_id, title, attribution, text, annotation, "
+    "type, date_created, date_modified) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (serial_no, bookmark_id) DO UPDATE SET "
+    "content_id = excluded.content_id, "
+    "title = COALESCE(excluded.title, highlights.title), "
+    "attribution = COALESCE(excluded.attribution, highlights.attribution), "
+    "text = excluded.text, "
+    "annotation = excluded.annotation, "
+    "type = excluded.type, "
+    "date_modified = excluded.date_modified "
+    "WHERE highlights.text IS NOT excluded.text "
+    "OR highlights.annotation IS NOT excluded.annotation "
+    "OR highlights.type IS NOT excluded.type "
+    "OR highlights.date_modified IS NOT excluded.date_modified"
+)
+
+# The change date is cut to whole seconds as the firmware doesn't always
+# write the fractions. Rows from the second of the last harvest are read
+# again, which the upsert ignores if nothing has changed.
+BOOKMARK_CHANGE_DATE = "substr(COALESCE(b.DateModified, b.DateCreated, ''), 1, 19)"
+BOOKMARKS_QUERY = (
+    "SELECT b.BookmarkID, b.VolumeID, c.Title, c.Attribution, b.Text, b.Annotation, "
+    "{type_column}, b.DateCreated, b.DateModified, " + BOOKMARK_CHANGE_DATE + " "
+    "FROM Bookmark b "
+    "LEFT JOIN content c ON c.ContentID = b.VolumeID AND c.ContentType = 6 "
+    "WHERE (b.Text IS NOT NULL OR b.Annotation IS NOT NULL) "
+    "AND " + BOOKMARK_CHANGE_DATE + " >= ?"
+)
+
+
+@dataclass
+class Highlight:
+    device_name: str
+    content_id: str
+    title: str | None
+    attribution: str | None
+    text: str | None
+    annotation: str | None
+    type: str | None
+    date_created: str | None
+
+
+@dataclass
+class HarvestHighlightsJobOptions:
+    archive_path: str
+    serial_no: str
+    device_name: str
+    database_path: str
+    annotations_dir: str
+
+
+def highlights_archive_path() -> str:
+    return os.path.join(config_dir, "plugins", HIGHLIGHTS_ARCHIVE_NAME)
+
+
+class HighlightArchive:
+    """
+    Local archive of the highlights and notes of all devices, with a
+    full-text index for searching them.
+
+    Highlights are read from the Bookmark table of the device database and
+    from the annotation files of sideloaded books. Each harvest only reads
+    the bookmarks changed since the previous harvest of the device, and the
+    annotation files whose size or modification time has changed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.connection = apsw.Connection(path)
+        self.connection.execute(ARCHIVE_SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def harvest_bookmarks(
+        self, serial_no: str, device_name: str, device_connection: apsw.Connection
+    ) -> int:
+        columns = {
+            row[1] for row in device_connection.execute("PRAGMA table_info(Bookmark)")
+        }
+        if not columns:
+            debug("no Bookmark table in the device database")
+            return 0
+
+        since = self._last_change(serial_no)
+        query = BOOKMARKS_QUERY.format(
+            type_column="b.Type" if "Type" in columns else "NULL"
+        )
+        rows = device_connection.execute(query, (since,)).fetchall()
+        debug("bookmarks changed since '%s': %d" % (since, len(rows)))
+        last_change = max([since, *(row[9] for row in rows)])
+        with self.connection:
+            changed = self._upsert_highlights((serial_no, *row[:9]) for row in rows)
+            self.connection.execute(
+                "INSERT INTO devices (serial_no, name, last_change) VALUES (?, ?, ?) "
+                "ON CONFLICT (serial_no) DO UPDATE SET "
+                "name = excluded.name, last_change = excluded.last_change",
+                (serial_no, device_name, last_change),
+            )
+        return changed
+
+    def harvest_annotation_files(self, serial_no: str, annotations_dir: str) -> int:
+        known_files = {
+            row[0]: (row[1], row[2])
+            for row in self.connection.execute(
+                "SELECT path, size, mtime FROM annotation_files WHERE serial_no = ?",
+                (serial_no,),
+            )
+        }
+        changed_files = []
+        for root, _dirs, files in os.walk(annotations_dir):
+            for filename in files:
+                if not filename.endswith(ANNOTATION_FILE_EXT):
+                    continue
+                file_path = os.path.join(root, filename)
+                stat = os.stat(file_path)
+                relative_path = os.path.relpath(file_path, annotations_dir)
+                relative_path = relative_path.replace(os.sep, "/")
+                if known_files.get(relative_path) != (stat.st_size, stat.st_mtime_ns):
+                    changed_files.append(
+                        (relative_path, file_path, stat.st_size, stat.st_mtime_ns)
+                    )
+        debug("changed annotation files:", len(changed_files))
+
+        rows = []
+        for relative_path, file_path, _size, _mtime in changed_files:
+            content_id = (
+                "file:///mnt/onboard/" + relative_path[: -len(ANNOTATION_FILE_EXT)]
+            )
+            rows.extend(_read_annotation_file(file_path, relative_path, content_id))
+        with self.connection:
+            changed = self._upsert_highlights((serial_no, *row) for row in rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO annotation_files (serial_no, path, size, mtime) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (serial_no, relative_path, size, mtime)
+                    for relative_path, _file_path, size, mtime in changed_files
+                ],
+            )
+        return changed
+
+    def search(self, text: str, limit: int = SEARCH_LIMIT) -> list[Highlight]:
+        """
+        Return the highlights matching all words of text, best matches first.
+        The last word is matched as a prefix so results can be shown while
+        typing. Without any words the most recent highlights are returned.
+        """
+        select = (
+            "SELECT COALESCE(d.name, h.serial_no), h.content_id, h.title, "
+            "h.attribution, h.text, h.annotation, h.type, h.date_created "
+        )
+        match = fts_query(text)
+        if match:
+            cursor = self.connection.execute(
+                select + "FROM highlights_fts f "
+                "JOIN highlights h ON h.rowid = f.rowid "
+                "LEFT JOIN devices d ON d.serial_no = h.serial_no "
+                "WHERE highlights_fts MATCH ? "
+                "ORDER BY f.rank "
+                "LIMIT ?",
+                (match, limit),
+            )
+        else:
+            cursor = self.connection.execute(
+                select + "FROM highlights h "
+                "LEFT JOIN devices d ON d.serial_no = h.serial_no "
+                "ORDER BY h.date_created DESC "
+                "LIMIT ?",
+                (limit,),
+            )
+        return [Highlight(*row) for row in cursor]
+
+    def count(self) -> int:
+        row = self.connection.execute("SELECT COUNT(*) FROM highlights").fetchone()
+        assert row is not None
+        return row[0]
+
+    def _upsert_highlights(self, rows: Iterable[tuple[Any, ...]]) -> int:
+        # Returns the number of new or changed highlights
+        changed = 0
+        for row in rows:
+            self.connection.execute(UPSERT_HIGHLIGHT_QUERY, row)
+            changed += self.connection.changes()
+        return changed
+
+    def _last_change(self, serial_no: str) -> str:
+        for (last_change,) in self.connection.execute(
+            "SELECT last_change FROM devices WHERE serial_no = ?", (serial_no,)
+        ):
+            return last_change
+        return ""
+
+
+def fts_query(text: str) -> str:
+    # Every word is quoted so the user doesn't have to know the FTS5 syntax
+    words = ['"%s"' % word.replace('"', '""') for word in text.split()]
+    if words:
+        words[-1] += "*"
+    return " ".join(words)
+
+
+def _read_annotation_file(
+    file_path: str, relative_path: str, content_id: str
+) -> list[tuple[Any, ...]]:
+    from calibre.utils.xml_parse import safe_xml_fromstring
+
+    try:
+        with open(file_path, "rb") as annotation_file:
+            root = safe_xml_fromstring(annotation_file.read())
+    except Exception as e:
+        debug("could not read annotation file '%s': %s" % (file_path, e))
+        return []
+
+    title = root.findtext(f"{ADOBE_NS}publication/{DC_NS}title")
+    attribution = root.findtext(f"{ADOBE_NS}publication/{DC_NS}creator")
+    rows = []
+    for index, annotation in enumerate(root.iter(f"{ADOBE_NS}annotation")):
+        text = annotation.findtext(
+            f"{ADOBE_NS}target/{ADOBE_NS}fragment/{ADOBE_NS}text"
+        )
+        note = annotation.findtext(f"{ADOBE_NS}content/{ADOBE_NS}text")
+        if not text and not note:
+            continue
+        date = annotation.findtext(f"{DC_NS}date")
+        rows.append(
+            (
+                annotation.findtext(f"{DC_NS}identifier")
+                or "%s#%d" % (relative_path, index),
+                content_id,
+                title,
+                attribution,
+                text,
+                note,
+                "note" if note else "highlight",
+                date,
+                date,
+            )
+        )
+    return rows
+
+
+def search_highlights(gui: ui.Main, load_resources: LoadResources) -> None:
+    dlg = HighlightSearchDialog(gui, load_resources)
+    dlg.exec()
+
+
+def harvest_highlights(
+    device: KoboDevice,
+    gui: ui.Main,
+    dispatcher: Dispatcher,
+    load_resources: LoadResources,
+) -> None:
+    del load_resources
+    _queue_harvest_job(device, gui, dispatcher, show_result=True)
+
+
+def auto_harvest_highlights(
+    device: KoboDevice, gui: ui.Main, dispatcher: Dispatcher
+) -> None:
+    _queue_harvest_job(device, gui, dispatcher, show_result=False)
+
+
+def _queue_harvest_job(
+    device: KoboDevice, gui: ui.Main, dispatcher: Dispatcher, show_result: bool
+) -> None:
+    options = HarvestHighlightsJobOptions(
+        highlights_archive_path(),
+        device.version_info.serial_no,
+        device.name,
+        device.db_path,
+        str(
+            device.driver.normalize_path(device.path + "Digital Editions/Annotations/")
+        ),
+    )
+    debug("options=", options)
+    desc = _("Adding highlights to the archive")
+    gui.device_manager.create_job(
+        harvest_highlights_job,
+        dispatcher(
+            partial(_harvest_highlights_completed, gui=gui, show_result=show_result)
+        ),
+        description=desc,
+        args=[pickle.dumps(options)],
+    )
+    gui.status_bar.show_message(_("Kobo Utilities") + " - " + desc, 3000)
+
+
+def harvest_highlights_job(
+    options_raw: bytes,
+    notification: Callable[[float, str], Any] = lambda _x, y: y,
+) -> tuple[int, int]:
+    options: HarvestHighlightsJobOptions = pickle.loads(options_raw)  # noqa: S301
+    archive = HighlightArchive(options.archive_path)
+    try:
+        notification(0.1, _("Reading bookmarks"))
+        # Only read from, so the database isn't copied back to the device
+        connection = DeviceDatabaseConnection(
+            options.database_path, options.database_path, is_db_copied=False
+        )
+        try:
+            with connection:
+                bookmarks = archive.harvest_bookmarks(
+                    options.serial_no, options.device_name, connection
+                )
+        finally:
+            connection.close()
+
+        notification(0.6, _("Reading annotation files"))
+        annotations = archive.harvest_annotation_files(
+            options.serial_no, options.annotations_dir
+        )
+    finally:
+        archive.close()
+    return bookmarks, annotations
+
+
+def _harvest_highlights_completed(job: DeviceJob, gui: ui.Main, show_result: bool):
+    if job.failed:
+        gui.job_exception(
+            job, dialog_title=_("Failed to add highlights to the archive")
+        )
+        return
+    bookmarks, annotations = job.result
+    debug("bookmarks=%d, annotations=%d" % (bookmarks, annotations))
+    gui.status_bar.show_message(
+        _("Kobo Utilities") + " - " + _("Highlights added to the archive"), 3000
+    )
+    if show_result:
+        info_dialog(
+            gui,
+            _("Kobo Utilities") + " - " + _("Highlights archive"),
+            _(
+                "New or changed highlights added to the archive:\n\tFrom the device database={0}\n\tFrom annotation files={1}"
+            ).format(bookmarks, annotations),
+            show=True,
+        )
+
+
+class HighlightsTableWidget(QTableWidget):
+    def __init__(self, parent: QWidget):
+        QTableWidget.__init__(self, parent)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.setAlternatingRowColors(True)
+        self.setWordWrap(True)
+        header_labels = [
+            _("Highlight"),
+            _("Note"),
+            _("Title"),
+            _("Author(s)"),
+            _("Device"),
+            _("Date"),
+        ]
+        self.setColumnCount(len(header_labels))
+        self.setHorizontalHeaderLabels(header_labels)
+        horiz_header = self.horizontalHeader()
+        assert horiz_header is not None
+        horiz_header.setStretchLastSection(True)
+        self.setColumnWidth(0, 300)
+        self.setColumnWidth(1, 200)
+        self.setColumnWidth(2, 150)
+        self.setColumnWidth(3, 100)
+        self.setMinimumSize(750, 0)
+
+    def populate_table(self, highlights: list[Highlight]):
+        self.setSortingEnabled(False)
+        self.setRowCount(len(highlights))
+        for row, highlight in enumerate(highlights):
+            for column, value in enumerate(
+                (
+                    highlight.text,
+                    highlight.annotation,
+                    highlight.title,
+                    highlight.attribution,
+                    highlight.device_name,
+                    (highlight.date_created or "")[:10],
+                )
+            ):
+                self.setItem(row, column, ReadOnlyTableWidgetItem(value))
+        self.resizeRowsToContents()
+
+
+class HighlightSearchDialog(PluginDialog):
+    def __init__(self, parent: ui.Main, load_resources: LoadResources):
+        super().__init__(
+            parent,
+            "kobo utilities plugin:highlight search dialog",
+        )
+        self.archive = HighlightArchive(highlights_archive_path())
+        self.initialize_controls(load_resources)
+        self.harvest_on_connect_checkbox.setChecked(
+            cfg.plugin_prefs.highlightArchive.harvestOnConnect
+        )
+        self.search("")
+
+        # Cause our dialog size to be restored from prefs or created on first usage
+        self.resize_dialog()
+
+    def initialize_controls(self, load_resources: LoadResources):
+        self.setWindowTitle(_("Search highlights"))
+        layout = QVBoxLayout(self)
+        self.setLayout(layout)
+        title_layout = ImageTitleLayout(
+            self,
+            "images/icon.png",
+            _("Search highlights"),
+            load_resources,
+            "SearchHighlights",
+        )
+        layout.addLayout(title_layout)
+
+        search_layout = QHBoxLayout()
+        layout.addLayout(search_layout)
+        search_label = QLabel(_("Search:"), self)
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setToolTip(
+            _("Find highlights and notes containing all of these words.")
+        )
+        self.search_edit.textChanged.connect(self.search)
+        search_label.setBuddy(self.search_edit)
+        search_layout.addWidget(search_label)
+        search_layout.addWidget(self.search_edit)
+
+        self.highlights_table = HighlightsTableWidget(self)
+        layout.addWidget(self.highlights_table)
+        self.result_label = QLabel(self)
+        layout.addWidget(self.result_label)
+
+        self.harvest_on_connect_checkbox = QCheckBox(
+            _("Add highlights to the archive when a device is connected"), self
+        )
+        self.harvest_on_connect_checkbox.setToolTip(
+            _(
+                "Add new and changed highlights and notes to the archive each time a device is connected. Highlights deleted on the device are kept."
+            )
+        )
+        layout.addWidget(self.harvest_on_connect_checkbox)
+
+        # Dialog buttons
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+    def search(self, text: str) -> None:
+        try:
+            highlights = self.archive.search(text)
+        except apsw.Error as e:
+            error_dialog(
+                self,
+                _("Search failed"),
+                _("The highlights archive could not be searched."),
+                det_msg=str(e),
+                show=True,
+            )
+            return
+        self.highlights_table.populate_table(highlights)
+        self.result_label.setText(
+            _("{0} of {1} highlights shown").format(
+                len(highlights), self.archive.count()
+            )
+        )
+
+    def done(self, r: int) -> None:
+        cfg.plugin_prefs.highlightArchive.harvestOnConnect = (
+            self.harvest_on_connect_checkbox.isChecked()
+        )
+        self.archive.close()
+        super().done(r)
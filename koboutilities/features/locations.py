@@ -15,7 +15,6 @@ from calibre.gui2.library.delegates import DateDelegate
 from calibre.utils.ipc.job import ParallelJob
 from calibre.utils.ipc.server import Server
 from qt.core import (
-    QAbstractItemView,
     QCheckBox,
     QDialogButtonBox,
     QGridLayout,
@@ -24,8 +23,6 @@ from qt.core import (
     QProgressDialog,
     QRadioButton,
     Qt,
-    QTableWidget,
-    QTableWidgetItem,
     QTimer,
     QVBoxLayout,
 )
@@ -34,13 +31,11 @@ from .. import config as cfg
 from .. import utils
 from ..constants import BOOK_CONTENTTYPE, GUI_NAME, MIMETYPE_KOBO
 from ..dialogs import (
-    AuthorsTableWidgetItem,
-    CheckableTableWidgetItem,
-    DateTableWidgetItem,
     ImageTitleLayout,
     PluginDialog,
     ProgressBar,
-    RatingTableWidgetItem,
+    ResultsTableModel,
+    ResultsTableView,
 )
 from ..utils import DeviceDatabaseConnection, debug
 
@@ -2038,7 +2033,7 @@ class ShowReadingPositionChangesDialog(PluginDialog):
             QLabel(_("Device: {0}").format(self.deviceName)), 0, 2, 1, 1
         )
 
-        self.reading_locations_table = ShowReadingPositionChangesTableWidget(
+        self.reading_locations_table = ShowReadingPositionChangesTableView(
             self, self.device, self.db
         )
         table_layout.addWidget(self.reading_locations_table, 1, 0, 1, 4)
@@ -2083,17 +2078,10 @@ class ShowReadingPositionChangesDialog(PluginDialog):
         )
         cfg.set_library_config(self.gui.current_db, library_config)
 
-        for i in range(len(self.reading_locations)):
-            self.reading_locations_table.selectRow(i)
-            item = self.reading_locations_table.item(i, 0)
-            assert item is not None
-            enabled = item.checkState() == Qt.CheckState.Checked
-            debug("row=%d, enabled=%s" % (i, enabled))
-            if not enabled:
-                item = self.reading_locations_table.item(i, 7)
-                assert item is not None
-                book_id = item.data(Qt.ItemDataRole.DisplayRole)
-                debug("row=%d, book_id=%s" % (i, book_id))
+        checked_book_ids = self.reading_locations_table.checked_book_ids()
+        for book_id in list(self.reading_locations):
+            if book_id not in checked_book_ids:
+                debug("book_id=%s not selected" % book_id)
                 del self.reading_locations[book_id]
         self.accept()
         return
@@ -2108,15 +2096,17 @@ class ShowReadingPositionChangesDialog(PluginDialog):
         self.select_books_checkbox.setEnabled(not checked)
 
 
-class ShowReadingPositionChangesTableWidget(QTableWidget):
+class ShowReadingPositionChangesTableView(ResultsTableView):
+    CHECK_COLUMN_NO = 0
+    BOOK_ID_COLUMN_NO = 7
+
     def __init__(
         self,
         parent: ShowReadingPositionChangesDialog,
         device: KoboDevice,
         db: LibraryDatabase,
     ):
-        QTableWidget.__init__(self, parent)
-        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        ResultsTableView.__init__(self, parent)
         self.db = db
 
         custom_columns = cfg.get_column_names(parent.gui, device)
@@ -2124,9 +2114,6 @@ class ShowReadingPositionChangesTableWidget(QTableWidget):
         self.last_read_column = custom_columns.last_read
 
     def populate_table(self, reading_positions: dict[int, dict[str, Any]]):
-        self.clear()
-        self.setAlternatingRowColors(True)
-        self.setRowCount(len(reading_positions))
         header_labels = [
             "",
             _("Title"),
@@ -2137,18 +2124,56 @@ class ShowReadingPositionChangesTableWidget(QTableWidget):
             _("New date"),
             _("Book ID"),
         ]
-        self.setColumnCount(len(header_labels))
-        self.setHorizontalHeaderLabels(header_labels)
-        vert_header = self.verticalHeader()
-        assert vert_header is not None
-        vert_header.setDefaultSectionSize(24)
-        horiz_header = self.horizontalHeader()
-        assert horiz_header is not None
-        horiz_header.setStretchLastSection(True)
 
         debug("reading_positions=", reading_positions)
-        for row, (book_id, reading_position) in enumerate(reading_positions.items()):
-            self.populate_table_row(row, book_id, reading_position)
+        # Get the library values for all books at once instead of the
+        # metadata of each book
+        book_ids = list(reading_positions)
+        new_api = self.db.new_api
+        authors = new_api.all_field_for("authors", book_ids)
+        author_sorts = new_api.all_field_for("author_sort", book_ids)
+        current_percents = (
+            new_api.all_field_for(self.kobo_percentRead_column, book_ids)
+            if self.kobo_percentRead_column
+            else {}
+        )
+        current_last_reads = (
+            new_api.all_field_for(self.last_read_column, book_ids)
+            if self.last_read_column
+            else {}
+        )
+
+        rows = []
+        for book_id, reading_position in reading_positions.items():
+            new_percentRead = 0
+            if reading_position["ReadStatus"] == 1:
+                new_percentRead = reading_position["___PercentRead"]
+            elif reading_position["ReadStatus"] == 2:
+                new_percentRead = 100
+            rows.append(
+                (
+                    None,
+                    reading_position["Title"],
+                    " & ".join(authors.get(book_id) or ()),
+                    current_percents.get(book_id),
+                    new_percentRead,
+                    current_last_reads.get(book_id) or None,
+                    utils.convert_kobo_date(reading_position["DateLastRead"]),
+                    book_id,
+                    author_sorts.get(book_id),
+                )
+            )
+
+        self.set_results_model(
+            ResultsTableModel(
+                header_labels,
+                rows,
+                sort_columns={2: 8},
+                right_aligned_columns=(3, 4),
+                dimmed_columns=(2,),
+                check_column=self.CHECK_COLUMN_NO,
+            )
+        )
 
         self.resizeColumnToContents(0)
         self.resizeColumnToContents(1)
@@ -2158,87 +2183,18 @@ class ShowReadingPositionChangesTableWidget(QTableWidget):
         self.resizeColumnToContents(4)
         self.resizeColumnToContents(5)
         self.resizeColumnToContents(6)
-        self.hideColumn(7)
-        self.setSortingEnabled(True)
-        self.selectRow(0)
+        self.hideColumn(self.BOOK_ID_COLUMN_NO)
         delegate = DateDelegate(self)
         self.setItemDelegateForColumn(5, delegate)
         self.setItemDelegateForColumn(6, delegate)
 
-    def setMinimumColumnWidth(self, col: int, minimum: int):
-        if self.columnWidth(col) < minimum:
-            self.setColumnWidth(col, minimum)
-
-    def populate_table_row(
-        self, row: int, book_id: int, reading_position: dict[str, Any]
-    ):
-        self.blockSignals(True)
-
-        book = self.db.get_metadata(book_id, index_is_id=True, get_cover=False)
-
-        self.setItem(row, 0, CheckableTableWidgetItem(True))
-
-        titleColumn = QTableWidgetItem(reading_position["Title"])
-        titleColumn.setFlags(Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEnabled)
-        self.setItem(row, 1, titleColumn)
-
-        authorColumn = AuthorsTableWidgetItem(book.authors, book.author_sort)
-        self.setItem(row, 2, authorColumn)
-
-        current_percentRead = None
-        if self.kobo_percentRead_column:
-            metadata = book.get_user_metadata(self.kobo_percentRead_column, True)
-            assert metadata is not None
-            current_percentRead = metadata["#value#"]
-        current_percent = RatingTableWidgetItem(current_percentRead, is_read_only=True)
-        current_percent.setTextAlignment(
-            Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
-        )
-        self.setItem(row, 3, current_percent)
-
-        new_percentRead = 0
-        if reading_position["ReadStatus"] == 1:
-            new_percentRead = reading_position["___PercentRead"]
-        elif reading_position["ReadStatus"] == 2:
-            new_percentRead = 100
-        new_percent = RatingTableWidgetItem(new_percentRead, is_read_only=True)
-        new_percent.setTextAlignment(
-            Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
-        )
-        self.setItem(row, 4, new_percent)
-
-        current_last_read = None
-        if self.last_read_column:
-            metadata = book.get_user_metadata(self.last_read_column, True)
-            assert metadata is not None
-            current_last_read = metadata["#value#"]
-        if current_last_read:
-            self.setItem(
-                row,
-                5,
-                DateTableWidgetItem(
-                    current_last_read, is_read_only=True, default_to_today=False
-                ),
-            )
-        if reading_position["DateLastRead"] is not None:
-            self.setItem(
-                row,
-                6,
-                DateTableWidgetItem(
-                    utils.convert_kobo_date(reading_position["DateLastRead"]),
-                    is_read_only=True,
-                    default_to_today=False,
-                ),
-            )
-        book_idColumn = RatingTableWidgetItem(book_id)
-        self.setItem(row, 7, book_idColumn)
-        self.blockSignals(False)
+    def checked_book_ids(self) -> set[int]:
+        model = cast("ResultsTableModel", self.model())
+        return {row[self.BOOK_ID_COLUMN_NO] for row in model.checked_rows()}
 
     def toggle_checkmarks(self, select: Qt.CheckState):
-        for i in range(self.rowCount()):
-            item = self.item(i, 0)
-            assert item is not None
-            item.setCheckState(select)
+        model = cast("ResultsTableModel", self.model())
+        model.set_all_checked(select == Qt.CheckState.Checked)
 
 
 ####################
@@ -43,7 +43,6 @@ from ..dialogs import (
     DateTableWidgetItem,
     ImageTitleLayout,
     PluginDialog,
-    ProgressBar,
     ReadOnlyTableWidgetItem,
 )
 from ..features import metadata
@@ -66,7 +65,6 @@ def manage_series_on_device(
     dispatcher: Dispatcher,
     load_resources: LoadResources,
 ) -> None:
-    del dispatcher
     current_view = gui.current_view()
     if current_view is None or len(current_view.selectionModel().selectedRows()) == 0:
         return
@@ -130,33 +128,30 @@ def manage_series_on_device(
             debug("book.series=", book.series)
             debug("book.series_index=%s" % book.series_index)
 
-    if options.title or options.series or options.published_date:
-        progressbar = ProgressBar(
-            parent=gui,
-            window_title=_("Updating series information on device"),
-            on_top=True,
-        )
-        progressbar.show()
-        updated_books, unchanged_books, not_on_device_books, count_books = (
-            metadata.do_update_metadata(books, device, gui, progressbar, options)
+    if not (options.title or options.series or options.published_date):
+        info_dialog(
+            gui,
+            _("Kobo Utilities") + " - " + _("Manage series on device"),
+            _("No changes made to series information."),
+            show=True,
         )
+        return
+
+    view_db = current_view.model().db
 
+    def sync_booklists():
         debug("about to call sync_booklists")
-        USBMS.sync_booklists(device.driver, (current_view.model().db, None, None))
-        result_message = (
-            _("Update summary:")
-            + "\n\t"
-            + _(
-                "Books updated={0}\n\tUnchanged books={1}\n\tBooks not on device={2}\n\tTotal books={3}"
-            ).format(updated_books, unchanged_books, not_on_device_books, count_books)
-        )
-    else:
-        result_message = _("No changes made to series information.")
-    info_dialog(
+        USBMS.sync_booklists(device.driver, (view_db, None, None))
+
+    metadata.queue_update_metadata_job(
+        device,
         gui,
-        _("Kobo Utilities") + " - " + _("Manage series on device"),
-        result_message,
-        show=True,
+        dispatcher,
+        books,
+        options,
+        _("Updating series information for {0} books").format(len(books)),
+        summary_title=_("Manage series on device"),
+        completed=sync_booklists,
     )
 
 
@@ -1,14 +1,20 @@
 from __future__ import annotations
 
 import datetime as dt
+import hashlib
 import os
+import pickle
 import time
-from typing import TYPE_CHECKING, cast
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, cast
 
 from calibre import strftime
 from calibre.constants import DEBUG
 from calibre.gui2 import error_dialog, info_dialog
 from calibre.gui2.dialogs.template_dialog import TemplateDialog
+from calibre.utils.config import JSONConfig
 from qt.core import (
     QCheckBox,
     QComboBox,
@@ -34,9 +40,11 @@ from ..dialogs import (
 from ..utils import debug
 
 if TYPE_CHECKING:
+    import apsw
     from calibre.devices.kobo.books import Book
     from calibre.ebooks.metadata.book.base import Metadata
     from calibre.gui2 import ui
+    from calibre.gui2.device import DeviceJob
 
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
@@ -47,6 +55,12 @@ DATE_COLUMNS = [
     "pubdate",
 ]
 
+# Fingerprints of the metadata last sent to each book, by device serial number
+FINGERPRINTS_FILE = "plugins/Kobo Utilities metadata fingerprints"
+
+# Temporary table with the ContentIDs of the books being updated
+METADATA_CONTENT_IDS_TABLE = "kobo_utilities_metadata_ids"
+
 READING_DIRECTIONS = {
     _("Default"): "default",
     _("RTL"): "rtl",
@@ -54,13 +68,20 @@ READING_DIRECTIONS = {
 }
 
 
+@dataclass
+class UpdateMetadataJobOptions:
+    metadata_options: cfg.MetadataOptionsConfig
+    plugboards: dict[str, Any]
+    rating_column: str
+    use_fingerprints: bool
+
+
 def update_metadata(
     device: KoboDevice,
     gui: ui.Main,
     dispatcher: Dispatcher,
     load_resources: LoadResources,
 ) -> None:
-    del dispatcher
     current_view = gui.current_view()
     if current_view is None or len(current_view.selectionModel().selectedRows()) == 0:
         return
@@ -92,15 +113,73 @@ def update_metadata(
     if dlg.result() != dlg.DialogCode.Accepted:
         return
 
-    progressbar = ProgressBar(parent=gui, window_title=_("Updating metadata on device"))
-    progressbar.show()
-    progressbar.set_label(
-        _("Number of books to update metadata for: {0}").format(len(books))
+    queue_update_metadata_job(
+        device,
+        gui,
+        dispatcher,
+        books,
+        cfg.plugin_prefs.MetadataOptions,
+        _("Updating metadata for {0} books").format(len(books)),
+        use_fingerprints=True,
     )
-    options = cfg.plugin_prefs.MetadataOptions
-    updated_books, unchanged_books, not_on_device_books, count_books = (
-        do_update_metadata(books, device, gui, progressbar, options)
+
+
+def queue_update_metadata_job(
+    device: KoboDevice,
+    gui: ui.Main,
+    dispatcher: Dispatcher,
+    books: list[Book],
+    options: cfg.MetadataOptionsConfig,
+    description: str,
+    summary_title: str | None = None,
+    use_fingerprints: bool = False,
+    completed: Callable[[], None] | None = None,
+) -> None:
+    """
+    Update the metadata of the books on the device in a device job. The
+    books and options are snapshotted here, so later changes in the library
+    don't affect the job. completed is called in the GUI thread once the job
+    has succeeded, before the summary is shown.
+    """
+    debug("Start")
+    job_options = UpdateMetadataJobOptions(
+        options,
+        gui.library_view.model().db.prefs.get("plugboards", {}),
+        cfg.get_column_names(gui, device).rating,
+        use_fingerprints,
+    )
+    debug("job_options=", job_options)
+
+    args = [device, pickle.dumps(books), pickle.dumps(job_options)]
+    gui.device_manager.create_job(
+        update_metadata_job,
+        dispatcher(
+            partial(
+                _update_metadata_completed,
+                gui=gui,
+                summary_title=summary_title or _("Device library updated"),
+                completed=completed,
+            )
+        ),
+        description=description,
+        args=args,
     )
+    gui.status_bar.show_message(GUI_NAME + " - " + description, 3000)
+
+
+def _update_metadata_completed(
+    job: DeviceJob,
+    gui: ui.Main,
+    summary_title: str,
+    completed: Callable[[], None] | None,
+) -> None:
+    if job.failed:
+        gui.job_exception(job, dialog_title=_("Failed to update metadata on device"))
+        return
+    if completed is not None:
+        completed()
+
+    updated_books, unchanged_books, not_on_device_books, count_books = job.result
     result_message = (
         _("Update summary:")
         + "\n\t"
@@ -110,22 +189,38 @@ def update_metadata(
     )
     info_dialog(
         gui,
-        _("Kobo Utilities") + " - " + _("Device library updated"),
+        _("Kobo Utilities") + " - " + summary_title,
         result_message,
         show=True,
     )
 
 
+def update_metadata_job(
+    device: KoboDevice,
+    books_raw: bytes,
+    job_options_raw: bytes,
+    notification: Callable[[float, str], Any] = lambda _x, y: y,
+) -> tuple[int, int, int, int]:
+    books: list[Book] = pickle.loads(books_raw)  # noqa: S301
+    job_options: UpdateMetadataJobOptions = pickle.loads(job_options_raw)  # noqa: S301
+    return do_update_metadata(books, device, job_options, notification)
+
+
 def do_update_metadata(
     books: list[Book],
     device: KoboDevice,
-    gui: ui.Main,
-    progressbar: ProgressBar,
-    options: cfg.MetadataOptionsConfig,
-):
+    job_options: UpdateMetadataJobOptions,
+    notification: Callable[[float, str], Any] = lambda _x, y: y,
+) -> tuple[int, int, int, int]:
+    """
+    Update the metadata of the books on the device. If the job options enable
+    fingerprints, books whose library metadata and device row haven't changed since
+    the last update with the same options are skipped.
+    """
     from calibre.ebooks.metadata import authors_to_string
     from calibre.utils.localization import canonicalize_lang, lang_as_iso639_1
 
+    options = job_options.metadata_options
     debug("number books=", len(books), "options=", options)
 
     updated_books = 0
@@ -134,33 +229,64 @@ def do_update_metadata(
     count_books = 0
 
     total_books = len(books)
-    progressbar.show_with_maximum(total_books)
+    notification(0.01, _("Reading device database"))
 
     from calibre.library.save_to_disk import find_plugboard
 
-    plugboards = gui.library_view.model().db.prefs.get("plugboards", {})
+    plugboards = job_options.plugboards
     debug("plugboards=", plugboards)
+    # The plugboard only depends on the format, so it is looked up once for each
+    format_plugboards: dict[str, Any] = {}
+    synopsis_renderer = None
+    if options.description and options.descriptionUseTemplate:
+        synopsis_renderer = _SynopsisRenderer(options.descriptionTemplate)
+
+    # The reading status and file timestamps can change on the device without
+    # the row's sync time changing, so these options always compare
+    fingerprints = None
+    if job_options.use_fingerprints and not (
+        options.setRreadingStatus
+        or (
+            options.set_sync_date
+            and options.sync_date_library_date == cfg.TOKEN_FILE_TIMESTAMP
+        )
+    ):
+        fingerprints = MetadataFingerprints(device.version_info.serial_no)
+        fingerprint_options = repr(
+            (
+                sorted(
+                    (name, getattr(options, name))
+                    for name in cfg.MetadataOptionsConfig.__annotations__
+                ),
+                plugboards,
+                job_options.rating_column,
+            )
+        )
     debug(
         "self.device.driver.__class__.__name__=",
         device.driver.__class__.__name__,
     )
 
-    rating_update = (
-        "UPDATE ratings "
-        "SET Rating = ?, "
-        "DateModified = ? "
-        "WHERE ContentID  = ?"
-    )  # fmt: skip
-    rating_insert = (
+    rating_upsert = (
         "INSERT INTO ratings ("
         "Rating, "
         "DateModified, "
         "ContentID "
         ")"
-        "VALUES (?, ?, ?)"
+        "VALUES (?, ?, ?) "
+        "ON CONFLICT (ContentID) DO UPDATE SET "
+        "Rating = excluded.Rating, "
+        "DateModified = excluded.DateModified"
     )  # fmt: skip
     rating_delete = "DELETE FROM ratings WHERE ContentID = ?"
 
+    # The changes are collected while comparing and written at the end.
+    # Content updates are grouped by the columns they set so that each group
+    # can be written with a single executemany.
+    content_updates: dict[tuple[str, ...], list[list[Any]]] = defaultdict(list)
+    rating_upserts: list[list[Any]] = []
+    rating_deletes: list[tuple[str]] = []
+
     series_id_query = (
         "SELECT DISTINCT Series, SeriesID "
         "FROM content "
@@ -171,7 +297,6 @@ def do_update_metadata(
     )
 
     with utils.device_database_connection(device, use_row_factory=True) as connection:
-        test_query = generate_metadata_query(device)
         cursor = connection.cursor()
         kobo_series_dict = {}
         if device.supports_series_list:
@@ -182,29 +307,52 @@ def do_update_metadata(
                 kobo_series_dict[row["Series"]] = row["SeriesID"]
             debug("kobo_series_list=", kobo_series_dict)
 
+        books_content_ids: list[tuple[Book, list[str]]] = []
         for book in books:
-            progressbar.set_label(_("Updating metadata for {}").format(book.title))
-            progressbar.increment()
-
+            content_ids = []
             for contentID in cast("list[str]", book.contentIDs):
-                debug("searching for contentId='%s'" % (contentID))
                 if not contentID:
                     contentID = utils.contentid_from_path(
                         device, book.path, BOOK_CONTENTTYPE
                     )
-                debug("options.update_KoboEpubs=", options.update_KoboEpubs)
-                debug("contentID.startswith('file')=", contentID.startswith("file"))
                 if not options.update_KoboEpubs and not contentID.startswith("file"):
-                    debug("skipping book")
+                    debug("skipping book with contentId='%s'" % (contentID))
                     continue
+                content_ids.append(contentID)
+            books_content_ids.append((book, content_ids))
+
+        device_rows = _get_device_rows(
+            connection,
+            device,
+            [
+                contentID
+                for _book, content_ids in books_content_ids
+                for contentID in content_ids
+            ],
+        )
+
+        for book_number, (book, content_ids) in enumerate(books_content_ids, 1):
+            notification(
+                book_number / total_books,
+                _("Updating metadata for {}").format(book.title),
+            )
+            fingerprint = None
+            if fingerprints is not None:
+                fingerprint = _metadata_fingerprint(book, fingerprint_options)
 
+            for contentID in content_ids:
                 count_books += 1
-                query_values = (contentID,)
-                cursor.execute(test_query, query_values)
-                try:
-                    result = next(cursor)
-                except StopIteration:
-                    result = None
+                result = device_rows.get(contentID)
+                if (
+                    result is not None
+                    and fingerprints is not None
+                    and fingerprints.is_unchanged(
+                        contentID, fingerprint, result["___SyncTime"]
+                    )
+                ):
+                    debug("unchanged since last update contentId='%s'" % (contentID))
+                    unchanged_books += 1
+                    continue
                 if result is not None:
                     debug("found contentId='%s'" % (contentID))
                     debug("    result=", result)
@@ -217,11 +365,13 @@ def do_update_metadata(
                     if options.usePlugboard and plugboards is not None:
                         book_format = os.path.splitext(contentID)[1][1:]
                         debug("format='%s'" % (book_format))
-                        plugboard = find_plugboard(
-                            device.driver.__class__.__name__,
-                            book_format,
-                            plugboards,
-                        )
+                        if book_format not in format_plugboards:
+                            format_plugboards[book_format] = find_plugboard(
+                                device.driver.__class__.__name__,
+                                book_format,
+                                plugboards,
+                            )
+                        plugboard = format_plugboards[book_format]
                         debug("plugboard=", plugboard)
 
                         if plugboard is not None:
@@ -252,10 +402,8 @@ def do_update_metadata(
                         book, "series_index_string", None
                     )
 
-                    update_query = "UPDATE content SET "
                     update_values = []
                     set_clause_columns = []
-                    changes_found = False
                     rating_values = []
                     rating_change_query = None
 
@@ -272,9 +420,8 @@ def do_update_metadata(
                     if options.description:
                         new_comments = library_comments = newmi.comments
                         if options.descriptionUseTemplate:
-                            new_comments = _render_synopsis(
-                                newmi, book, template=options.descriptionTemplate
-                            )
+                            assert synopsis_renderer is not None
+                            new_comments = synopsis_renderer.render(newmi, book)
                             if len(new_comments) == 0:
                                 new_comments = library_comments
                         if (
@@ -326,7 +473,7 @@ def do_update_metadata(
 
                     debug("options.rating= ", options.rating)
                     if options.rating:
-                        rating_column = cfg.get_column_names(gui, device).rating
+                        rating_column = job_options.rating_column
 
                         if rating_column:
                             if rating_column == "rating":
@@ -357,13 +504,8 @@ def do_update_metadata(
                             if rating != result["Rating"]:
                                 if not rating:
                                     rating_change_query = rating_delete
-                                    rating_values = (contentID,)
-                                elif (
-                                    result["DateModified"] is None
-                                ):  # If the date modified column does not have a value, there is no rating column
-                                    rating_change_query = rating_insert
                                 else:
-                                    rating_change_query = rating_update
+                                    rating_change_query = rating_upsert
 
                     debug("options.series=", options.series)
                     if device.supports_series and options.series:
@@ -564,50 +706,153 @@ def do_update_metadata(
                             set_clause_columns.append("FirstTimeReading=?")
                             update_values.append(options.readingStatus < 2)
 
-                    if len(set_clause_columns) > 0:
-                        update_query += ",".join(set_clause_columns)
-                        changes_found = True
+                    if fingerprints is not None:
+                        new_sync_time = result["___SyncTime"]
+                        if "___SyncTime=?" in set_clause_columns:
+                            new_sync_time = update_values[
+                                set_clause_columns.index("___SyncTime=?")
+                            ]
+                        fingerprints.set(contentID, fingerprint, new_sync_time)
 
-                    if not (changes_found or rating_change_query):
+                    if not (set_clause_columns or rating_change_query):
                         debug(
                             "no changes found to selected metadata. No changes being made."
                         )
                         unchanged_books += 1
                         continue
 
-                    update_query += " WHERE ContentID = ? AND BookID IS NULL"
-                    update_values.append(contentID)
-                    debug("update_query=%s" % update_query)
+                    debug("set_clause_columns=", set_clause_columns)
                     debug("update_values= ", update_values)
-                    try:
-                        if changes_found:
-                            cursor.execute(update_query, update_values)
-
-                        if rating_change_query:
-                            debug("rating_change_query=%s" % rating_change_query)
-                            debug("rating_values= ", rating_values)
-                            cursor.execute(rating_change_query, rating_values)
-
-                        updated_books += 1
-                    except:
-                        debug("    Database Exception:  Unable to set series info")
-                        raise
+                    if set_clause_columns:
+                        update_values.append(contentID)
+                        content_updates[tuple(set_clause_columns)].append(update_values)
+                    if rating_change_query == rating_delete:
+                        rating_deletes.append((contentID,))
+                    elif rating_change_query == rating_upsert:
+                        rating_upserts.append(rating_values)
+                    updated_books += 1
                 else:
                     debug(
                         "no match for title='%s' contentId='%s'"
                         % (book.title, contentID)
                     )
                     not_on_device_books += 1
+        _write_metadata_changes(
+            connection,
+            content_updates,
+            [(rating_upsert, rating_upserts), (rating_delete, rating_deletes)],
+        )
+
+    # Only remember what was written once the changes have been committed
+    if fingerprints is not None:
+        fingerprints.commit()
+
     debug(
         "Update summary: Books updated=%d, unchanged books=%d, not on device=%d, Total=%d"
         % (updated_books, unchanged_books, not_on_device_books, count_books)
     )
 
-    progressbar.hide()
-
     return (updated_books, unchanged_books, not_on_device_books, count_books)
 
 
+class MetadataFingerprints:
+    """
+    For each book on a device, the fingerprint of the library metadata the
+    last update compared with it and the sync time of the device row after
+    that update.
+    """
+
+    def __init__(self, serial_no: str):
+        self.serial_no = serial_no
+        self.store = JSONConfig(FINGERPRINTS_FILE)
+        self.fingerprints: dict[str, list[str | None]] = dict(
+            self.store.get(serial_no, {})
+        )
+
+    def is_unchanged(
+        self, content_id: str, fingerprint: str | None, sync_time: str | None
+    ) -> bool:
+        return self.fingerprints.get(content_id) == [fingerprint, sync_time]
+
+    def set(
+        self, content_id: str, fingerprint: str | None, sync_time: str | None
+    ) -> None:
+        self.fingerprints[content_id] = [fingerprint, sync_time]
+
+    def commit(self) -> None:
+        self.store[self.serial_no] = self.fingerprints
+
+
+def _metadata_fingerprint(book: Book, fingerprint_options: str) -> str:
+    """
+    Hash of the library metadata an update can write to the device, together
+    with the options that decide what is written.
+    """
+    user_metadata = book.get_all_user_metadata(False)
+    values = (
+        fingerprint_options,
+        book.title,
+        book.title_sort,
+        book.authors,
+        book.author_sort,
+        book.comments,
+        book.publisher,
+        book.pubdate,
+        book.isbn,
+        book.languages,
+        book.rating,
+        book.series,
+        book.series_index,
+        book.timestamp,
+        book.last_modified,
+        sorted(
+            (key, metadata.get("#value#")) for key, metadata in user_metadata.items()
+        ),
+    )
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()  # noqa: S324
+
+
+def _write_metadata_changes(
+    connection: apsw.Connection,
+    content_updates: dict[tuple[str, ...], list[list[Any]]],
+    rating_changes: list[tuple[str, list[Any]]],
+) -> None:
+    """
+    Write the collected changes. They are made inside the transaction of
+    the caller's connection, so either all books are updated or none.
+    """
+    cursor = connection.cursor()
+    for set_clause_columns, update_values in content_updates.items():
+        set_clause = ",".join(set_clause_columns)
+        update_query = (
+            f"UPDATE content SET {set_clause} WHERE ContentID = ? AND BookID IS NULL"  # noqa: S608
+        )
+        debug("update_query=%s, books=%d" % (update_query, len(update_values)))
+        cursor.executemany(update_query, update_values)
+    for rating_query, rating_values in rating_changes:
+        if rating_values:
+            debug("rating_query=%s, books=%d" % (rating_query, len(rating_values)))
+            cursor.executemany(rating_query, rating_values)
+
+
+def _get_device_rows(
+    connection: apsw.Connection, device: KoboDevice, content_ids: list[str]
+) -> dict[str, dict[str, Any]]:
+    """
+    Read the device rows of all books to update with one query, keyed by
+    ContentID.
+    """
+    utils.fill_temp_content_ids(connection, METADATA_CONTENT_IDS_TABLE, content_ids)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(generate_metadata_query(device))
+        device_rows = {row["ContentID"]: row for row in cursor}
+    finally:
+        connection.execute("DROP TABLE temp.%s" % METADATA_CONTENT_IDS_TABLE)
+    debug("books=%d, found on device=%d" % (len(content_ids), len(device_rows)))
+    return device_rows
+
+
 def generate_metadata_query(device: KoboDevice):
     debug(
         "self.device.supports_series=%s, self.device.supports_series_list%s"
@@ -615,6 +860,7 @@ def generate_metadata_query(device: KoboDevice):
     )
 
     test_query_columns = []
+    test_query_columns.append("c1.ContentID")
     test_query_columns.append("Title")
     test_query_columns.append("Attribution")
     test_query_columns.append("Description")
@@ -657,58 +903,94 @@ def generate_metadata_query(device: KoboDevice):
 
     test_query = "SELECT "
     test_query += ",".join(test_query_columns)
-    test_query += " FROM content c1 "
+    test_query += " FROM temp.%s ids " % METADATA_CONTENT_IDS_TABLE
+    test_query += "JOIN content c1 ON c1.ContentID = ids.ContentID "
     if device.supports_ratings:
         test_query += " left outer join ratings r on c1.ContentID = r.ContentID "
 
-    test_query += "WHERE c1.BookId IS NULL AND c1.ContentID = ?"
+    test_query += "WHERE c1.BookId IS NULL"
     debug("test_query=%s" % test_query)
     return test_query
 
 
-def _render_synopsis(mi: Metadata, book: Book, template: str | None = None):
-    from xml.sax.saxutils import escape
+class _SynopsisRenderer:
+    """
+    Renders book descriptions from a template. Everything that doesn't
+    depend on the book, such as the template itself, the formatter and the
+    output profile, is prepared once so that one renderer can be used for
+    all books of an update.
+    """
 
-    from calibre.customize.ui import output_profiles
-    from calibre.ebooks.conversion.config import load_defaults
-    from calibre.ebooks.oeb.transforms.jacket import (
-        SafeFormatter,
-        Series,
-        Tags,
-        get_rating,
-    )
-    from calibre.library.comments import comments_to_html
-    from calibre.utils.date import is_date_undefined
+    def __init__(self, template: str | None = None):
+        if not template:
+            try:
+                data = P("kobo_template.xhtml", data=True)
+                assert isinstance(data, bytes), f"data is of type {type(data)}"
+                template = data.decode("utf-8")
+            except Exception:
+                template = ""
+        debug("template=", template)
+
+        colon_pos = template.find(":")
+        self.jacket_style = False
+        if colon_pos > 0:
+            if template.startswith(("template:", "plugboard:")):
+                self.jacket_style = False
+                template = template[colon_pos + 1 :]
+            elif template.startswith("jacket:"):
+                self.jacket_style = True
+                template = template[colon_pos + 1 :]
+        self.template = template
+
+        if self.jacket_style:
+            from calibre.customize.ui import output_profiles
+            from calibre.ebooks.conversion.config import load_defaults
+            from calibre.ebooks.oeb.transforms.jacket import SafeFormatter
+
+            debug("using jacket style template.")
+            ps = load_defaults("page_setup")
+            op = ps.get("output_profile", "default")
+            opmap = {x.short_name: x for x in output_profiles()}
+            self.output_profile = opmap.get(op, opmap["default"])
+            self.jacket_formatter = SafeFormatter()
+        else:
+            from calibre.ebooks.metadata.book.formatter import (
+                SafeFormatter as TemplateFormatter,
+            )
+
+            self.template_formatter = TemplateFormatter()
+            # The formatter keeps the compiled template in here between books,
+            # under the column name given to safe_format
+            self.template_cache: dict[str, Any] = {}
 
-    debug('start - book.comments="%s"' % book.comments)
+    def render(self, mi: Metadata, book: Book) -> str:
+        debug('start - book.comments="%s"' % book.comments)
+        if self.jacket_style:
+            return self._render_jacket(mi)
 
-    if not template:
+        debug("before - mi.comments=", mi.comments)
         try:
-            data = P("kobo_template.xhtml", data=True)
-            assert isinstance(data, bytes), f"data is of type {type(data)}"
-            template = data.decode("utf-8")
-        except Exception:
-            template = ""
-    debug("template=", template)
-
-    colon_pos = template.find(":")
-    jacket_style = False
-    if colon_pos > 0:
-        if template.startswith(("template:", "plugboard:")):
-            jacket_style = False
-            template = template[colon_pos + 1 :]
-        elif template.startswith("jacket:"):
-            jacket_style = True
-            template = template[colon_pos + 1 :]
-
-    if jacket_style:
-        debug("using jacket style template.")
-
-        ps = load_defaults("page_setup")
-        op = ps.get("output_profile", "default")
-        opmap = {x.short_name: x for x in output_profiles()}
-        output_profile = opmap.get(op, opmap["default"])
+            mi.comments = self.template_formatter.safe_format(
+                self.template,
+                book,
+                "PLUGBOARD TEMPLATE ERROR",
+                book,
+                column_name="comments",
+                template_cache=self.template_cache,
+            )
+        except Exception as e:
+            debug("template failed:", e)
+        debug("after - mi.comments=", mi.comments)
+        return cast("str", mi.comments)
+
+    def _render_jacket(self, mi: Metadata) -> str:
+        from xml.sax.saxutils import escape
 
+        from calibre.ebooks.oeb.transforms.jacket import Series, Tags, get_rating
+        from calibre.library.comments import comments_to_html
+        from calibre.utils.date import is_date_undefined
+
+        output_profile = self.output_profile
         rating = get_rating(
             mi.rating,
             output_profile.ratings_char,
@@ -779,20 +1061,9 @@ def _render_synopsis(mi: Metadata, book: Book, template: str | None = None):
         args["_genre_label"] = args.get("_genre_label", "{_genre_label}")
         args["_genre"] = args.get("_genre", "{_genre}")
 
-        formatter = SafeFormatter()
-        rendered_comments = formatter.format(template, **args)
+        rendered_comments = self.jacket_formatter.format(self.template, **args)
         debug("generated_html=", rendered_comments)
-
-    else:
-        pb = [(template, "comments")]
-        debug("before - mi.comments=", mi.comments)
-        debug("book.comments=", book.comments)
-        debug("pb=", pb)
-        mi.template_to_attribute(book, pb)
-        debug("after - mi.comments=", mi.comments)
-        rendered_comments = mi.comments
-
-    return rendered_comments
+        return rendered_comments
 
 
 class UpdateMetadataOptionsDialog(PluginDialog):
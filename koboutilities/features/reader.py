@@ -1,11 +1,11 @@
 from __future__ import annotations
 
+import os
 import time
 from configparser import ConfigParser
 from functools import partial
 from typing import TYPE_CHECKING, cast
 
-from calibre.devices.kobo.driver import KOBO
 from calibre.gui2 import info_dialog, question_dialog
 from qt.core import (
     QCheckBox,
@@ -34,6 +34,12 @@ if TYPE_CHECKING:
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
 
+# Parsed Kobo eReader.conf files by path, with the modification time and
+# size of the file when it was read
+_config_files: dict[str, tuple[tuple[int, int] | None, ConfigParser]] = {}
+
+READER_FONTS_CONTENT_IDS_TABLE = "kobo_utilities_reader_fonts_content_ids"
+
 LINE_SPACINGS = [1.3, 1.35, 1.4, 1.6, 1.775, 1.9, 2, 2.2, 3]
 LINE_SPACINGS_020901 = [
     1,
@@ -462,19 +468,7 @@ class ReaderOptionsDialog(PluginDialog):
         return self.lock_margins_checkbox.isChecked()
 
     def get_device_settings(self):
-        koboConfig = ConfigParser(allow_no_value=True)
-        device = cast("ui.Main", self.parent()).device_manager.connected_device
-        assert isinstance(device, KOBO), (
-            f"device is of an unexpected type: {type(device)}"
-        )
-        device_path = device._main_prefix
-        debug("device_path=", device_path)
-        assert device_path is not None
-        normalized_path = device.normalize_path(
-            device_path + ".kobo/Kobo/Kobo eReader.conf"
-        )
-        assert normalized_path is not None
-        koboConfig.read(normalized_path)
+        koboConfig, _config_file_path = get_config_file(self.device)
 
         device_settings = cfg.ReadingOptionsConfig()
         if koboConfig.has_option("Reading", cfg.KEY_READING_FONT_FAMILY):
@@ -584,44 +578,19 @@ class JustificationChoiceComboBox(QComboBox):
 def _update_config_reader_settings(
     device: KoboDevice, options: cfg.ReadingOptionsConfig
 ):
-    config_section_reading = "Reading"
-
-    koboConfig, config_file_path = get_config_file(device)
-
-    if not koboConfig.has_section(config_section_reading):
-        koboConfig.add_section(config_section_reading)
-
-    koboConfig.set(
-        config_section_reading,
-        cfg.KEY_READING_FONT_FAMILY,
-        options.readingFontFamily,
+    update_config_file(
+        device,
+        {
+            "Reading": {
+                cfg.KEY_READING_FONT_FAMILY: options.readingFontFamily,
+                cfg.KEY_READING_ALIGNMENT: options.readingAlignment,
+                cfg.KEY_READING_FONT_SIZE: "%g" % options.readingFontSize,
+                cfg.KEY_READING_LINE_HEIGHT: "%g" % options.readingLineHeight,
+                cfg.KEY_READING_LEFT_MARGIN: "%g" % options.readingLeftMargin,
+                cfg.KEY_READING_RIGHT_MARGIN: "%g" % options.readingRightMargin,
+            }
+        },
     )
-    koboConfig.set(
-        config_section_reading, cfg.KEY_READING_ALIGNMENT, options.readingAlignment
-    )
-    koboConfig.set(
-        config_section_reading,
-        cfg.KEY_READING_FONT_SIZE,
-        "%g" % options.readingFontSize,
-    )
-    koboConfig.set(
-        config_section_reading,
-        cfg.KEY_READING_LINE_HEIGHT,
-        "%g" % options.readingLineHeight,
-    )
-    koboConfig.set(
-        config_section_reading,
-        cfg.KEY_READING_LEFT_MARGIN,
-        "%g" % options.readingLeftMargin,
-    )
-    koboConfig.set(
-        config_section_reading,
-        cfg.KEY_READING_RIGHT_MARGIN,
-        "%g" % options.readingRightMargin,
-    )
-
-    with open(config_file_path, "w") as config_file:
-        koboConfig.write(config_file)
 
 
 def _set_reader_fonts(
@@ -634,27 +603,21 @@ def _set_reader_fonts(
     updated_fonts = 0
     added_fonts = 0
     deleted_fonts = 0
-    count_books = 0
-
-    debug("connected to device database")
+    count_books = len(contentIDs)
 
-    test_query = (
-        "SELECT 1 "
-        "FROM content_settings "
-        "WHERE ContentType = ? "
-        "AND ContentId = ?"
-    )  # fmt: skip
+    # The settings of all books are changed with a statement each over a
+    # temporary table of the books, instead of statements for every book
+    selected_books = (
+        "SELECT ContentID FROM temp.%s" % READER_FONTS_CONTENT_IDS_TABLE  # noqa: S608
+    )
     delete_query = (
         "DELETE "
         "FROM content_settings "
         "WHERE ContentType = ? "
-        "AND ContentId = ?"
+        "AND ContentId IN (" + selected_books + ")"
     )  # fmt: skip
 
-    add_query = None
-    add_values = ()
-    update_query = None
-    update_values = ()
+    settings_values = ()
     if not delete:
         font_face = options.readingFontFamily
         justification = options.readingAlignment.lower()
@@ -665,44 +628,7 @@ def _set_reader_fonts(
         line_spacing = options.readingLineHeight
         left_margins = options.readingLeftMargin
         right_margins = options.readingRightMargin
-
-        add_query = (
-            "INSERT INTO content_settings ( "
-            '"ContentType", '
-            '"DateModified", '
-            '"ReadingFontFamily", '
-            '"ReadingFontSize", '
-            '"ReadingAlignment", '
-            '"ReadingLineHeight", '
-            '"ReadingLeftMargin", '
-            '"ReadingRightMargin", '
-            '"ContentID" '
-            ") "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
-        )
-        add_values = (
-            BOOK_CONTENTTYPE,
-            time.strftime(device.timestamp_string, time.gmtime()),
-            font_face,
-            font_size,
-            justification,
-            line_spacing,
-            left_margins,
-            right_margins,
-        )
-        update_query = (
-            "UPDATE content_settings "
-            'SET "DateModified" = ?, '
-            '"ReadingFontFamily" = ?, '
-            '"ReadingFontSize" = ?, '
-            '"ReadingAlignment" = ?, '
-            '"ReadingLineHeight" = ?, '
-            '"ReadingLeftMargin" = ?, '
-            '"ReadingRightMargin" = ? '
-            "WHERE ContentType = ?  "
-            "AND ContentId = ?"
-        )
-        update_values = (
+        settings_values = (
             time.strftime(device.timestamp_string, time.gmtime()),
             font_face,
             font_size,
@@ -710,45 +636,138 @@ def _set_reader_fonts(
             line_spacing,
             left_margins,
             right_margins,
-            BOOK_CONTENTTYPE,
         )
+        debug(f"settings values: {settings_values}")
+
+    add_query = (  # noqa: S608
+        "INSERT INTO content_settings ( "
+        '"ContentType", '
+        '"DateModified", '
+        '"ReadingFontFamily", '
+        '"ReadingFontSize", '
+        '"ReadingAlignment", '
+        '"ReadingLineHeight", '
+        '"ReadingLeftMargin", '
+        '"ReadingRightMargin", '
+        '"ContentID" '
+        ") "
+        "SELECT ?, ?, ?, ?, ?, ?, ?, ?, t.ContentID "
+        "FROM temp.%s t "
+        "WHERE NOT EXISTS ( "
+        "SELECT 1 FROM content_settings cs "
+        "WHERE cs.ContentType = ? "
+        "AND cs.ContentId = t.ContentID"
+        ")"
+    ) % READER_FONTS_CONTENT_IDS_TABLE
+    update_query = (
+        "UPDATE content_settings "
+        'SET "DateModified" = ?, '
+        '"ReadingFontFamily" = ?, '
+        '"ReadingFontSize" = ?, '
+        '"ReadingAlignment" = ?, '
+        '"ReadingLineHeight" = ?, '
+        '"ReadingLeftMargin" = ?, '
+        '"ReadingRightMargin" = ? '
+        "WHERE ContentType = ?  "
+        "AND ContentId IN (" + selected_books + ")"
+    )
 
     with utils.device_database_connection(device) as connection:
-        cursor = connection.cursor()
-        for contentID in contentIDs:
-            test_values = (BOOK_CONTENTTYPE, contentID)
+        debug("connected to device database")
+        utils.fill_temp_content_ids(
+            connection, READER_FONTS_CONTENT_IDS_TABLE, contentIDs
+        )
+        try:
             if delete:
-                debug(f"Deleting settings for '{contentID}'")
-                cursor.execute(delete_query, test_values)
-                deleted_fonts += 1
-            elif update_query is not None and add_query is not None:
-                cursor.execute(test_query, test_values)
-                try:
-                    result = next(cursor)
-                    debug("found existing row:", result)
-                    if not options.doNotUpdateIfSet:
-                        debug(
-                            f"Updating settings for '{contentID}' with values: {update_values}"
-                        )
-                        cursor.execute(update_query, (*update_values, contentID))
-                        updated_fonts += 1
-                except StopIteration:
-                    debug(
-                        f"Adding settings for '{contentID}' with values: {add_values}"
+                connection.execute(delete_query, (BOOK_CONTENTTYPE,))
+                deleted_fonts = connection.changes()
+            else:
+                # Existing settings are updated first, so the books added
+                # afterwards aren't counted as updated
+                if not options.doNotUpdateIfSet:
+                    connection.execute(
+                        update_query, (*settings_values, BOOK_CONTENTTYPE)
                     )
-                    cursor.execute(add_query, (*add_values, contentID))
-                    added_fonts += 1
-            count_books += 1
-
+                    updated_fonts = connection.changes()
+                connection.execute(
+                    add_query,
+                    (BOOK_CONTENTTYPE, *settings_values, BOOK_CONTENTTYPE),
+                )
+                added_fonts = connection.changes()
+        finally:
+            connection.execute("DROP TABLE temp.%s" % READER_FONTS_CONTENT_IDS_TABLE)
+
+    debug(
+        "updated=%d, added=%d, deleted=%d, books=%d"
+        % (updated_fonts, added_fonts, deleted_fonts, count_books)
+    )
     return updated_fonts, added_fonts, deleted_fonts, count_books
 
 
 def get_config_file(device: KoboDevice) -> tuple[ConfigParser, str]:
+    """
+    Return the parsed Kobo eReader.conf of the device and its path. The
+    parsed file is kept until the size or modification time of the file
+    changes, so it must not be changed. Use update_config_file instead.
+    """
+    config_file_path = _config_file_path(device)
+    return _read_config_file(config_file_path), config_file_path
+
+
+def update_config_file(device: KoboDevice, settings: dict[str, dict[str, str]]):
+    """
+    Change settings in Kobo eReader.conf with a single write of the file.
+    settings maps section names to the options to set in the section. The
+    file is replaced in one step, so the device never sees a partly
+    written file.
+    """
+    config_file_path = _config_file_path(device)
+    koboConfig = _read_config_file(config_file_path)
+    try:
+        for section, options in settings.items():
+            if not koboConfig.has_section(section):
+                koboConfig.add_section(section)
+            for option, value in options.items():
+                koboConfig.set(section, option, value)
+
+        tmp_path = config_file_path + ".tmp"
+        with open(tmp_path, "w") as config_file:
+            koboConfig.write(config_file)
+        os.replace(tmp_path, config_file_path)
+        _config_files[config_file_path] = (
+            _config_file_state(config_file_path),
+            koboConfig,
+        )
+    except Exception:
+        # The cached copy might have been changed, so read the file again
+        # the next time
+        _config_files.pop(config_file_path, None)
+        raise
+
+
+def _config_file_path(device: KoboDevice) -> str:
     assert device.driver._main_prefix is not None
     config_file_path = device.driver.normalize_path(
         device.driver._main_prefix + ".kobo/Kobo/Kobo eReader.conf"
     )
     assert config_file_path is not None
+    return config_file_path
+
+
+def _config_file_state(config_file_path: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(config_file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _read_config_file(config_file_path: str) -> ConfigParser:
+    state = _config_file_state(config_file_path)
+    cached = _config_files.get(config_file_path)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+
     koboConfig = ConfigParser(allow_no_value=True)
     koboConfig.optionxform = str  # type: ignore[reportAttributeAccessIssue]
     debug("config_file_path=", config_file_path)
@@ -758,7 +777,8 @@ def get_config_file(device: KoboDevice) -> tuple[ConfigParser, str]:
         debug("exception=", e)
         raise
 
-    return koboConfig, config_file_path
+    _config_files[config_file_path] = (state, koboConfig)
+    return koboConfig
 
 
 def get_contentIDs_for_selected(gui: ui.Main) -> list[str]:
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, cast
 
-from calibre.gui2 import error_dialog, info_dialog
+from calibre.gui2 import error_dialog
 from qt.core import QDialogButtonBox, QVBoxLayout
 
 from .. import config as cfg
@@ -11,7 +11,6 @@ from ..constants import GUI_NAME
 from ..dialogs import (
     ImageTitleLayout,
     PluginDialog,
-    ProgressBar,
     ReadingStatusGroupBox,
 )
 from ..features import metadata
@@ -30,7 +29,6 @@ def change_reading_status(
     dispatcher: Dispatcher,
     load_resources: LoadResources,
 ) -> None:
-    del dispatcher
     current_view = gui.current_view()
     if current_view is None or len(current_view.selectionModel().selectedRows()) == 0:
         return
@@ -55,26 +53,13 @@ def change_reading_status(
     options.subtitle = False
     debug("options:", options)
 
-    progressbar = ProgressBar(
-        parent=gui, window_title=_("Changing reading status on device")
-    )
-    progressbar.show()
-
-    updated_books, unchanged_books, not_on_device_books, count_books = (
-        metadata.do_update_metadata(books, device, gui, progressbar, options)
-    )
-    result_message = (
-        _("Update summary:")
-        + "\n\t"
-        + _(
-            "Books updated={0}\n\tUnchanged books={1}\n\tBooks not on device={2}\n\tTotal books={3}"
-        ).format(updated_books, unchanged_books, not_on_device_books, count_books)
-    )
-    info_dialog(
+    metadata.queue_update_metadata_job(
+        device,
         gui,
-        _("Kobo Utilities") + " - " + _("Device library updated"),
-        result_message,
-        show=True,
+        dispatcher,
+        books,
+        options,
+        _("Changing reading status for {0} books").format(len(books)),
     )
 
 
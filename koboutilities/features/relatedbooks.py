@@ -1,11 +1,18 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any
+import hashlib
+import pickle
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable
 
 from calibre.gui2 import info_dialog, question_dialog
+from calibre.utils.config import JSONConfig
 from qt.core import (
     QAbstractItemView,
     QButtonGroup,
+    QCheckBox,
     QDialogButtonBox,
     QGroupBox,
     QHBoxLayout,
@@ -21,15 +28,43 @@ from .. import config as cfg
 from .. import utils
 from ..constants import GUI_NAME
 from ..dialogs import ImageTitleLayout, PluginDialog, ProgressBar, RatingTableWidgetItem
-from ..utils import debug
+from ..utils import DeviceDatabaseConnection, debug
 
 if TYPE_CHECKING:
+    import apsw
     from calibre.gui2 import ui
+    from calibre.gui2.device import DeviceJob
     from qt.core import QWidget
 
     from ..config import KoboDevice
     from ..utils import Dispatcher, LoadResources
 
+# Hashes of the books in each series or author group, by device serial number
+RELATED_BOOKS_STATE_FILE = "plugins/Kobo Utilities related books"
+
+# Temporary tables with the selected series or authors and their books
+RELATED_BOOKS_NAMES_TABLE = "kobo_utilities_related_names"
+RELATED_BOOKS_MEMBERS_TABLE = "kobo_utilities_related_books"
+
+
+@dataclass
+class RelatedBooksResult:
+    categories_count: int
+    unchanged_count: int
+    books_count: int
+    tabs_count: int
+    # Hashes of the books in each group after the update
+    group_hashes: dict[str, str]
+
+
+@dataclass
+class SetRelatedBooksJobOptions:
+    database_path: str
+    device_database_path: str
+    is_db_copied: bool
+    related_books_type: int
+    group_hashes: dict[str, str]
+
 
 def set_related_books(
     device: KoboDevice,
@@ -54,15 +89,15 @@ def set_related_books(
         related_types = dlg.get_related_types()
         debug("related_types=", related_types)
 
-        categories_count, books_count = _set_related_books(
+        categories_count, unchanged_count, books_count, tabs_count = _set_related_books(
             device, gui, related_types, options
         )
         result_message = (
             _("Update summary:")
             + "\n\t"
-            + _("Number of series or authors={0}\n\tNumber of books={1}").format(
-                categories_count, books_count
-            )
+            + _(
+                "Number of series or authors={0}\n\tUnchanged series or authors={1}\n\tNumber of books={2}\n\tNumber of related books set={3}"
+            ).format(categories_count, unchanged_count, books_count, tabs_count)
         )
 
     info_dialog(
@@ -76,8 +111,14 @@ def set_related_books(
 def _get_related_books_count(
     device: KoboDevice, related_category: int
 ) -> list[dict[str, Any]]:
-    debug("order_shelf_type:", related_category)
     connection = utils.device_database_connection(device)
+    return _query_related_books_count(connection, related_category)
+
+
+def _query_related_books_count(
+    connection: apsw.Connection, related_category: int
+) -> list[dict[str, Any]]:
+    debug("order_shelf_type:", related_category)
     related_books = []
 
     series_query = (
@@ -122,79 +163,279 @@ def _set_related_books(
 ):
     debug("related_books:", related_books, " options:", options)
 
-    categories_count = 0
-    books_count = 0
-
     progressbar = ProgressBar(parent=gui, window_title=_("Set related books"))
-    total_related_books = len(related_books)
-    progressbar.show_with_maximum(total_related_books)
+    progressbar.show()
     progressbar.left_align_label()
+    progressbar.set_label(_("Setting related books"))
+
+    related_books_type = options.relatedBooksType.value
+    with utils.device_database_connection(device) as connection:
+        result = _update_related_books(
+            connection,
+            related_books,
+            related_books_type,
+            _get_group_hashes(device, related_books_type),
+        )
+    # Only remember the groups once the changes have been committed
+    _save_group_hashes(device, related_books_type, result.group_hashes)
 
-    series_query = (
-        "SELECT c.ContentID, c.Title, c.Attribution, Series, SeriesNumber "
-        "FROM content c "
-        "WHERE c.ContentType = 6 "
-        "AND Series = ? "
-        "AND ContentID LIKE 'file%' "
+    progressbar.hide()
+    debug("end")
+    return (
+        result.categories_count,
+        result.unchanged_count,
+        result.books_count,
+        result.tabs_count,
     )
-    author_query = (
-        "SELECT c.ContentID, c.Title, c.Attribution, Series, SeriesNumber "
-        "FROM content c "
-        "WHERE c.ContentType = 6 "
-        "AND Attribution = ? "
-        "AND ContentID LIKE 'file%' "
+
+
+def _get_group_hashes(device: KoboDevice, related_books_type: int) -> dict[str, str]:
+    device_state = JSONConfig(RELATED_BOOKS_STATE_FILE).get(
+        device.version_info.serial_no, {}
     )
-    if options.relatedBooksType == cfg.RelatedBooksType.Series:
-        get_query = series_query
+    if device_state.get("type") != related_books_type:
+        return {}
+    return dict(device_state.get("groups", {}))
+
+
+def _save_group_hashes(
+    device: KoboDevice, related_books_type: int, group_hashes: dict[str, str]
+) -> None:
+    state = JSONConfig(RELATED_BOOKS_STATE_FILE)
+    state[device.version_info.serial_no] = {
+        "type": related_books_type,
+        "groups": group_hashes,
+    }
+
+
+def _update_related_books(
+    connection: apsw.Connection,
+    related_books: list[dict[str, Any]],
+    related_books_type: int,
+    group_hashes: dict[str, str],
+) -> RelatedBooksResult:
+    """
+    Replace the related books of all books in the selected series or author
+    groups. The books of the groups are collected in a temporary table, and
+    their tabs are deleted and rebuilt with one statement each.
+
+    group_hashes has a hash of the books in each group from the last run.
+    Groups whose books haven't changed since then are skipped, and the tabs
+    of groups that no longer have more than one book are deleted. The hashes
+    after the update are returned with the counts.
+    """
+    categories_count = len(related_books)
+    group_names = [
+        (related_type["name"],)
+        for related_type in related_books
+        if related_type["count"] > 1
+    ]
+    if related_books_type == cfg.RelatedBooksType.Series:
+        group_column = "Series"
     else:
-        get_query = author_query
-    insert_query = "INSERT INTO volume_tabs VALUES ( ?, ? )"
-    delete_query = "DELETE FROM volume_tabs WHERE tabId = ? "
-
-    with utils.device_database_connection(device, use_row_factory=True) as connection:
-        cursor = connection.cursor()
-        for related_type in related_books:
-            progressbar.set_label(
-                _("Setting related books for {}").format(related_type["name"])
+        group_column = "Attribution"
+
+    group_hashes = dict(group_hashes)
+    current_groups = {
+        related_type["name"]
+        for related_type in _query_related_books_count(connection, related_books_type)
+        if related_type["count"] > 1
+    }
+    removed_groups = [(name,) for name in group_hashes if name not in current_groups]
+
+    # Only the names of the temporary tables and the group column are put
+    # into the queries
+    members_query = (  # noqa: S608
+        "INSERT INTO temp.{members} (ContentID, GroupName) "
+        "SELECT c.ContentID, c.{column} "
+        "FROM content c JOIN temp.{names} n ON c.{column} = n.Name "
+        "WHERE c.ContentType = 6 "
+        "AND c.ContentID LIKE 'file%'"
+    ).format(
+        members=RELATED_BOOKS_MEMBERS_TABLE,
+        names=RELATED_BOOKS_NAMES_TABLE,
+        column=group_column,
+    )
+    name_insert_query = "INSERT OR IGNORE INTO temp.%s VALUES (?)" % (  # noqa: S608
+        RELATED_BOOKS_NAMES_TABLE
+    )
+    members_list_query = (  # noqa: S608
+        "SELECT GroupName, ContentID FROM temp.{members} ORDER BY GroupName, ContentID"
+    ).format(members=RELATED_BOOKS_MEMBERS_TABLE)
+    unchanged_delete_query = (  # noqa: S608
+        "DELETE FROM temp.{members} WHERE GroupName = ?"
+    ).format(members=RELATED_BOOKS_MEMBERS_TABLE)
+    delete_query = (  # noqa: S608
+        "DELETE FROM volume_tabs WHERE tabId IN (SELECT ContentID FROM temp.{members})"
+    ).format(members=RELATED_BOOKS_MEMBERS_TABLE)
+    insert_query = (  # noqa: S608
+        "INSERT INTO volume_tabs "
+        "SELECT v.ContentID, t.ContentID "
+        "FROM temp.{members} t JOIN temp.{members} v "
+        "ON v.GroupName = t.GroupName AND v.ContentID <> t.ContentID"
+    ).format(members=RELATED_BOOKS_MEMBERS_TABLE)
+    # Tabs from books outside the groups to books in them, left over from
+    # books that have moved to another series or author
+    stale_delete_query = (  # noqa: S608
+        "DELETE FROM volume_tabs "
+        "WHERE volumeId IN (SELECT ContentID FROM temp.{members}) "
+        "AND tabId LIKE 'file%' "
+        "AND NOT EXISTS ("
+        "SELECT 1 FROM content t JOIN content v ON v.{column} = t.{column} "
+        "WHERE t.ContentID = volume_tabs.tabId "
+        "AND v.ContentID = volume_tabs.volumeId"
+        ")"
+    ).format(members=RELATED_BOOKS_MEMBERS_TABLE, column=group_column)
+    # Tabs of books that have been removed from the device
+    orphans_delete_query = (
+        "DELETE FROM volume_tabs "
+        "WHERE (tabId LIKE 'file%' "
+        "AND tabId NOT IN (SELECT ContentID FROM content)) "
+        "OR (volumeId LIKE 'file%' "
+        "AND volumeId NOT IN (SELECT ContentID FROM content))"
+    )
+
+    connection.execute(
+        "CREATE TEMP TABLE %s (Name TEXT PRIMARY KEY)" % RELATED_BOOKS_NAMES_TABLE
+    )
+    connection.execute(
+        "CREATE TEMP TABLE %s (ContentID TEXT PRIMARY KEY, GroupName TEXT)"
+        % RELATED_BOOKS_MEMBERS_TABLE
+    )
+    try:
+        if removed_groups:
+            debug("removed groups:", removed_groups)
+            connection.executemany(name_insert_query, removed_groups)
+            connection.execute(members_query)
+            connection.execute(delete_query)
+            connection.execute(stale_delete_query)
+            for table in (RELATED_BOOKS_NAMES_TABLE, RELATED_BOOKS_MEMBERS_TABLE):
+                connection.execute("DELETE FROM temp.%s" % table)  # noqa: S608
+        connection.execute(orphans_delete_query)
+
+        connection.executemany(name_insert_query, group_names)
+        connection.execute(members_query)
+
+        group_members: dict[str, list[str]] = defaultdict(list)
+        for group_name, content_id in connection.execute(members_list_query):
+            group_members[group_name].append(content_id)
+        new_hashes = {
+            group_name: _group_hash(content_ids)
+            for group_name, content_ids in group_members.items()
+        }
+        unchanged_groups = [
+            (group_name,)
+            for group_name, group_hash in new_hashes.items()
+            if group_hashes.get(group_name) == group_hash
+        ]
+        connection.executemany(unchanged_delete_query, unchanged_groups)
+
+        books_count = sum(
+            len(content_ids)
+            for group_name, content_ids in group_members.items()
+            if group_hashes.get(group_name) != new_hashes[group_name]
+        )
+        connection.execute(delete_query)
+        connection.execute(stale_delete_query)
+        connection.execute(insert_query)
+        tabs_count = connection.changes()
+    finally:
+        connection.execute("DROP TABLE temp.%s" % RELATED_BOOKS_NAMES_TABLE)
+        connection.execute("DROP TABLE temp.%s" % RELATED_BOOKS_MEMBERS_TABLE)
+
+    for (group_name,) in removed_groups:
+        del group_hashes[group_name]
+    group_hashes.update(new_hashes)
+
+    debug(
+        "categories=%d, unchanged=%d, books=%d, related books written=%d"
+        % (categories_count, len(unchanged_groups), books_count, tabs_count)
+    )
+    return RelatedBooksResult(
+        categories_count, len(unchanged_groups), books_count, tabs_count, group_hashes
+    )
+
+
+def _group_hash(content_ids: list[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(content_ids)).encode("utf-8")).hexdigest()  # noqa: S324
+
+
+def auto_set_related_books(
+    device: KoboDevice, gui: ui.Main, dispatcher: Dispatcher
+) -> None:
+    """
+    Update the related books of all series or authors on the device in a
+    device job, using the type chosen the last time related books were set.
+    """
+    related_books_type = (
+        cfg.plugin_prefs.setRelatedBooksOptionsStore.relatedBooksType.value
+    )
+    options = SetRelatedBooksJobOptions(
+        device.db_path,
+        device.device_db_path,
+        device.is_db_copied,
+        related_books_type,
+        _get_group_hashes(device, related_books_type),
+    )
+    debug("options=", options)
+    desc = _("Updating related books")
+    gui.device_manager.create_job(
+        set_related_books_job,
+        dispatcher(
+            partial(
+                _set_related_books_completed,
+                device=device,
+                gui=gui,
+                related_books_type=related_books_type,
             )
-            progressbar.increment()
+        ),
+        description=desc,
+        args=[pickle.dumps(options)],
+    )
+    gui.status_bar.show_message(_("Kobo Utilities") + " - " + desc, 3000)
 
-            categories_count += 1
-            debug(
-                "related_type=%s, count=%d"
-                % (related_type["name"], related_type["count"])
+
+def set_related_books_job(
+    options_raw: bytes,
+    notification: Callable[[float, str], Any] = lambda _x, y: y,
+) -> RelatedBooksResult:
+    options: SetRelatedBooksJobOptions = pickle.loads(options_raw)  # noqa: S301
+    notification(0.1, _("Setting related books"))
+    connection = DeviceDatabaseConnection(
+        options.database_path, options.device_database_path, options.is_db_copied
+    )
+    try:
+        with connection:
+            related_books = _query_related_books_count(
+                connection, options.related_books_type
             )
-            if related_type["count"] <= 1:
-                continue
-            related_type_data = (related_type["name"],)
-            debug("related_type_data:", related_type_data)
-            cursor.execute(get_query, related_type_data)
-            related_type_contentIds = []
-            for i, row in enumerate(cursor):
-                debug(
-                    "row:",
-                    i,
-                    row["ContentID"],
-                    row["Title"],
-                    row["Attribution"],
-                    row["Series"],
-                    row["SeriesNumber"],
-                )
-                related_type_contentIds.append(row["ContentID"])
-
-            debug("related_type_contentIds:", related_type_contentIds)
-            for tab_contentId in related_type_contentIds:
-                cursor.execute(delete_query, (tab_contentId,))
-                books_count += 1
-                for volume_contentId in related_type_contentIds:
-                    if tab_contentId != volume_contentId:
-                        insert_data = (volume_contentId, tab_contentId)
-                        debug("insert_data:", insert_data)
-                        cursor.execute(insert_query, insert_data)
+            return _update_related_books(
+                connection,
+                related_books,
+                options.related_books_type,
+                options.group_hashes,
+            )
+    finally:
+        connection.close()
 
-    progressbar.hide()
-    debug("end")
-    return categories_count, books_count
+
+def _set_related_books_completed(
+    job: DeviceJob, device: KoboDevice, gui: ui.Main, related_books_type: int
+) -> None:
+    if job.failed:
+        gui.job_exception(job, dialog_title=_("Failed to update related books"))
+        return
+    result: RelatedBooksResult = job.result
+    # Only remember the groups once the changes have been committed
+    _save_group_hashes(device, related_books_type, result.group_hashes)
+    gui.status_bar.show_message(
+        _("Kobo Utilities")
+        + " - "
+        + _(
+            "Related books updated for {0} books, {1} series or authors unchanged"
+        ).format(result.books_count, result.unchanged_count),
+        3000,
+    )
 
 
 def _delete_related_books(device: KoboDevice, gui: ui.Main) -> None:
@@ -212,6 +453,9 @@ def _delete_related_books(device: KoboDevice, gui: ui.Main) -> None:
     progressbar.increment()
 
     cursor.execute(delete_query)
+    state = JSONConfig(RELATED_BOOKS_STATE_FILE)
+    if device.version_info.serial_no in state:
+        del state[device.version_info.serial_no]
 
     progressbar.hide()
     debug("end")
@@ -316,6 +560,19 @@ class SetRelatedBooksDialog(PluginDialog):
         ]
         table_layout.addWidget(self.related_types_table)
 
+        self.update_on_connect_checkbox = QCheckBox(
+            _("Update related books when the device is connected"), self
+        )
+        self.update_on_connect_checkbox.setToolTip(
+            _(
+                "Update the related books for all series or authors each time the device is connected. Only series or authors whose books have changed are updated."
+            )
+        )
+        self.update_on_connect_checkbox.setChecked(
+            cfg.plugin_prefs.setRelatedBooksOptionsStore.updateOnConnect
+        )
+        layout.addWidget(self.update_on_connect_checkbox)
+
         # Dialog buttons
         button_box = QDialogButtonBox(
             QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
@@ -343,9 +600,9 @@ class SetRelatedBooksDialog(PluginDialog):
         layout.addWidget(button_box)
 
     def _ok_clicked(self):
-        cfg.plugin_prefs.setRelatedBooksOptionsStore.relatedBooksType = (
-            cfg.RelatedBooksType(self.related_category)
-        )
+        with cfg.plugin_prefs.setRelatedBooksOptionsStore as options:
+            options.relatedBooksType = cfg.RelatedBooksType(self.related_category)
+            options.updateOnConnect = self.update_on_connect_checkbox.isChecked()
         self.accept()
         return
 
@@ -2,12 +2,14 @@ from __future__ import annotations
 
 import os
 import pickle
+import re
 import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import partial
 from typing import TYPE_CHECKING, Any, Callable, cast
 
-from calibre.ebooks.BeautifulSoup import BeautifulStoneSoup
 from calibre.ebooks.metadata import authors_to_string
 from calibre.gui2 import info_dialog
 from qt.core import (
@@ -37,6 +39,13 @@ if TYPE_CHECKING:
     from ..utils import Dispatcher, LoadResources
 
 
+# The start tag of an annotation element, but not of the annotationSet root
+ANNOTATION_START_RE = re.compile(rb"<annotation[\s/>]")
+ANNOTATION_START_OVERLAP = len(b"<annotation ") - 1
+ANNOTATION_READ_SIZE = 64 * 1024
+ANNOTATION_CHECK_THREADS = 8
+
+
 @dataclass
 class RemoveAnnotationsJobOptions:
     annotations_dir: str
@@ -201,13 +210,11 @@ def remove_annotations_job(
         current_step += 1
         notification(current_step / steps, _("Removing annotations files"))
         debug("Removing annotations files")
-        annotation_files_names = set(annotation_files.keys())
+        annotation_files_by_dir: dict[str, list[str]] = defaultdict(list)
+        for filename, path in annotation_files.items():
+            annotation_files_by_dir[path].append(filename)
         removed_annotation_files = utils.remove_extra_files(
-            annotation_files_names,
-            annotation_files,
-            True,
-            annotations_dir,
-            images_tree=True,
+            annotation_files_by_dir, True, prune_empty_dirs=True
         )
         msg = _("{0} annotations files removed.").format(len(removed_annotation_files))
 
@@ -275,13 +282,20 @@ def _check_annotation_files(
     device_path: str,
     annotation_test_func: Callable[[str, str, str, str], bool],
 ) -> dict[str, str]:
-    annotation_files_to_remove = {}
-    for filename in annotation_files:
-        debug("filename='%s', path='%s'" % (filename, annotation_files[filename]))
-        file_path = annotation_files[filename]
-        if annotation_test_func(filename, file_path, annotations_dir, device_path):
-            debug("annotation to be removed=", filename)
-            annotation_files_to_remove[filename] = file_path
+    # The checks mostly wait for the device, so they are run in parallel
+    with ThreadPoolExecutor(max_workers=ANNOTATION_CHECK_THREADS) as executor:
+        results = executor.map(
+            lambda item: annotation_test_func(
+                item[0], item[1], annotations_dir, device_path
+            ),
+            annotation_files.items(),
+        )
+        annotation_files_to_remove = {}
+        for (filename, file_path), to_remove in zip(annotation_files.items(), results):
+            debug("filename='%s', path='%s'" % (filename, file_path))
+            if to_remove:
+                debug("annotation to be removed=", filename)
+                annotation_files_to_remove[filename] = file_path
 
     return annotation_files_to_remove
 
@@ -318,11 +332,19 @@ def _annotation_file_is_not_empty(
     del annotations_dir, device_path
     debug("annotation_filename=", annotation_filename)
     annotation_filepath = os.path.join(annotation_path, annotation_filename)
-    with open(annotation_filepath) as annotation_file:
-        soup = BeautifulStoneSoup(annotation_file.read())
-        annotation = soup.find("annotation")
-
-    return annotation is not None
+    # Only look for the start of the first annotation element instead of
+    # parsing the file. The end of each chunk is kept in case the tag is
+    # split between two chunks.
+    overlap = b""
+    with open(annotation_filepath, "rb") as annotation_file:
+        while True:
+            chunk = annotation_file.read(ANNOTATION_READ_SIZE)
+            if not chunk:
+                return False
+            data = overlap + chunk
+            if ANNOTATION_START_RE.search(data) is not None:
+                return True
+            overlap = data[-ANNOTATION_START_OVERLAP:]
 
 
 class RemoveAnnotationsProgressDialog(QProgressDialog):
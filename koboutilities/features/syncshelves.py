@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from calibre import strftime
+from calibre.gui2 import error_dialog, info_dialog, question_dialog
+from calibre.utils.config import JSONConfig
+
+from .. import config as cfg
+from .. import utils
+from ..constants import BOOK_CONTENTTYPE
+from ..dialogs import ProgressBar
+from ..utils import debug
+from .getshelves import get_device_shelves
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+    import apsw
+    from calibre.gui2 import ui
+
+    from ..config import KoboDevice
+    from ..utils import Dispatcher, LoadResources
+
+# Collections of each book after the last sync, by device serial number
+SYNC_STATE_FILE = "plugins/Kobo Utilities collection sync"
+# Database version from which the calibre driver sets the Id and Type of new
+# collections
+SHELF_ID_DBVERSION = 64
+
+
+@dataclass
+class ShelfSyncPlan:
+    # New value of the collections column for each changed book
+    library_values: dict[int, list[str]] = field(default_factory=dict)
+    # (ShelfName, ContentId) pairs to add to or remove from the device
+    device_adds: list[tuple[str, str]] = field(default_factory=list)
+    device_removes: list[tuple[str, str]] = field(default_factory=list)
+    # Collections of each book once the plan has been applied
+    synced: dict[str, list[str]] = field(default_factory=dict)
+    unchanged_books: int = 0
+
+
+def sync_shelves_with_device(
+    device: KoboDevice,
+    gui: ui.Main,
+    dispatcher: Dispatcher,
+    load_resources: LoadResources,
+) -> None:
+    del dispatcher, load_resources
+    library_db = gui.current_db
+    shelves_column = cfg.get_library_config(library_db).shelvesColumn
+    if not shelves_column:
+        error_dialog(
+            gui,
+            _("No collection column selected"),
+            _(
+                'Select the column for the collections with "Get collections from device" before syncing them.'
+            ),
+            show=True,
+            show_copy_button=False,
+        )
+        return
+
+    message = _(
+        "Collections added or removed in column {0} since the last sync will be added or removed on the device, and changes on the device will be copied to the column."
+    ).format(shelves_column)
+    if shelves_column in device.driver.get_collections_attributes():
+        message += "\n\n" + _(
+            "The column is one of the columns used in the driver configuration for collection management. The driver might change the collections the next time you connect the device."
+        )
+    if not question_dialog(
+        gui, _("Sync collections with device"), message, show_copy_button=False
+    ):
+        return
+
+    progressbar = ProgressBar(parent=gui, window_title=_("Sync collections"))
+    progressbar.show()
+    progressbar.set_label(_("Getting list of books on the device"))
+    book_ids = library_db.search_getting_ids(
+        "ondevice:True", None, sort_results=False, use_virtual_library=False
+    )
+    device_books = utils.get_books_from_ids(book_ids, gui)
+    library_shelves = library_db.new_api.all_field_for(shelves_column, book_ids)
+    books = [
+        (
+            book_id,
+            [
+                utils.contentid_from_path(device, book.path, BOOK_CONTENTTYPE)
+                for book in device_books[book_id]
+            ],
+            _split_shelf_names(library_shelves.get(book_id)),
+        )
+        for book_id in book_ids
+        if book_id in device_books
+    ]
+
+    progressbar.set_label(_("Comparing collections"))
+    state = JSONConfig(SYNC_STATE_FILE)
+    serial_no = device.version_info.serial_no
+    device_state = state.get(serial_no, {})
+    last_synced = (
+        device_state.get("books", {})
+        if device_state.get("column") == shelves_column
+        else {}
+    )
+
+    with utils.device_database_connection(device) as connection:
+        device_shelves = get_device_shelves(
+            connection,
+            [
+                content_id
+                for _book_id, content_ids, _names in books
+                for content_id in content_ids
+            ],
+        )
+        plan = plan_shelf_sync(books, device_shelves, last_synced)
+        progressbar.set_label(_("Updating collections on the device"))
+        apply_device_changes(
+            connection,
+            plan,
+            strftime(device.timestamp_string, time.gmtime()),
+            device.driver.dbversion,
+        )
+
+    if plan.library_values:
+        progressbar.set_label(_("Updating collections in the library"))
+        is_multiple = bool(library_db.field_metadata[shelves_column]["is_multiple"])
+        library_db.new_api.set_field(
+            shelves_column,
+            {
+                book_id: names if is_multiple else ", ".join(names)
+                for book_id, names in plan.library_values.items()
+            },
+        )
+        gui.iactions["Edit Metadata"].refresh_gui(list(plan.library_values))
+
+    # The state is only saved once both sides have been updated
+    state[serial_no] = {
+        "column": shelves_column,
+        "books": {**last_synced, **plan.synced},
+    }
+    progressbar.hide()
+
+    result_message = (
+        _("Update summary:")
+        + "\n\t"
+        + _(
+            "Books on device={0}\n\tUnchanged books={1}\n\tBooks updated in library={2}\n\tAdded to collections on device={3}\n\tRemoved from collections on device={4}"
+        ).format(
+            len(books),
+            plan.unchanged_books,
+            len(plan.library_values),
+            len(plan.device_adds),
+            len(plan.device_removes),
+        )
+    )
+    info_dialog(
+        gui,
+        _("Kobo Utilities") + " - " + _("Sync collections with device"),
+        result_message,
+        show=True,
+    )
+
+
+def plan_shelf_sync(
+    books: Iterable[tuple[int, list[str], list[str]]],
+    device_shelves: dict[str, list[str]],
+    last_synced: dict[str, list[str]],
+) -> ShelfSyncPlan:
+    """
+    Work out the changes needed to bring the collections of the books in the
+    library and on the device together. books is a list of (calibre id,
+    ContentIDs, collections in the library). A collection added or removed
+    on either side since the last sync is added or removed on the other.
+    Without an earlier sync nothing is removed.
+    """
+    plan = ShelfSyncPlan()
+    for book_id, content_ids, library_names in books:
+        if not content_ids:
+            continue
+        library = set(library_names)
+        on_device = set()
+        for content_id in content_ids:
+            on_device.update(device_shelves.get(content_id, []))
+        if any(content_id in last_synced for content_id in content_ids):
+            base = set()
+            for content_id in content_ids:
+                base.update(last_synced.get(content_id, []))
+        else:
+            base = library & on_device
+
+        if library == base and on_device == base:
+            plan.unchanged_books += 1
+            for content_id in content_ids:
+                plan.synced[content_id] = sorted(base)
+            continue
+
+        removed = (base - library) | (base - on_device)
+        result = (base | library | on_device) - removed
+        if result != library:
+            plan.library_values[book_id] = sorted(result)
+        for content_id in content_ids:
+            current = set(device_shelves.get(content_id, []))
+            plan.device_adds.extend(
+                (name, content_id) for name in sorted(result - current)
+            )
+            plan.device_removes.extend(
+                (name, content_id) for name in sorted(current - result)
+            )
+            plan.synced[content_id] = sorted(result)
+
+    debug(
+        "library changes=%d, device adds=%d, device removes=%d, unchanged=%d"
+        % (
+            len(plan.library_values),
+            len(plan.device_adds),
+            len(plan.device_removes),
+            plan.unchanged_books,
+        )
+    )
+    return plan
+
+
+def apply_device_changes(
+    connection: apsw.Connection, plan: ShelfSyncPlan, timestamp: str, dbversion: int
+) -> None:
+    """
+    Write the device side of a plan. Rows that have been synced with the Kobo
+    server are marked as deleted so the server removes them too, rows it has
+    never seen are deleted. Missing collections are created the same way the
+    calibre driver creates them, or restored if they were deleted.
+    """
+    if not (plan.device_adds or plan.device_removes):
+        return
+
+    shelf_names = {name for name, _content_id in plan.device_adds}
+    active_shelves = {
+        row[0]
+        for row in connection.execute(
+            "SELECT DISTINCT Name FROM Shelf WHERE _IsDeleted = 'false'"
+        )
+    }
+    deleted_shelves: dict[str, Any] = {
+        row[0]: row[1]
+        for row in connection.execute(
+            "SELECT Name, MAX(Id) FROM Shelf WHERE _IsDeleted = 'true' GROUP BY Name"
+        )
+    }
+    missing_shelves = sorted(shelf_names - active_shelves)
+    connection.executemany(
+        "UPDATE Shelf "
+        "SET _IsDeleted = 'false', _IsSynced = 'false', LastModified = ? "
+        "WHERE Id = ?",
+        [
+            (timestamp, deleted_shelves[name])
+            for name in missing_shelves
+            if name in deleted_shelves
+        ],
+    )
+    new_shelves = [name for name in missing_shelves if name not in deleted_shelves]
+    if dbversion < SHELF_ID_DBVERSION:
+        connection.executemany(
+            "INSERT INTO Shelf "
+            "(CreationDate, InternalName, LastModified, Name, "
+            "_IsDeleted, _IsVisible, _IsSynced) "
+            "VALUES (?, ?, ?, ?, 'false', 'true', 'false')",
+            [(timestamp, name, timestamp, name) for name in new_shelves],
+        )
+    else:
+        connection.executemany(
+            "INSERT INTO Shelf "
+            "(CreationDate, InternalName, LastModified, Name, "
+            "_IsDeleted, _IsVisible, _IsSynced, Id, Type) "
+            "VALUES (?, ?, ?, ?, 'false', 'true', 'false', ?, 'UserTag')",
+            [(timestamp, name, timestamp, name, name) for name in new_shelves],
+        )
+
+    connection.executemany(
+        "INSERT INTO ShelfContent "
+        "(ShelfName, ContentId, DateModified, _IsDeleted, _IsSynced) "
+        "VALUES (?, ?, ?, 'false', 'false') "
+        "ON CONFLICT (ShelfName, ContentId) DO UPDATE SET "
+        "DateModified = excluded.DateModified, "
+        "_IsDeleted = 'false', "
+        "_IsSynced = 'false'",
+        [(name, content_id, timestamp) for name, content_id in plan.device_adds],
+    )
+    connection.executemany(
+        "DELETE FROM ShelfContent "
+        "WHERE ShelfName = ? AND ContentId = ? AND _IsSynced = 'false'",
+        plan.device_removes,
+    )
+    connection.executemany(
+        "UPDATE ShelfContent "
+        "SET _IsDeleted = 'true', _IsSynced = 'false', DateModified = ? "
+        "WHERE ShelfName = ? AND ContentId = ? AND _IsSynced = 'true'",
+        [(timestamp, name, content_id) for name, content_id in plan.device_removes],
+    )
+
+    # The Kobo server picks up changed collections by their modification time
+    changed_shelves = shelf_names | {name for name, _content_id in plan.device_removes}
+    connection.executemany(
+        "UPDATE Shelf SET LastModified = ?, _IsSynced = 'false' "
+        "WHERE Name = ? AND _IsDeleted = 'false'",
+        [(timestamp, name) for name in sorted(changed_shelves)],
+    )
+
+
+def _split_shelf_names(value: list[str] | str | None) -> list[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [name.strip() for name in value.split(",") if name.strip()]
+    return list(value)
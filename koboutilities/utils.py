@@ -9,7 +9,6 @@ __docformat__ = "restructuredtext en"
 import datetime as dt
 import inspect
 import os
-import re
 from collections import defaultdict
 from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, cast
 
@@ -210,6 +209,10 @@ def check_device_database(database_path: str):
     connection = DeviceDatabaseConnection(
         database_path, database_path, is_db_copied=False
     )
+    return check_database_integrity(connection)
+
+
+def check_database_integrity(connection: apsw.Connection) -> str:
     check_query = "PRAGMA integrity_check"
     cursor = connection.cursor()
 
@@ -226,6 +229,22 @@ def check_device_database(database_path: str):
     return check_result
 
 
+def fill_temp_content_ids(
+    connection: apsw.Connection, table_name: str, content_ids: Iterable[str]
+) -> None:
+    """
+    Put content_ids into a temporary table with a ContentID column, so a
+    selection of books can be read with a single join instead of running
+    a query for every book. An existing table with the name is replaced.
+    """
+    connection.execute("DROP TABLE IF EXISTS temp.%s" % table_name)
+    connection.execute("CREATE TEMP TABLE %s (ContentID TEXT PRIMARY KEY)" % table_name)
+    connection.executemany(
+        "INSERT OR IGNORE INTO temp.%s VALUES (?)" % table_name,  # noqa: S608
+        ((content_id,) for content_id in content_ids),
+    )
+
+
 def convert_kobo_date(kobo_date: str | None) -> dt.datetime | None:
     if kobo_date is None:
         return None
@@ -416,37 +435,40 @@ def contentid_from_path(device: KoboDevice, path: str, content_type: int):
 
 
 def remove_extra_files(
-    extra_imageids_files: set[str],
-    imageids_files: dict[str, str],
-    delete_extra_covers: bool,
-    image_path: str,
-    images_tree: bool = False,
+    extra_files: dict[str, list[str]],
+    delete_extra_files: bool,
+    prune_empty_dirs: bool = False,
 ) -> list[str]:
-    extra_image_files = []
-    from glob import glob
-
-    debug("images_tree=%s" % (images_tree))
-    for imageId in extra_imageids_files:
-        image_path = imageids_files[imageId]
-        debug("image_path=%s" % (image_path))
-        debug("imageId=%s" % (imageId))
-        escaped_path = os.path.join(image_path, imageId + "*")
-        escaped_path = re.sub(r"([\[\]])", r"[\1]", escaped_path)
-        debug("escaped_path:", escaped_path)
-        for filename in glob(escaped_path):
-            debug("filename=%s" % (filename))
-            extra_image_files.append(os.path.basename(filename))
-            if delete_extra_covers:
-                os.unlink(filename)
-        if images_tree and delete_extra_covers:
-            debug("about to remove directory: image_path=%s" % image_path)
+    """
+    Remove files from the device.
+
+    `extra_files` maps each directory to the exact names of the files in it
+    that should be removed, as found while scanning the directory tree. If
+    `prune_empty_dirs` is set, directories that are empty after the deletion
+    are removed afterwards, along with any parents that become empty.
+    """
+    extra_file_names = []
+
+    debug("directories=%d, prune_empty_dirs=%s" % (len(extra_files), prune_empty_dirs))
+    for path, filenames in extra_files.items():
+        extra_file_names.extend(filenames)
+        if not delete_extra_files:
+            continue
+        for filename in filenames:
+            os.unlink(os.path.join(path, filename))
+
+    if prune_empty_dirs and delete_extra_files:
+        # Deepest directories first so that emptied parents can be removed as well
+        for path in sorted(extra_files, key=len, reverse=True):
+            if not os.path.isdir(path):
+                continue
             try:
-                os.removedirs(image_path)
-                debug("removed path=%s" % (image_path))
-            except Exception as e:
+                os.removedirs(path)
+                debug("removed path=%s" % (path))
+            except OSError as e:
                 debug("removed path exception=", e)
 
-    return extra_image_files
+    return extra_file_names
 
 
 def value_changed(old_value: Any | None, new_value: Any | None) -> bool:
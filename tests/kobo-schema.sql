@@ -109,3 +109,25 @@ CREATE TABLE ratings (
     DateModified TEXT NOT NULL,
     PRIMARY KEY(ContentID)
 );
+CREATE TABLE Shelf (
+    CreationDate TEXT,
+    Id TEXT,
+    InternalName TEXT,
+    LastModified TEXT,
+    Name TEXT,
+    Type TEXT,
+    _IsDeleted BOOL,
+    _IsVisible BOOL,
+    _IsSynced BOOL,
+    _SyncTime TEXT,
+    LastAccessed TEXT,
+    PRIMARY KEY (Id)
+);
+CREATE TABLE ShelfContent (
+    ShelfName TEXT,
+    ContentId TEXT,
+    DateModified TEXT,
+    _IsDeleted BOOL,
+    _IsSynced BOOL,
+    PRIMARY KEY (ShelfName, ContentId)
+);
@@ -0,0 +1,99 @@
+# ruff: noqa: INP001, PT009
+from __future__ import annotations
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import apsw
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path = [test_dir, *sys.path]
+
+if TYPE_CHECKING:
+    from ..koboutilities.features import backupdiff
+else:
+    from calibre_plugins.koboutilities.features import backupdiff
+
+
+def create_database() -> apsw.Connection:
+    connection = apsw.Connection(":memory:")
+    connection.execute(Path(test_dir, "kobo-schema.sql").read_text())
+    return connection
+
+
+def insert_content(
+    connection: apsw.Connection, content_id: str, content_type: int, read_status: int
+) -> None:
+    connection.execute(
+        "INSERT INTO content (ContentID, ContentType, MimeType, ___UserID, ReadStatus) "
+        "VALUES (?, ?, 'application/epub+zip', 'user', ?)",
+        (content_id, content_type, read_status),
+    )
+
+
+class TestBackupDiff(unittest.TestCase):
+    def diff(
+        self, old: apsw.Connection, new: apsw.Connection
+    ) -> dict[str, backupdiff.TableDiff]:
+        connection = backupdiff.open_diff_connection()
+        backupdiff.attach_database_content(
+            connection, backupdiff.OLD_SCHEMA, old.serialize("main")
+        )
+        backupdiff.attach_database_content(
+            connection, backupdiff.NEW_SCHEMA, new.serialize("main")
+        )
+        return {diff.table: diff for diff in backupdiff.diff_databases(connection)}
+
+    def test_identical(self) -> None:
+        old = create_database()
+        insert_content(old, "book", 6, 1)
+        diffs = self.diff(old, old)
+        self.assertTrue(diffs["content"].is_empty)
+        self.assertTrue(diffs["Shelf"].is_empty)
+
+    def test_content_books_only(self) -> None:
+        old = create_database()
+        new = create_database()
+        insert_content(old, "changed", 6, 0)
+        insert_content(new, "changed", 6, 2)
+        insert_content(old, "removed", 6, 0)
+        insert_content(new, "added", 6, 0)
+        insert_content(old, "chapter", 9, 0)
+        insert_content(new, "chapter", 9, 2)
+
+        diff = self.diff(old, new)["content"]
+        self.assertEqual(diff.added, [("added",)])
+        self.assertEqual(diff.removed, [("removed",)])
+        self.assertEqual(diff.changed, {("changed",): {"ReadStatus": (0, 2)}})
+
+    def test_shelves(self) -> None:
+        old = create_database()
+        new = create_database()
+        for connection in (old, new):
+            connection.execute(
+                "INSERT INTO Shelf (CreationDate, Id, Name, _IsDeleted) "
+                "VALUES ('2020', 's1', 'A', 'false')"
+            )
+        new.execute("UPDATE Shelf SET _IsDeleted = 'true'")
+        new.execute(
+            "INSERT INTO ShelfContent (ShelfName, ContentId, _IsDeleted) "
+            "VALUES ('A', 'book', 'false')"
+        )
+
+        diffs = self.diff(old, new)
+        self.assertEqual(
+            diffs["Shelf"].changed, {("s1",): {"_IsDeleted": ("false", "true")}}
+        )
+        self.assertEqual(diffs["ShelfContent"].added, [("A", "book")])
+
+    def test_missing_table(self) -> None:
+        old = create_database()
+        diff = self.diff(old, old)["Bookmark"]
+        self.assertIsNotNone(diff.skipped)
+
+
+if __name__ == "__main__":
+    unittest.main(module=Path(__file__).stem, verbosity=2)
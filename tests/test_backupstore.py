@@ -0,0 +1,94 @@
+# ruff: noqa: INP001, PT009
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path = [test_dir, *sys.path]
+
+if TYPE_CHECKING:
+    from ..koboutilities.features import backupstore
+else:
+    from calibre_plugins.koboutilities.features import backupstore
+
+CHUNK_SIZE = backupstore.CHUNK_SIZE
+DATABASE_NAME = ".kobo/KoboReader.sqlite"
+
+
+class TestBackupStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = backupstore.BackupStore(os.path.join(self.tmp_dir.name, "store"))
+        # Four full chunks and a partial one
+        self.database = os.urandom(4 * CHUNK_SIZE + 1000)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def chunk_names(self) -> set[str]:
+        return {path.name for path in Path(self.store.chunks_path).glob("*/*")}
+
+    def test_restore_is_identical(self) -> None:
+        config = b"[Reading]\nreadingFontFamily=Georgia\n"
+        self.store.add_backup(
+            "backup1", [(DATABASE_NAME, self.database), ("Kobo eReader.conf", config)]
+        )
+
+        target_dir = os.path.join(self.tmp_dir.name, "restore")
+        restored = self.store.restore("backup1", target_dir)
+
+        self.assertEqual(
+            restored,
+            [
+                os.path.join(target_dir, ".kobo", "KoboReader.sqlite"),
+                os.path.join(target_dir, "Kobo eReader.conf"),
+            ],
+        )
+        self.assertEqual(Path(restored[0]).read_bytes(), self.database)
+        self.assertEqual(Path(restored[1]).read_bytes(), config)
+        self.assertEqual(self.store.read_file("backup1", DATABASE_NAME), self.database)
+        with self.assertRaises(backupstore.BackupStoreError):  # noqa: PT027
+            self.store.read_file("backup1", "missing")
+
+    def test_only_changed_chunks_are_written(self) -> None:
+        self.assertGreater(
+            self.store.add_backup("backup1", [(DATABASE_NAME, self.database)]), 0
+        )
+        self.assertEqual(len(self.chunk_names()), 5)
+
+        changed = bytearray(self.database)
+        changed[2 * CHUNK_SIZE + 10] ^= 0xFF
+        bytes_written = self.store.add_backup("backup2", [(DATABASE_NAME, changed)])
+
+        self.assertEqual(len(self.chunk_names()), 6)
+        self.assertGreater(bytes_written, 0)
+        self.assertLess(bytes_written, 2 * CHUNK_SIZE)
+        self.assertEqual(self.store.backup_names(), ["backup1", "backup2"])
+        self.assertEqual(self.store.read_file("backup2", DATABASE_NAME), changed)
+        self.assertEqual(
+            self.store.add_backup("backup3", [(DATABASE_NAME, changed)]), 0
+        )
+
+    def test_remove_backups_keeps_shared_chunks(self) -> None:
+        self.store.add_backup("backup1", [(DATABASE_NAME, self.database)])
+        changed = self.database[: 3 * CHUNK_SIZE] + os.urandom(CHUNK_SIZE)
+        self.store.add_backup("backup2", [(DATABASE_NAME, changed)])
+        backup1_chunks = set(self.store.read_manifest("backup1")["files"][0]["chunks"])
+        backup2_chunks = set(self.store.read_manifest("backup2")["files"][0]["chunks"])
+
+        removed = self.store.remove_backups(["backup1"])
+
+        self.assertEqual(removed, len(backup1_chunks - backup2_chunks))
+        self.assertEqual(self.chunk_names(), backup2_chunks)
+        self.assertEqual(self.store.backup_names(), ["backup2"])
+        self.assertEqual(self.store.read_file("backup2", DATABASE_NAME), changed)
+        self.assertEqual(self.store.collect_garbage(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main(module=Path(__file__).stem, verbosity=2)
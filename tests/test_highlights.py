@@ -0,0 +1,80 @@
+# ruff: noqa: INP001, PT009
+from __future__ import annotations
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import apsw
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path = [test_dir, *sys.path]
+
+if TYPE_CHECKING:
+    from ..koboutilities.features import highlights
+else:
+    from calibre_plugins.koboutilities.features import highlights
+
+BOOKMARK_SCHEMA = """
+CREATE TABLE Bookmark (
+    BookmarkID TEXT NOT NULL,
+    VolumeID TEXT NOT NULL,
+    ContentID TEXT NOT NULL,
+    Text TEXT,
+    Annotation TEXT,
+    DateCreated TEXT,
+    DateModified TEXT,
+    PRIMARY KEY (BookmarkID)
+);
+"""
+
+
+class TestHighlightArchive(unittest.TestCase):
+    def setUp(self) -> None:
+        self.device = apsw.Connection(":memory:")
+        self.device.execute(Path(test_dir, "kobo-schema.sql").read_text())
+        self.device.execute(BOOKMARK_SCHEMA)
+        self.device.execute(
+            "INSERT INTO content (ContentID, ContentType, MimeType, ___UserID, Title, Attribution) "
+            "VALUES ('book', 6, 'application/epub+zip', 'user', 'Moby Dick', 'Herman Melville')"
+        )
+        self.device.execute(
+            "INSERT INTO Bookmark VALUES "
+            "('b1', 'book', 'book#1', 'Call me Ishmael', NULL, '2024-01-01T10:00:00.000', NULL), "
+            "('b2', 'book', 'book#2', NULL, NULL, '2024-01-02T10:00:00.000', NULL)"
+        )
+        self.archive = highlights.HighlightArchive(":memory:")
+
+    def tearDown(self) -> None:
+        self.archive.close()
+
+    def test_incremental_harvest(self) -> None:
+        self.assertEqual(self.archive.harvest_bookmarks("N1", "Libra", self.device), 1)
+        self.assertEqual(self.archive.harvest_bookmarks("N1", "Libra", self.device), 0)
+
+        self.device.execute(
+            "UPDATE Bookmark SET Annotation = 'The whale', "
+            "DateModified = '2024-02-01T00:00:00Z' WHERE BookmarkID = 'b1'"
+        )
+        self.assertEqual(self.archive.harvest_bookmarks("N1", "Libra", self.device), 1)
+        self.assertEqual(self.archive.count(), 1)
+
+    def test_search(self) -> None:
+        self.archive.harvest_bookmarks("N1", "Libra", self.device)
+        self.archive.harvest_bookmarks("N2", "Clara", self.device)
+
+        matches = self.archive.search("ishm")
+        self.assertEqual([match.device_name for match in matches], ["Libra", "Clara"])
+        self.assertEqual(matches[0].title, "Moby Dick")
+        self.assertEqual(len(self.archive.search("melville")), 2)
+        self.assertEqual(self.archive.search('"whale'), [])
+
+    def test_fts_query(self) -> None:
+        self.assertEqual(highlights.fts_query(' call  "me '), '"call" """me"*')
+        self.assertEqual(highlights.fts_query("  "), "")
+
+
+if __name__ == "__main__":
+    unittest.main(module=Path(__file__).stem, verbosity=2)
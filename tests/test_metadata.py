@@ -0,0 +1,35 @@
+# ruff: noqa: INP001, PT009
+from __future__ import annotations
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, cast
+
+from calibre.ebooks.metadata import MetaInformation
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path = [test_dir, *sys.path]
+
+if TYPE_CHECKING:
+    from ..koboutilities.features import metadata
+else:
+    from calibre_plugins.koboutilities.features import metadata
+
+
+class TestSynopsisRenderer(unittest.TestCase):
+    def test_template_is_compiled_once(self) -> None:
+        renderer = metadata._SynopsisRenderer("program: field('title')")
+
+        descriptions = []
+        for title in ("Moby Dick", "Emma"):
+            mi = MetaInformation(title, ["Author"])
+            descriptions.append(renderer.render(mi, cast("Any", mi)))
+
+        self.assertEqual(descriptions, ["Moby Dick", "Emma"])
+        self.assertEqual(list(renderer.template_cache), ["comments"])
+
+
+if __name__ == "__main__":
+    unittest.main(module=Path(__file__).stem, verbosity=2)
@@ -0,0 +1,108 @@
+# ruff: noqa: INP001, PT009
+from __future__ import annotations
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import apsw
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path = [test_dir, *sys.path]
+
+if TYPE_CHECKING:
+    from ..koboutilities.features import syncshelves
+else:
+    from calibre_plugins.koboutilities.features import syncshelves
+
+TIMESTAMP = "2025-01-01T00:00:00Z"
+DBVERSION = 170
+
+
+class TestPlanShelfSync(unittest.TestCase):
+    def test_first_sync_merges_both_sides(self) -> None:
+        plan = syncshelves.plan_shelf_sync(
+            [(1, ["book"], ["A", "B"])], {"book": ["B", "C"]}, {}
+        )
+        self.assertEqual(plan.library_values, {1: ["A", "B", "C"]})
+        self.assertEqual(plan.device_adds, [("A", "book")])
+        self.assertEqual(plan.device_removes, [])
+        self.assertEqual(plan.synced, {"book": ["A", "B", "C"]})
+
+    def test_removals_since_last_sync(self) -> None:
+        plan = syncshelves.plan_shelf_sync(
+            [(1, ["book"], ["B", "C"])], {"book": ["A", "C"]}, {"book": ["A", "B", "C"]}
+        )
+        self.assertEqual(plan.library_values, {1: ["C"]})
+        self.assertEqual(plan.device_removes, [("A", "book")])
+        self.assertEqual(plan.synced, {"book": ["C"]})
+
+    def test_unchanged(self) -> None:
+        plan = syncshelves.plan_shelf_sync(
+            [(1, ["book"], ["A"])], {"book": ["A"]}, {"book": ["A"]}
+        )
+        self.assertEqual(plan.unchanged_books, 1)
+        self.assertFalse(plan.library_values or plan.device_adds or plan.device_removes)
+
+
+class TestApplyDeviceChanges(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection = apsw.Connection(":memory:")
+        self.connection.execute(Path(test_dir, "kobo-schema.sql").read_text())
+        self.connection.execute(
+            "INSERT INTO Shelf "
+            "(CreationDate, Id, InternalName, LastModified, Name, "
+            "_IsDeleted, _IsVisible, _IsSynced) VALUES "
+            "('2020', 'deleted', 'A', '2020', 'A', 'true', 'true', 'true'), "
+            "('2020', 'b', 'B', '2020', 'B', 'false', 'true', 'true')"
+        )
+        self.connection.execute(
+            "INSERT INTO ShelfContent "
+            "(ShelfName, ContentId, DateModified, _IsDeleted, _IsSynced) VALUES "
+            "('B', 'synced', '2020', 'false', 'true'), "
+            "('B', 'local', '2020', 'false', 'false'), "
+            "('B', 'readded', '2020', 'true', 'true')"
+        )
+
+    def test_apply(self) -> None:
+        plan = syncshelves.ShelfSyncPlan(
+            device_adds=[("A", "book"), ("B", "readded"), ("C", "book")],
+            device_removes=[("B", "synced"), ("B", "local")],
+        )
+        syncshelves.apply_device_changes(self.connection, plan, TIMESTAMP, DBVERSION)
+
+        shelves = dict(
+            self.connection.execute("SELECT Name, _IsDeleted FROM Shelf").fetchall()
+        )
+        self.assertEqual(shelves, {"A": "false", "B": "false", "C": "false"})
+        self.assertEqual(
+            self.connection.execute("SELECT Id FROM Shelf WHERE Name = 'A'").fetchall(),
+            [("deleted",)],
+        )
+        self.assertEqual(
+            self.connection.execute(
+                "SELECT Id, InternalName, Type FROM Shelf WHERE Name = 'C'"
+            ).fetchall(),
+            [("C", "C", "UserTag")],
+        )
+        contents = {
+            (row[0], row[1]): (row[2], row[3])
+            for row in self.connection.execute(
+                "SELECT ShelfName, ContentId, _IsDeleted, _IsSynced FROM ShelfContent"
+            )
+        }
+        self.assertEqual(
+            contents,
+            {
+                ("A", "book"): ("false", "false"),
+                ("B", "readded"): ("false", "false"),
+                ("C", "book"): ("false", "false"),
+                ("B", "synced"): ("true", "false"),
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main(module=Path(__file__).stem, verbosity=2)